@@ -2,14 +2,11 @@
 Main control file for the robot control
 """
 
-from motor_control.calibrate import start_calibration_control
-from motor_control.manual_control import start_manual_control 
-from motor_control.test_wash import demo
-
 
 def main(answer: str):
     """
-    Control function for robot
+    Control function for robot. The chosen mode is imported here, so only
+    its hardware is loaded.
 
     :param answer: answer typed in by user via input
     :type answer: str
@@ -19,12 +16,18 @@ def main(answer: str):
             raise ValueError("Invalid input.")
 
         if answer == "c":
+            from motor_control.calibrate import start_calibration_control
+
             start_calibration_control()
 
         elif answer == "t":
+            from motor_control.test_wash import demo
+
             demo()
 
         elif answer == "m":
+            from motor_control.manual_control import start_manual_control
+
             start_manual_control()
 
     except Exception as e:
@@ -1,8 +1,7 @@
 """
 This is a package downloaded that is made for the driver
 """
-import RPi.GPIO as GPIO
-import time
+from .pulse_engine import constant_periods, default_backend
 
 MotorDir = [
     'forward',
@@ -14,25 +13,51 @@ ControlMode = [
     'softward',
 ]
 
+# Mode pin levels of every step format
+MicroStep = {'fullstep': (0, 0, 0),
+             'halfstep': (1, 0, 0),
+             '1/4step': (0, 1, 0),
+             '1/8step': (1, 1, 0),
+             '1/16step': (0, 0, 1),
+             '1/32step': (1, 0, 1)}
+
 class DRV8825():
-    def __init__(self, dir_pin, step_pin, enable_pin, mode_pins):
+    def __init__(self, dir_pin, step_pin, enable_pin, mode_pins, pulse_backend=None, gpio=None):
         self.dir_pin = dir_pin
         self.step_pin = step_pin        
         self.enable_pin = enable_pin
         self.mode_pins = mode_pins
+        # RPi.GPIO compatible module, the simulated rig passes its own
+        if gpio is None:
+            # Imported on first use, it only exists on the Pi
+            import RPi.GPIO as gpio
+        self.gpio = gpio
         
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(self.dir_pin, GPIO.OUT)
-        GPIO.setup(self.step_pin, GPIO.OUT)
-        GPIO.setup(self.enable_pin, GPIO.OUT)
-        GPIO.setup(self.mode_pins, GPIO.OUT)
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setwarnings(False)
+        self.gpio.setup(self.dir_pin, self.gpio.OUT)
+        self.gpio.setup(self.enable_pin, self.gpio.OUT)
+        self.gpio.setup(self.mode_pins, self.gpio.OUT)
+
+        # The step pin is owned by the pulse backend, which times the pulses
+        if pulse_backend is None:
+            pulse_backend = default_backend(
+                self.digital_write, lambda pin: self.gpio.setup(pin, self.gpio.OUT), self.gpio.cleanup
+            )
+        self.pulse_backend = pulse_backend
+        self.pulse_backend.claim(self.step_pin)
         
     def digital_write(self, pin, value):
-        GPIO.output(pin, value)
+        self.gpio.output(pin, value)
         
     def Stop(self):
         self.digital_write(self.enable_pin, 0)
+
+    def Close(self):
+        """Disables the driver and releases its pins, the step pin through the pulse backend"""
+        self.Stop()
+        self.pulse_backend.release(self.step_pin)
+        self.gpio.cleanup([self.dir_pin, self.enable_pin] + list(self.mode_pins))
     
     def SetMicroStep(self, mode, stepformat):
         """
@@ -43,19 +68,23 @@ class DRV8825():
         (2) stepformat
             ('fullstep', 'halfstep', '1/4step', '1/8step', '1/16step', '1/32step')
         """
-        microstep = {'fullstep': (0, 0, 0),
-                     'halfstep': (1, 0, 0),
-                     '1/4step': (0, 1, 0),
-                     '1/8step': (1, 1, 0),
-                     '1/16step': (0, 0, 1),
-                     '1/32step': (1, 0, 1)}
-
         print ("Control mode:", mode)
         if (mode == ControlMode[1]):
             print ("set pins")
-            self.digital_write(self.mode_pins, microstep[stepformat])
+            self.SetStepFormat(stepformat)
+
+    def SetStepFormat(self, stepformat):
+        """
+        Sets the microstep pins to stepformat without printing, for switching
+        between moves. Only call while no pulses are output.
+        """
+        self.digital_write(self.mode_pins, MicroStep[stepformat])
         
-    def TurnStep(self, Dir, steps, stepdelay=0.005):
+    def SetDirection(self, Dir):
+        """
+        Enables the driver and sets the dir pin. Returns False (and disables
+        the driver) when Dir is not 'forward' or 'backward'.
+        """
         if (Dir == MotorDir[0]):
             # print ("forward")
             self.digital_write(self.enable_pin, 1)
@@ -67,14 +96,41 @@ class DRV8825():
         else:
             print ("the dir must be : 'forward' or 'backward'")
             self.digital_write(self.enable_pin, 0)
-            return
+            return False
+        return True
+
+    def StartPulses(self, Dir, periods, delay=0.0):
+        """
+        Hands a whole move to the pulse backend and returns immediately.
 
-        if (steps == 0):
-            return
-            
-        # print ("turn step:",steps)
-        for i in range(steps):
-            self.digital_write(self.step_pin, True)
-            time.sleep(stepdelay)
-            self.digital_write(self.step_pin, False)
-            time.sleep(stepdelay)
+        :param Dir: 'forward' or 'backward'
+        :param periods: step periods in seconds, one per step
+        :param delay: seconds before the first step
+        :return: PulseTrain handle that can be waited on or aborted, None for an invalid Dir
+        """
+        if not self.SetDirection(Dir):
+            return None
+        return self.pulse_backend.start(self.step_pin, periods, delay)
+
+    def StartTurn(self, Dir, steps, stepdelay=0.005):
+        """
+        Non-blocking TurnStep, returns the PulseTrain handle of the move.
+        """
+        return self.StartPulses(Dir, constant_periods(steps, 2 * stepdelay))
+
+    def StartProfile(self, Dir, profile):
+        """
+        Starts a move planned by motion_planner.plan_move, returns the PulseTrain handle.
+        """
+        return self.StartPulses(Dir, profile.intervals)
+
+    def TurnStep(self, Dir, steps, stepdelay=0.005):
+        """
+        Turns steps steps with stepdelay seconds high and low per step.
+        Blocks until the move is done and returns the number of steps output.
+        """
+        train = self.StartTurn(Dir, steps, stepdelay)
+        if train is None:
+            return 0
+        train.wait()
+        return train.steps_done
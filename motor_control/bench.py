@@ -0,0 +1,276 @@
+"""
+Step rate and jitter benchmark for the pulse backends.
+
+For every backend and requested step period a train of pulses is output and
+measured: achieved step frequency, the distribution of the period between
+rising edges (p50/p99/max), CPU usage of the process and how long start()
+took to return. 'legacy' is the old TurnStep loop with two time.sleep calls
+per step, for comparison.
+
+Runs on a dev machine against the mock backends (recording, python, legacy)
+and on the rig against real pins (rpigpio, gpiozero, lgpio). The motor on the
+benchmark pin moves if its driver is enabled. The lgpio backend times pulses
+outside Python; to measure its edges, wire the step pin to a free input pin
+and pass it as --loopback.
+
+Usage:
+    python -m motor_control.bench --backends python,legacy --json bench.json
+    python -m motor_control.bench --backends lgpio --loopback 25 --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+
+from .pulse_engine import (
+    LgpioPulseBackend,
+    PulseTrain,
+    RecordingPulseBackend,
+    ThreadPulseBackend,
+    constant_periods,
+)
+
+# Requested step periods in microseconds
+DEFAULT_PERIODS_US = [1000, 200, 100, 50, 20, 10, 5]
+DEFAULT_STEPS = 2000
+DEFAULT_PIN = 18  # STEP pin of the X axis driver
+
+# A result is a regression when its frequency drops more than this fraction below the baseline
+REGRESSION_TOLERANCE = 0.10
+
+
+class LegacyLoopBackend:
+    """
+    The original DRV8825.TurnStep loop: pin high, sleep, pin low, sleep.
+    Runs the train synchronously in start().
+    """
+
+    def __init__(self, write):
+        self._write = write
+
+    def claim(self, pin):
+        pass
+
+    def start(self, pin, periods, delay=0.0):
+        train = PulseTrain(pin, periods, delay)
+        train.started_at = time.monotonic()
+        for period in train.periods:
+            self._write(pin, True)
+            time.sleep(period / 2)
+            self._write(pin, False)
+            time.sleep(period / 2)
+        train._finish(train.steps)
+        return train
+
+
+class EdgeRecorder:
+    """Collects timestamps in seconds of rising edges on the benchmark pin"""
+
+    def __init__(self):
+        self.times = []
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.times = []
+
+    def add(self, t):
+        with self._lock:
+            self.times.append(t)
+
+    def wrap(self, write=None):
+        """Returns a write(pin, value) that timestamps every rising edge"""
+
+        def stamped(pin, value):
+            if value:
+                self.add(time.perf_counter())
+            if write is not None:
+                write(pin, value)
+
+        return stamped
+
+
+# =================== Backends ===================
+
+
+def _rpigpio(pin, edges, loopback):
+    import RPi.GPIO as GPIO
+
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setwarnings(False)
+    return ThreadPulseBackend(edges.wrap(GPIO.output), lambda p: GPIO.setup(p, GPIO.OUT))
+
+
+def _gpiozero(pin, edges, loopback):
+    from gpiozero import DigitalOutputDevice
+
+    device = DigitalOutputDevice(pin)
+    return ThreadPulseBackend(edges.wrap(lambda p, value: device.on() if value else device.off()))
+
+
+def _lgpio(pin, edges, loopback):
+    backend = LgpioPulseBackend()
+    if loopback is not None:
+        import lgpio
+
+        handle = backend._handle
+        lgpio.gpio_claim_alert(handle, loopback, lgpio.RISING_EDGE)
+        # Alert ticks are kernel timestamps in nanoseconds
+        backend._bench_alert = lgpio.callback(
+            handle, loopback, lgpio.RISING_EDGE, lambda chip, gpio, level, tick: edges.add(tick / 1e9)
+        )
+    return backend
+
+
+BACKENDS = {
+    "recording": lambda pin, edges, loopback: RecordingPulseBackend(),
+    "python": lambda pin, edges, loopback: ThreadPulseBackend(edges.wrap()),
+    "legacy": lambda pin, edges, loopback: LegacyLoopBackend(edges.wrap()),
+    "rpigpio": _rpigpio,
+    "gpiozero": _gpiozero,
+    "lgpio": _lgpio,
+}
+
+
+# =================== Measurement ===================
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(name, backend, pin, steps, period, edges):
+    """
+    Outputs one train of steps pulses at period seconds and returns its measurements.
+    Periods in the result are in microseconds.
+    """
+    edges.clear()
+    periods = constant_periods(steps, period)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    train = backend.start(pin, periods)
+    start_latency = time.perf_counter() - wall_start
+    train.wait()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    stamps = sorted(edges.times)
+    measured = sorted((b - a) * 1e6 for a, b in zip(stamps, stamps[1:]))
+    return {
+        "backend": name,
+        "requested_period_us": period * 1e6,
+        "steps": train.steps_done,
+        "wall_s": wall,
+        "frequency_hz": train.steps_done / wall if wall > 0 else None,
+        "period_p50_us": _percentile(measured, 0.50),
+        "period_p99_us": _percentile(measured, 0.99),
+        "period_max_us": measured[-1] if measured else None,
+        "edges_measured": len(stamps),
+        "cpu_percent": 100 * cpu / wall if wall > 0 else None,
+        "start_latency_us": start_latency * 1e6,
+    }
+
+
+def run(backends, periods_us, steps, pin, loopback=None):
+    results = []
+    for name in backends:
+        edges = EdgeRecorder()
+        try:
+            backend = BACKENDS[name](pin, edges, loopback)
+            backend.claim(pin)
+        except Exception as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        for period_us in periods_us:
+            results.append(measure(name, backend, pin, steps, period_us / 1e6, edges))
+    return results
+
+
+def find_regressions(results, baseline):
+    """
+    Results whose frequency dropped more than REGRESSION_TOLERANCE below the
+    baseline result of the same backend and requested period.
+    """
+    reference = {
+        (r["backend"], r["requested_period_us"]): r["frequency_hz"]
+        for r in baseline.get("results", [])
+        if r.get("frequency_hz")
+    }
+    regressions = []
+    for r in results:
+        before = reference.get((r["backend"], r["requested_period_us"]))
+        if before and r["frequency_hz"] and r["frequency_hz"] < before * (1 - REGRESSION_TOLERANCE):
+            regressions.append((r, before))
+    return regressions
+
+
+def _fmt(value, digits=1):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_table(results):
+    print(f"{'backend':<10} {'req us':>8} {'freq Hz':>10} {'p50 us':>8} {'p99 us':>8} {'max us':>8} {'cpu %':>6}")
+    for r in results:
+        print(
+            f"{r['backend']:<10} {_fmt(r['requested_period_us']):>8} {_fmt(r['frequency_hz'], 0):>10} "
+            f"{_fmt(r['period_p50_us']):>8} {_fmt(r['period_p99_us']):>8} "
+            f"{_fmt(r['period_max_us']):>8} {_fmt(r['cpu_percent'], 0):>6}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Step rate and jitter benchmark of the pulse backends")
+    parser.add_argument("--backends", default="recording,python,legacy",
+                        help=f"comma separated, from: {', '.join(BACKENDS)}")
+    parser.add_argument("--periods", default=",".join(str(p) for p in DEFAULT_PERIODS_US),
+                        help="comma separated requested step periods in microseconds")
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS)
+    parser.add_argument("--pin", type=int, default=DEFAULT_PIN, help="BCM step pin to pulse")
+    parser.add_argument("--loopback", type=int, default=None, help="input pin wired to the step pin (lgpio)")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--baseline", default=None, help="earlier --json file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.backends.split(","),
+        [float(p) for p in args.periods.split(",")],
+        args.steps,
+        args.pin,
+        args.loopback,
+    )
+    print_table(results)
+
+    report = {
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "steps": args.steps,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(report, fp, indent=2)
+        print(f"Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = find_regressions(results, json.load(fp))
+        for r, before in regressions:
+            print(
+                f"REGRESSION {r['backend']} at {_fmt(r['requested_period_us'])} us: "
+                f"{r['frequency_hz']:.0f} Hz, baseline {before:.0f} Hz"
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,82 +3,177 @@ Calibration script using the updated manual_control architecture.
 Works over SSH or local terminal.
 """
 
-import select
-import json
 import time
-import threading
-import sys
-import termios
-import tty
+from collections import namedtuple
 
 from . import manual_control
+from .calibration_store import get_store as get_calibration_store
+from .drift_monitor import get_monitor as get_drift_monitor
+from .key_input import KeyReader, MotionLatency
 from .manual_control import initialize_motors
-from gpiozero import Button, Device
-from gpiozero.pins.rpigpio import RPiGPIOFactory
+from .microstep import COARSE_MODE, FINE_MODE
+from .motion_planner import AxisLimits, plan_move, planned_duration
 
 
-# ===================== Keyboard =====================
+# ===================== Homing =====================
 
 
-def get_key_nonblocking():
-    dr, _, _ = select.select([sys.stdin], [], [], 0)
-    if dr:
-        return sys.stdin.read(1)
-    return None
+HomingConfig = namedtuple(
+    "HomingConfig", ["seek_velocity", "latch_velocity", "backoff_steps", "acceleration"]
+)
+HomingConfig.__doc__ = """
+Homing settings of one axis.
 
+:param seek_velocity: microsteps/s of the fast first approach
+:param latch_velocity: microsteps/s of the slow second approach, sets the repeatability
+:param backoff_steps: microsteps driven away from the endstop between and after the approaches
+:param acceleration: microsteps/s^2 of the seek and backoff moves
+"""
 
-# ===================== Homing =====================
+HOMING = {
+    "x": HomingConfig(seek_velocity=20000, latch_velocity=2000, backoff_steps=800, acceleration=40000),
+    "y": HomingConfig(seek_velocity=20000, latch_velocity=2000, backoff_steps=800, acceleration=40000),
+}
 
+# Velocity every homing move starts at, the motor never stalls from standstill at this rate
+HOMING_START_VELOCITY = 4000
 
-def move_to_home(step_delay=0.0000001):
-    """
-    Home both axes using motor TurnStep for consistent speed with move_to_position.
-    Motion stops immediately on endstop trigger.
+# Upper bound on microsteps travelled while searching for an endstop
+HOMING_MAX_STEPS = 400000
 
-    :param step_delay: Step delay for motor movement, matches move_to_position speed
-    :type step_delay: float
-    """
-    print("Homing in progress...")
 
-    # ---- X axis (move backward toward X-min) ----
-    print("  X axis: moving backward toward endstop...")
-    while not manual_control.x_min_pressed.is_set():
-        manual_control.Motor2.TurnStep(Dir="backward", steps=20, stepdelay=step_delay)
-        # time.sleep(0.01)
+def _seek_limits(config):
+    start = min(HOMING_START_VELOCITY, config.seek_velocity)
+    return AxisLimits(config.seek_velocity, config.acceleration, None, start)
 
-    print("  X axis: endstop hit, waiting for backoff...")
-    # Wait for backoff thread to start
-    time.sleep(0.05)
 
-    manual_control.x_min_pressed.clear()
-    while manual_control.x_backoff_running.is_set():
-        time.sleep(0.1)
+def _latch_limits(config):
+    # Constant speed, so the endstop is always hit at exactly latch_velocity
+    return AxisLimits(config.latch_velocity, config.acceleration, None, config.latch_velocity)
 
-    time.sleep(0.2)  # small settle delay
-    print("  X axis: homing complete")
 
-    # ---- Y axis (move backward toward Y-min) ----
-    print("  Y axis: moving backward toward endstop...")
-    while not manual_control.y_min_pressed.is_set():
-        manual_control.Motor1.TurnStep(Dir="backward", steps=20, stepdelay=step_delay)
-        # time.sleep(0.01)
+def _seek_plans(limits, max_steps, mode):
+    controller = manual_control.controller
+    return {
+        axis: ("backward", plan_move(max_steps[axis], axis_limits, decelerate=False).intervals, 0.0, mode)
+        for axis, axis_limits in limits.items()
+        if not controller.min_pressed[axis].is_set()
+    }
 
-    print("  Y axis: endstop hit, waiting for backoff...")
-    # Wait for backoff thread to start
-    time.sleep(0.05)
 
-    manual_control.y_min_pressed.clear()
-    while manual_control.y_backoff_running.is_set():
-        time.sleep(0.1)
+def _seek_steps(limits, max_steps, result):
+    controller = manual_control.controller
+    for axis in limits:
+        if not controller.min_pressed[axis].is_set():
+            raise RuntimeError(f"{axis.upper()} endstop not reached within {max_steps[axis]} steps")
+    return {axis: result.steps.get(axis, 0) for axis in limits}
 
-    time.sleep(0.2)  # small settle delay
-    print("  Y axis: homing complete")
+
+def _backoff_plans(config, axes):
+    return {
+        axis: ("forward", plan_move(config[axis].backoff_steps, _seek_limits(config[axis])).intervals, 0.0)
+        for axis in axes
+    }
+
+
+def homing_moves(config=HOMING, axes=("x", "y")):
+    """
+    The moves of two-phase homing, as a generator: it yields the plans of
+    every move and expects the MoveResult of that move to be sent back.
+    Lets move_to_home and the asyncio cycle engine share one sequence.
+
+    :return: (StopIteration value) dict axis -> steps driven during the fast seek
+    """
+    controller = manual_control.controller
+    monitor = get_drift_monitor()
+    before = monitor.homing_started(controller, axes)
+
+    seek_limits = {axis: _seek_limits(config[axis]) for axis in axes}
+    seek_max = {axis: HOMING_MAX_STEPS for axis in axes}
+    # The fast seek cruises coarse, which also puts the microstep indexer on the coarse grid
+    result = yield _seek_plans(seek_limits, seek_max, COARSE_MODE)
+    seek = _seek_steps(seek_limits, seek_max, result)
+    print(f"  Seek done, steps per axis: {seek}")
+
+    yield _backoff_plans(config, axes)
+    for axis in axes:
+        controller.min_pressed[axis].clear()
+
+    latch_limits = {axis: _latch_limits(config[axis]) for axis in axes}
+    latch_max = {axis: 2 * config[axis].backoff_steps for axis in axes}
+    result = yield _seek_plans(latch_limits, latch_max, FINE_MODE)
+    _seek_steps(latch_limits, latch_max, result)
+
+    yield _backoff_plans(config, axes)
+    for axis in axes:
+        controller.min_pressed[axis].clear()
+
+    # The seek measured how far the axes really were from home
+    drift = monitor.homing_done(controller, before, seek, {axis: config[axis].backoff_steps for axis in axes})
+    if drift:
+        print(f"  Drift per axis: {drift}")
 
     # Reset counters
-    manual_control.x_axis = 0
-    manual_control.y_axis = 0
+    for axis in axes:
+        controller.reset_position(axis)
+    return seek
+
+
+def move_to_home(config=HOMING, axes=("x", "y")):
+    """
+    Two-phase homing of the axes, which move at the same time.
+
+    Each axis seeks its endstop fast, backs off a fixed number of steps,
+    re-approaches slowly so the trigger point is repeatable and backs off
+    again. Returns as soon as the last backoff completes; position zero is
+    the point backoff_steps away from the latched trigger point.
+
+    :param config: dict axis -> HomingConfig
+    :param axes: axes to home
+    :return: dict axis -> steps driven during the fast seek
+    """
+    controller = manual_control.controller
+    print("Homing in progress...")
+
+    # The homing sequence does its own backoffs
+    for axis in axes:
+        controller.wait_for_backoff(axis)
+    controller.auto_backoff = False
+    try:
+        moves = homing_moves(config, axes)
+        plans = next(moves)
+        while True:
+            result = controller.seek(plans)
+            result.wait()
+            if result.error is not None:
+                raise result.error
+            plans = moves.send(result)
+    except StopIteration as done:
+        seek = done.value
+    finally:
+        controller.auto_backoff = True
 
     print("Homing complete")
+    return seek
+
+
+def planned_home_time(steps, config=HOMING):
+    """
+    Planned duration in seconds of move_to_home, without endstop settle times.
+
+    :param steps: dict axis -> microsteps between the axis and its home position
+    :param config: dict axis -> HomingConfig
+    """
+    longest = 0.0
+    for axis, distance in steps.items():
+        axis_config = config[axis]
+        # The seek accelerates towards the trigger point, backoff_steps behind home
+        seek = plan_move(HOMING_MAX_STEPS, _seek_limits(axis_config), decelerate=False)
+        seek_time = sum(seek.intervals[:abs(distance) + axis_config.backoff_steps])
+        backoff_time = planned_duration(axis_config.backoff_steps, _seek_limits(axis_config))
+        latch_time = axis_config.backoff_steps / axis_config.latch_velocity
+        longest = max(longest, seek_time + latch_time + 2 * backoff_time)
+    return longest
 
 
 # ============== Reset State ==============
@@ -86,19 +181,11 @@ def move_to_home(step_delay=0.0000001):
 
 def reset_manual_state():
     """
-    Reset flags and perform homing.
-    Must be called AFTER motor_control_loop is running.
+    Stop all motion and perform homing.
+    Must be called AFTER the motion controller is running.
     """
 
-    manual_control.is_moving_forward = False
-    manual_control.is_moving_backward = False
-    manual_control.is_moving_left = False
-    manual_control.is_moving_right = False
-
-    manual_control.continuous_forward = False
-    manual_control.continuous_backward = False
-    manual_control.continuous_left = False
-    manual_control.continuous_right = False
+    manual_control.stop_all_motion()
 
     move_to_home()
 
@@ -106,13 +193,15 @@ def reset_manual_state():
 # ============== Save Calibration ==============
 
 
-def dump_to_json(x_axis, y_axis, filename="motor_control/calibration_info.json"):
-    coords = {"end_position_x": x_axis, "end_position_y": y_axis}
-
+def save_position(**points):
+    """
+    Saves named positions in calibration counts to the calibration store,
+    e.g. save_position(house=(x, y)).
+    """
     try:
-        with open(filename, "w") as fp:
-            json.dump(coords, fp, indent=2)
-        print(f"Calibration saved to {filename}")
+        store = get_calibration_store()
+        store.save(**points)
+        print(f"Calibration saved to {store.path}: {points}")
     except Exception as e:
         print(f"Failed to save calibration: {e}")
 
@@ -121,92 +210,52 @@ def dump_to_json(x_axis, y_axis, filename="motor_control/calibration_info.json")
 
 
 def calibration_listener():
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    tty.setcbreak(fd)
-
     print("\nCalibration controls:")
     print("  W = continuous up")
     print("  A = continuous left")
     print("  S = continuous down")
     print("  D = continuous right")
-    print("  Y = step up")
-    print("  H = step down")
-    print("  Z = step left")
-    print("  X = step right")
+    print("  Y = step up (hold to keep moving)")
+    print("  H = step down (hold to keep moving)")
+    print("  Z = step left (hold to keep moving)")
+    print("  X = step right (hold to keep moving)")
     print("  SPACE = stop all")
     print("  ENTER = save calibration & exit")
     print("  ESC = quit without saving\n")
 
-    try:
+    latency = MotionLatency()
+    with KeyReader(hold_keys=manual_control.HOLD_KEYS) as keyboard:
+        manual_control.keyboard = keyboard
         while manual_control.running:
-            key = get_key_nonblocking()
-            if not key:
-                # time.sleep(0.01)
+            event = keyboard.read()  # blocks until a key or stop_keyboard_listener()
+            if event is None:
+                break
+            key = event.key
+
+            # Continuous motion, single steps, held steps and stop
+            if key in manual_control.MOTION_KEYS:
+                manual_control.handle_motion_key(event, latency)
+
+            elif event.kind != "press":
                 continue
 
-            key = key.lower()
-
-            # Continuous motion
-            if key == "w":
-                manual_control.continuous_forward = (
-                    not manual_control.continuous_forward
-                )
-                manual_control.continuous_backward = False
-                manual_control.continuous_left = False
-                manual_control.continuous_right = False
-
-            elif key == "a":
-                manual_control.continuous_left = not manual_control.continuous_left
-                manual_control.continuous_right = False
-                manual_control.continuous_forward = False
-                manual_control.continuous_backward = False
-
-            elif key == "s":
-                manual_control.continuous_backward = (
-                    not manual_control.continuous_backward
-                )
-                manual_control.continuous_forward = False
-                manual_control.continuous_left = False
-                manual_control.continuous_right = False
-
-            elif key == "d":
-                manual_control.continuous_right = not manual_control.continuous_right
-                manual_control.continuous_left = False
-                manual_control.continuous_forward = False
-                manual_control.continuous_backward = False
-
-            # Single steps
-            elif key == "y":
-                manual_control.is_moving_forward = True
-            elif key == "h":
-                manual_control.is_moving_backward = True
-            elif key == "z":
-                manual_control.is_moving_left = True
-            elif key == "x":
-                manual_control.is_moving_right = True
-
-            # Stop
-            elif key == " ":
-                manual_control.continuous_forward = False
-                manual_control.continuous_backward = False
-                manual_control.continuous_left = False
-                manual_control.continuous_right = False
             #save house position
             elif key == "p":
                 print("Saving house position...")
-                dump_to_json(manual_control.x_axis, manual_control.y_axis, filename="motor_control/calibration_house.json")
+                save_position(house=manual_control.position_counts())
             # Save & exit
             elif key in ("\n", "\r"):
-                dump_to_json(manual_control.x_axis, manual_control.y_axis)
+                x_axis, y_axis = manual_control.position_counts()
+                # The wash cycle drives Y to the spray nozzle, then X to the sponge
+                save_position(spray=(0, y_axis), sponge=(x_axis, y_axis))
                 manual_control.running = False
 
             # Exit without saving
             elif key == "\x1b":
                 manual_control.running = False
 
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+    manual_control.keyboard = None
+    print(latency.summary())
 
 
 # ============== Entry Point ==============
@@ -217,16 +266,9 @@ def start_calibration_control():
     time.sleep(2)
 
     # Initialize GPIO and endstops
-    Device.pin_factory = RPiGPIOFactory()
+    manual_control.set_pin_factory()
 
-    y_min = Button(manual_control.Y_MIN_PIN, pull_up=False)
-    x_min = Button(manual_control.X_MIN_PIN, pull_up=True)
-
-    y_min.when_pressed = manual_control.on_y_min_pressed
-    y_min.when_released = manual_control.on_y_min_released
-
-    x_min.when_pressed = manual_control.on_x_min_pressed
-    x_min.when_released = manual_control.on_x_min_released
+    manual_control.initialize_endstops()
 
     # Initialize motors & GPIO
     Motor1, Motor2, pump1 = initialize_motors()
@@ -236,15 +278,9 @@ def start_calibration_control():
 
     manual_control.running = True
 
-    motor_thread = threading.Thread(
-        target=manual_control.motor_control_loop, daemon=True
-    )
-    motor_thread.start()
-
-    # Give thread time to start
-    time.sleep(0.1)
+    manual_control.start_motion_controller()
 
-    # Perform homing AFTER motor thread is alive
+    # Perform homing AFTER the motion controller is running
     reset_manual_state()
 
     # Enter UI
@@ -252,28 +288,15 @@ def start_calibration_control():
 
     # Shutdown
     manual_control.running = False
-    Motor1.Stop()
-    Motor2.Stop()
-
-    # Clean up GPIO pins
-    if hasattr(Motor1, "dir_pin") and Motor1.dir_pin:
-        Motor1.dir_pin.close()
-    if hasattr(Motor1, "step_pin") and Motor1.step_pin:
-        Motor1.step_pin.close()
-    if hasattr(Motor1, "enable_pin") and Motor1.enable_pin:
-        Motor1.enable_pin.close()
-
-    if hasattr(Motor2, "dir_pin") and Motor2.dir_pin:
-        Motor2.dir_pin.close()
-    if hasattr(Motor2, "step_pin") and Motor2.step_pin:
-        Motor2.step_pin.close()
-    if hasattr(Motor2, "enable_pin") and Motor2.enable_pin:
-        Motor2.enable_pin.close()
-
-    if y_min:
-        y_min.close()
-    if x_min:
-        x_min.close()
+    manual_control.stop_motion_controller()
+
+    # Release the driver pins, the pump and the endstops
+    Motor1.Close()
+    Motor2.Close()
+    pump1.close()
+
+    for endstop in manual_control.endstops.values():
+        endstop.close()
 
     print("Calibration exited cleanly")
 
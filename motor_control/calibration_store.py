@@ -0,0 +1,239 @@
+"""
+Calibration store: all named positions of the rig in one versioned file.
+
+Positions are (x, y) in calibration counts of JOG_STEPS microsteps from home,
+away from the min endstops, so never negative:
+
+    {
+      "version": 2,
+      "revision": 3,
+      "updated": "2026-03-01 10:00:00",
+      "positions": {"spray": {"x": 0, "y": 4713}, ...}
+    }
+
+The file is read once and cached. get() only checks the modification time,
+so a long running process picks up a new calibration without re-parsing the
+file on every cycle, and reload() forces a re-read. SIGHUP only marks the
+cache stale, the next read re-reads the file (see reload_on_sighup). Writes go
+to a temp file that is renamed over the old one, so a crash leaves either the
+old or the new calibration, never half of one.
+
+Rigs calibrated before the store existed have calibration_info.json and
+calibration_house.json; those are imported the first time the store loads.
+Those files and version 1 of this file could hold negative counts, which lie
+behind the min endstop where the carriage cannot go: the old calibration
+counted them with the sign flipped. They are migrated to the absolute count
+and the file is rewritten as version 2.
+"""
+import json
+import os
+import signal
+import tempfile
+import threading
+from datetime import datetime
+
+FORMAT_VERSION = 2
+FILE_NAME = "calibration.json"
+
+# Files written by earlier versions of calibrate.dump_to_json
+LEGACY_SPONGE = "calibration_info.json"
+LEGACY_HOUSE = "calibration_house.json"
+
+
+def default_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), FILE_NAME)
+
+
+def write_json_atomic(path, data):
+    """
+    Writes data as JSON to a temp file and renames it over path, so a crash
+    or power loss leaves either the old or the new file.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix="." + os.path.basename(path) + "-", suffix=".tmp", dir=folder)
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(data, fp, indent=2)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    # Make the rename itself durable
+    dir_fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _legacy_point(path):
+    with open(path, "r") as fp:
+        coords = json.load(fp)
+    return abs(int(coords["end_position_x"])), abs(int(coords["end_position_y"]))
+
+
+def _migrate_v1(positions):
+    """Version 1 positions with the negative counts flipped, see the module docstring"""
+    migrated = {name: {"x": abs(p["x"]), "y": abs(p["y"])} for name, p in positions.items()}
+    flipped = sorted(name for name in positions if migrated[name] != positions[name])
+    if flipped:
+        print(f"Calibration: flipped the negative counts of {flipped}, positions lie away from the endstops")
+    return migrated
+
+
+class CalibrationStore:
+    """
+    Cached named positions backed by one JSON file.
+
+    :param path: calibration file, default_path() by default
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self._lock = threading.Lock()
+        self._positions = None
+        self._revision = 0
+        self._mtime = None
+        self._stale = False  # set by mark_stale(), e.g. from a signal handler
+
+    # ----- Reading -----
+
+    def get(self, name):
+        """(x, y) of the named position, KeyError if it was never calibrated"""
+        point = self.positions()[name]
+        return point["x"], point["y"]
+
+    def positions(self):
+        """dict name -> {"x", "y"}, reloaded first if the file changed"""
+        with self._lock:
+            if self._positions is None or self._stale or self._changed():
+                self._load()
+            return dict(self._positions)
+
+    @property
+    def revision(self):
+        with self._lock:
+            return self._revision
+
+    def reload(self):
+        """Forces a re-read of the file"""
+        with self._lock:
+            self._load()
+
+    def mark_stale(self):
+        """
+        Makes the next read re-read the file. Takes no lock, so it is safe in
+        a signal handler, which may interrupt a thread holding it.
+        """
+        self._stale = True
+
+    def _changed(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self._mtime
+        except FileNotFoundError:
+            return self._mtime is not None
+
+    def _load(self):
+        if self._stale:
+            print("Re-reading the calibration, it was marked stale")
+            self._stale = False
+        try:
+            with open(self.path, "r") as fp:
+                mtime = os.fstat(fp.fileno()).st_mtime_ns
+                data = json.load(fp)
+        except FileNotFoundError:
+            self._positions, self._revision, self._mtime = self._import_legacy(), 0, None
+            if self._positions:
+                self._write()
+            return
+
+        version = data.get("version")
+        if version not in (1, FORMAT_VERSION):
+            raise ValueError(f"{self.path}: unsupported calibration version {version}")
+        self._mtime = mtime
+        self._positions = {
+            name: {"x": int(p["x"]), "y": int(p["y"])} for name, p in data["positions"].items()
+        }
+        self._revision = int(data.get("revision", 0))
+        if version == 1:
+            self._positions = _migrate_v1(self._positions)
+            self._write()
+
+    def _import_legacy(self):
+        """Positions from the old per-point files, as the wash cycle used them"""
+        folder = os.path.dirname(os.path.abspath(self.path))
+        positions = {}
+        try:
+            x, y = _legacy_point(os.path.join(folder, LEGACY_SPONGE))
+            # The cycle moves Y to the spray nozzle first, then X to the sponge
+            positions["spray"] = {"x": 0, "y": y}
+            positions["sponge"] = {"x": x, "y": y}
+        except (OSError, ValueError, KeyError):
+            pass
+        try:
+            x, y = _legacy_point(os.path.join(folder, LEGACY_HOUSE))
+            positions["house"] = {"x": x, "y": y}
+        except (OSError, ValueError, KeyError):
+            pass
+        if positions:
+            print(f"Imported calibration {sorted(positions)} from the old calibration files")
+        return positions
+
+    # ----- Writing -----
+
+    def save(self, **points):
+        """
+        Stores one or more positions and writes the file atomically.
+
+        save(house=(1, 2)) or save(spray=(0, y), sponge=(x, y))
+
+        :raises ValueError: for a negative count, behind the min endstop
+        """
+        for name, (x, y) in points.items():
+            if x < 0 or y < 0:
+                raise ValueError(f"{name} = ({x}, {y}) lies behind the min endstop")
+        with self._lock:
+            if self._positions is None or self._stale or self._changed():
+                self._load()
+            for name, (x, y) in points.items():
+                self._positions[name] = {"x": int(x), "y": int(y)}
+            self._revision += 1
+            self._write()
+
+    def _write(self):
+        data = {
+            "version": FORMAT_VERSION,
+            "revision": self._revision,
+            "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "positions": self._positions,
+        }
+        write_json_atomic(self.path, data)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+
+_store = None
+
+
+def get_store():
+    """The process wide CalibrationStore"""
+    global _store
+
+    if _store is None:
+        _store = CalibrationStore()
+    return _store
+
+
+def reload_on_sighup(store=None):
+    """
+    Makes SIGHUP re-read the calibration, on the next read of a position.
+    Call from the main thread.
+    """
+    store = store or get_store()
+
+    def on_sighup(signum, frame):
+        # The signal may arrive while the main thread holds the store's lock, reloading here would deadlock
+        store.mark_stale()
+
+    signal.signal(signal.SIGHUP, on_sighup)
@@ -0,0 +1,59 @@
+"""
+Clock used for the timed waits of the wash cycle (pump runs, servo moves, dwells).
+
+By default this is the wall clock. The simulated rig installs a virtual clock,
+so a whole wash cycle runs in a fraction of the wall time while still
+reporting the cycle time the real rig would need.
+"""
+import asyncio
+import time
+
+
+class WallClock:
+    """The real clock"""
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, event, timeout=None):
+        return event.wait(timeout)
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+_clock = WallClock()
+
+
+def set_clock(clock):
+    """Installs clock, None restores the wall clock"""
+    global _clock
+    _clock = clock if clock is not None else WallClock()
+
+
+def get_clock():
+    return _clock
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def wait(event, timeout=None):
+    """
+    Waits until event is set or timeout seconds passed, like event.wait.
+    Returns True if the event was set.
+    """
+    return _clock.wait(event, timeout)
+
+
+async def async_sleep(seconds):
+    """asyncio sleep on the installed clock, cancellable like asyncio.sleep"""
+    await _clock.async_sleep(seconds)
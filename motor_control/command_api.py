@@ -0,0 +1,366 @@
+"""
+Local command API of the rig.
+
+A Unix socket server on the wash service's event loop, so operator tools and
+automation can drive the rig without an SSH terminal in cbreak mode. The
+protocol is one JSON object per line in both directions, like the fleet
+protocol:
+
+    -> {"op": "step", "axis": "x", "direction": "forward", "steps": 400, "id": 1}
+    <- {"id": 1, "ok": true, "ms": 0.4, "first_step_ms": 0.9}
+
+Ops:
+    status                               busy, position, homed
+    jog axis direction                   toggle continuous motion
+    step axis direction [steps]          move steps microsteps (one jog step by default)
+    stop                                 stop all motion and cancel a running cycle
+    home                                 two-phase homing
+    move_to name | x y                   move to a calibration position or counts
+    wash                                 start a wash cycle
+    save_position name                   save the current position under name
+    stats                                request timing per op
+    endstops                             presses, bounces and edge-to-stop latency per axis
+    drift                                drift found by the homings and max velocity per axis
+
+Every reply carries ms, the time the server took for the request, and, for
+motion ops, first_step_ms, the time from receiving the request to the first
+step pulse train. Motion ops other than stop are refused while a cycle runs.
+While motion ops run or the axes still move from one, the server holds the
+rig (WashService.claim) and wash requests are refused.
+
+Usage:
+    python -m motor_control.command_api status
+    python -m motor_control.command_api step x forward 400
+    python -m motor_control.command_api move-to sponge
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+
+from . import clock, manual_control
+
+SOCKET_PATH = "/tmp/biomim_8.sock"
+
+AXES = ("x", "y")
+DIRECTIONS = ("forward", "backward")
+
+MOTION_OPS = ("jog", "step", "home", "move_to")
+
+# Seconds a move_to or home request may take
+MOTION_TIMEOUT = 120.0
+
+# Seconds a jog or step reply waits for the first step pulse train
+FIRST_STEP_WAIT = 0.5
+
+# Seconds save_position waits for running motion to end
+IDLE_WAIT = 5.0
+
+# Seconds between checks whether the axes stopped, before the rig is given back
+IDLE_POLL = 0.01
+
+
+class CommandError(Exception):
+    """A request that cannot be executed, the message goes back to the client"""
+
+
+def _axis_args(message):
+    axis, direction = message.get("axis"), message.get("direction")
+    if axis not in AXES or direction not in DIRECTIONS:
+        raise CommandError(f"expected axis in {AXES} and direction in {DIRECTIONS}")
+    return axis, direction
+
+
+class CommandServer:
+    """
+    Serves the command API for one WashService, on the service's event loop.
+
+    :param service: WashService, started with serve() on the same loop
+    :param path: Unix socket path
+    """
+
+    def __init__(self, service, path=SOCKET_PATH):
+        self.service = service
+        self.path = path
+        self.stats = {}  # op -> [count, total ms, max ms]
+        self._server = None
+        self._motion_ops = 0  # motion ops being handled
+        self._claimed = False  # holds the service's busy lock
+        self._unclaiming = None  # task giving the rig back once the axes stopped
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over from a crashed process
+        self._server = await asyncio.start_unix_server(self._client, self.path)
+        os.chmod(self.path, 0o660)
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.handle(line)
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, line):
+        """Executes one request line and returns the reply"""
+        received = time.perf_counter()
+        received_clock = clock.monotonic()
+        reply = {}
+        op = None
+        started = None
+        try:
+            try:
+                message = json.loads(line)
+                op = message["op"]
+            except (ValueError, KeyError, TypeError):
+                raise CommandError("expected a JSON object with an op")
+            reply["id"] = message.get("id")
+            handler = getattr(self, "_op_" + str(op), None)
+            if handler is None:
+                raise CommandError(f"unknown op {op!r}")
+
+            if op in MOTION_OPS:
+                if manual_control.controller is None:
+                    raise CommandError("the rig is not initialized")
+                self._claim()
+                loop = asyncio.get_running_loop()
+                started = loop.create_future()
+
+                def first_step(t):
+                    loop.call_soon_threadsafe(lambda: started.done() or started.set_result(t))
+
+                manual_control.controller.notify_next_start(first_step)
+
+            try:
+                result = await handler(message)
+            finally:
+                if op in MOTION_OPS:
+                    self._motion_done()
+            reply["ok"] = True
+            if result:
+                reply.update(result)
+            if started is not None:
+                try:
+                    t = await asyncio.wait_for(asyncio.shield(started), FIRST_STEP_WAIT)
+                    reply["first_step_ms"] = round((t - received_clock) * 1000, 3)
+                except asyncio.TimeoutError:
+                    pass  # nothing moved, e.g. the axis is on its endstop
+        except CommandError as e:
+            reply.update(ok=False, error=str(e))
+        except Exception as e:
+            reply.update(ok=False, error=f"{type(e).__name__}: {e}")
+
+        ms = (time.perf_counter() - received) * 1000
+        reply["ms"] = round(ms, 3)
+        if op is not None:
+            count, total, longest = self.stats.get(op, (0, 0.0, 0.0))
+            self.stats[op] = [count + 1, total + ms, max(longest, ms)]
+        return reply
+
+    # ----- Rig claim -----
+
+    def _claim(self):
+        if not self._claimed:
+            if not self.service.claim():
+                raise CommandError("a wash cycle is running")
+            self._claimed = True
+        self._motion_ops += 1
+
+    def _motion_done(self):
+        self._motion_ops -= 1
+        if self._motion_ops == 0 and (self._unclaiming is None or self._unclaiming.done()):
+            self._unclaiming = asyncio.create_task(self._unclaim_when_idle())
+
+    async def _unclaim_when_idle(self):
+        # jog and step reply while the axes still move
+        while self._motion_ops == 0 and not manual_control.controller.is_idle():
+            await clock.async_sleep(IDLE_POLL)
+        if self._motion_ops == 0 and self._claimed:
+            self._claimed = False
+            self.service.unclaim()
+
+    # ----- Ops -----
+
+    async def _op_status(self, message):
+        controller = manual_control.controller
+        return {
+            "busy": self.service.busy(),
+            "cycles": self.service.cycles,
+            "position": controller.position if controller else None,
+            "homed": {axis: controller.tracker.homed(axis) for axis in AXES} if controller else None,
+        }
+
+    async def _op_jog(self, message):
+        axis, direction = _axis_args(message)
+        manual_control.controller.continuous(axis, direction)
+
+    async def _op_step(self, message):
+        axis, direction = _axis_args(message)
+        steps = message.get("steps")
+        if steps is not None and (not isinstance(steps, int) or steps <= 0):
+            raise CommandError("steps must be a positive integer")
+        manual_control.controller.jog(axis, direction, steps)
+
+    async def _op_stop(self, message):
+        self.service.cancel_cycle()
+        manual_control.stop_all_motion()
+
+    async def _op_home(self, message):
+        from .cycle_engine import home
+
+        seek = await asyncio.wait_for(home(), MOTION_TIMEOUT)
+        return {"seek_steps": seek}
+
+    async def _op_move_to(self, message):
+        from .cycle_engine import move
+        from .test_wash import get_calibrated_positions
+
+        if "name" in message:
+            target = (get_calibrated_positions() or {}).get(message["name"])
+            if target is None:
+                raise CommandError(f"unknown position {message['name']!r}")
+        elif isinstance(message.get("x"), int) and isinstance(message.get("y"), int):
+            target = (message["x"], message["y"])
+        else:
+            raise CommandError("expected a position name or integer x and y")
+        if not all(manual_control.controller.tracker.homed(axis) for axis in AXES):
+            raise CommandError("home first, the position is unknown")
+
+        x, y = manual_control.position_counts()
+        result = await asyncio.wait_for(move(target[0] - x, target[1] - y), MOTION_TIMEOUT)
+        return {"steps": result.steps, "aborted": result.aborted, "position": manual_control.position_counts()}
+
+    async def _op_wash(self, message):
+        if not self.service.request_wash():
+            raise CommandError("a wash cycle or a motion op is running")
+
+    async def _op_save_position(self, message):
+        from .calibration_store import get_store
+
+        name = message.get("name")
+        if not isinstance(name, str) or not name:
+            raise CommandError("expected a position name")
+        if not all(manual_control.controller.tracker.homed(axis) for axis in AXES):
+            raise CommandError("home first, the position is unknown")
+        # A step sent right before is still running, let it finish
+        deadline = clock.monotonic() + IDLE_WAIT
+        while not manual_control.controller.is_idle():
+            if clock.monotonic() > deadline:
+                raise CommandError("the axes are moving")
+            await clock.async_sleep(0.01)
+        point = manual_control.position_counts()
+        # The store fsyncs, keep that off the event loop
+        await asyncio.to_thread(get_store().save, **{name: point})
+        return {"name": name, "position": point}
+
+    async def _op_stats(self, message):
+        return {"stats": {
+            op: {"count": count, "mean_ms": round(total / count, 3), "max_ms": round(longest, 3)}
+            for op, (count, total, longest) in self.stats.items()
+        }}
+
+
+    async def _op_endstops(self, message):
+        return {"endstops": {axis: endstop.stats() for axis, endstop in manual_control.endstops.items()}}
+
+    async def _op_drift(self, message):
+        from .drift_monitor import get_monitor
+
+        monitor = get_monitor()
+        return {"drift": monitor.stats(), "alerts": [message for _, message in monitor.alerts[-5:]]}
+
+
+# =================== Client ===================
+
+
+class CommandClient:
+    """
+    Blocking client of the command API.
+
+    :param path: Unix socket path of the CommandServer
+    """
+
+    def __init__(self, path=SOCKET_PATH, timeout=MOTION_TIMEOUT):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._file = self._sock.makefile("rb")
+        self._id = 0
+
+    def call(self, op, **args):
+        """Sends one request and returns the reply, with round_trip_ms added"""
+        self._id += 1
+        message = dict(args, op=op, id=self._id)
+        start = time.perf_counter()
+        self._sock.sendall((json.dumps(message) + "\n").encode())
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("command server closed the connection")
+        reply = json.loads(line)
+        reply["round_trip_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return reply
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _request(argv):
+    """op and arguments from the command line, e.g. step x forward 400"""
+    op, args = argv[0].replace("-", "_"), argv[1:]
+    if op in ("jog", "step") and len(args) >= 2:
+        message = {"axis": args[0], "direction": args[1]}
+        if len(args) > 2:
+            message["steps"] = int(args[2])
+        return op, message
+    if op == "move_to" and len(args) == 2:
+        return op, {"x": int(args[0]), "y": int(args[1])}
+    if op in ("move_to", "save_position") and len(args) == 1:
+        return op, {"name": args[0]}
+    return op, {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send one request to the rig's command API")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("request", nargs="+", help="op and arguments, e.g. step x forward 400")
+    args = parser.parse_args(argv)
+
+    op, message = _request(args.request)
+    try:
+        with CommandClient(args.socket) as client:
+            reply = client.call(op, **message)
+    except OSError as e:
+        print(f"Command server not reachable at {args.socket}: {e}")
+        return 1
+    print(json.dumps(reply, indent=2))
+    return 0 if reply.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+asyncio engine for the wash cycle.
+
+Every step of the cycle (home, move, spray, scrub, wait) is a coroutine with
+a timeout. When a step fails, times out or is cancelled, all actuators are
+de-energised straight away: motion is aborted, the drivers are disabled, the
+pump is switched off and the servo detached. Cancelling the task running
+wash_cycle therefore stops the rig mid-cycle.
+
+The steps to run come from a compiled wash recipe (see recipe.py).
+
+Moves are awaited through MoveResult callbacks and waits go through the
+injectable clock, so the cycle holds no thread while it waits and one event
+loop can serve the button, remote commands and the cycle together.
+"""
+import asyncio
+
+from . import clock, manual_control, telemetry
+from .calibrate import HOMING, homing_moves
+from .drift_monitor import get_monitor as get_drift_monitor
+
+# Seconds on top of the planned duration before a step times out
+MOVE_TIMEOUT_MARGIN = 5.0
+ACTUATOR_TIMEOUT_MARGIN = 5.0
+HOME_TIMEOUT = 120.0
+
+# Seconds homing waits for a running endstop backoff before ending it
+BACKOFF_TIMEOUT = 5.0
+
+
+def de_energise():
+    """Aborts all motion, disables the drivers, stops the pump and detaches the servo"""
+    controller = manual_control.controller
+    if controller is not None:
+        controller.stop()
+        for motor in controller.motors.values():
+            motor.Stop()
+    if manual_control.pump1:
+        manual_control.pump1.stop()
+    if manual_control.servo:
+        manual_control.servo.detach()
+
+
+# =================== Awaitable Steps ===================
+
+
+def wait_move(result):
+    """Future that completes with result once the move is done"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def done(r):
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(r))
+
+    result.add_done_callback(done)
+    return future
+
+
+async def sleep(seconds):
+    await clock.async_sleep(seconds)
+
+
+async def move(calibrated_x, calibrated_y):
+    """
+    Coordinated move by (calibrated_x, calibrated_y) counts, returns the MoveResult.
+    Raises if the move was refused or cut short, the rig is not where the cycle expects it.
+    """
+    result = await wait_move(manual_control.start_move(calibrated_x, calibrated_y))
+    if result.error is not None:
+        raise result.error
+    if result.aborted:
+        raise RuntimeError(f"move by ({calibrated_x}, {calibrated_y}) was aborted, steps {result.steps}")
+    return result
+
+
+async def home(config=HOMING, axes=("x", "y")):
+    """Two-phase homing, see calibrate.move_to_home"""
+    controller = manual_control.controller
+    print("Homing in progress...")
+
+    for axis in axes:
+        end = clock.monotonic() + BACKOFF_TIMEOUT
+        while controller.backoff_running[axis].is_set() and clock.monotonic() < end:
+            await sleep(0.01)
+        if controller.backoff_running[axis].is_set():
+            controller.end_backoff(axis)
+    controller.auto_backoff = False
+    try:
+        moves = homing_moves(config, axes)
+        plans = next(moves)
+        while True:
+            result = await wait_move(controller.seek(plans))
+            if result.error is not None:
+                raise result.error
+            plans = moves.send(result)
+    except StopIteration as done:
+        seek = done.value
+    finally:
+        controller.auto_backoff = True
+
+    print("Homing complete")
+    return seek
+
+
+async def return_home():
+    """Coordinated move back to position (0, 0), for a rig whose position is trusted"""
+    position = manual_control.controller.position
+    result = await wait_move(manual_control.start_move_steps(-position["x"], -position["y"]))
+    if result.error is not None:
+        raise result.error
+    if result.aborted:
+        raise RuntimeError(f"return to the origin was aborted, steps {result.steps}")
+    return result
+
+
+async def spray(duration):
+    pump = manual_control.pump1
+    pump.forward()
+    try:
+        await sleep(duration)
+    finally:
+        pump.stop()
+
+
+async def scrub(dwell):
+    """Lets the sponge soak for dwell seconds, then rotate_sponge"""
+    await sleep(dwell)
+    servo = manual_control.servo
+    if servo is None:
+        print("Servo not initialized")
+        return
+    try:
+        servo.min()
+        await sleep(manual_control.SPONGE_TURN_TIME)
+        servo.max()
+        await sleep(manual_control.SPONGE_TURN_TIME)
+        servo.mid()  # stop signal
+    finally:
+        servo.detach()
+
+
+async def together(*awaitables):
+    """
+    Runs the awaitables concurrently and returns their results. If one fails
+    the others are cancelled before the error is raised.
+    """
+    tasks = [asyncio.ensure_future(a) for a in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+# =================== Engine ===================
+
+
+class CycleEngine:
+    """
+    Runs steps with a timeout, de-energising the rig when a step does not complete.
+
+    :param timer: optional CycleTimer, every step is recorded as a phase
+    :param journal: optional PositionJournal, homings are checked against it for drift
+    """
+
+    def __init__(self, timer=None, journal=None):
+        self.timer = timer
+        self.journal = journal
+
+    async def step(self, name, awaitable, timeout, motion=False):
+        counter = self.timer.step_counter if self.timer is not None and motion else None
+        steps_before = counter() if counter else None
+        start = clock.monotonic()
+        error = None
+        telemetry.phase_started(name)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except BaseException as e:
+            error = type(e).__name__
+            de_energise()
+            raise
+        finally:
+            telemetry.phase_ended(name)
+            if self.timer is not None:
+                steps = None
+                if counter:
+                    steps_after = counter()
+                    steps = {axis: steps_after[axis] - steps_before.get(axis, 0) for axis in steps_after}
+                self.timer.add_phase(name, start, clock.monotonic(), steps, error)
+
+    async def home(self, name="home"):
+        return await self.step(name, self._home(), HOME_TIMEOUT, motion=True)
+
+    async def _home(self):
+        journal = self.journal
+        trusted = journal is not None and journal.confident
+        seek = await home()
+        if trusted:
+            journal.check_drift(get_drift_monitor().last)
+        return seek
+
+    async def origin(self, name="return-home"):
+        return await self.step(name, self._origin(), HOME_TIMEOUT, motion=True)
+
+    async def _origin(self):
+        # Trust lost earlier in the cycle, e.g. an endstop hit: home instead
+        if self.journal is not None and not self.journal.confident:
+            print(f"Position not trusted ({self.journal.reason}), homing instead of returning")
+            return await self._home()
+        return await return_home()
+
+    async def move(self, name, calibrated_x, calibrated_y):
+        timeout = manual_control.planned_move_time(calibrated_x, calibrated_y) + MOVE_TIMEOUT_MARGIN
+        return await self.step(name, move(calibrated_x, calibrated_y), timeout, motion=True)
+
+    async def spray(self, duration, name="spray"):
+        return await self.step(name, spray(duration), duration + ACTUATOR_TIMEOUT_MARGIN)
+
+    async def scrub(self, dwell, name="scrub"):
+        timeout = dwell + 2 * manual_control.SPONGE_TURN_TIME + ACTUATOR_TIMEOUT_MARGIN
+        return await self.step(name, scrub(dwell), timeout)
+
+
+async def run_step(engine, step):
+    """
+    Runs a compiled recipe step (see recipe.Step) on engine. Steps of a
+    sequence are only created when they start, so a cancelled sequence
+    leaves nothing behind.
+    """
+    if step.kind == "sequence":
+        for child in step.children:
+            await run_step(engine, child)
+    elif step.kind == "together":
+        await together(*(run_step(engine, child) for child in step.children))
+    elif step.kind == "home":
+        await engine.home(step.name)
+    elif step.kind == "origin":
+        await engine.origin(step.name)
+    elif step.kind == "move":
+        await engine.move(step.name, *step.args)
+    elif step.kind == "spray":
+        await engine.spray(*step.args, name=step.name)
+    elif step.kind == "scrub":
+        await engine.scrub(*step.args, name=step.name)
+    elif step.kind == "wait":
+        await sleep(*step.args)
+    else:
+        raise ValueError(f"unknown step kind {step.kind!r}")
+
+
+async def wash_cycle(plan, timer=None, journal=None):
+    """
+    Runs a compiled wash recipe, see recipe.compile_recipe.
+
+    :param plan: recipe.Plan
+    :param timer: optional CycleTimer
+    :param journal: optional PositionJournal
+    """
+    await run_step(CycleEngine(timer, journal), plan.root)
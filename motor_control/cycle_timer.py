@@ -0,0 +1,69 @@
+"""
+Per-phase timing of the wash cycle.
+
+The timer does not measure anything itself: CycleEngine.step times every
+step of a cycle and records it with add_phase().
+
+    timer = CycleTimer(step_counter=manual_control.steps_executed)
+    await run_step(CycleEngine(timer, journal), plan.root)
+    print(timer.summary())
+
+Phases are timed on the injectable clock, so simulated runs report the time
+the real rig would need. For motion steps the engine also records the
+microsteps every axis executed, read from step_counter. A disabled timer
+records nothing.
+"""
+from . import clock
+
+
+class CycleTimer:
+    """
+    Collects the phases of one cycle.
+
+    :param enabled: False makes add_phase() a no-op
+    :param step_counter: function returning dict axis -> microsteps executed so far
+    """
+
+    def __init__(self, enabled=True, step_counter=None):
+        self.enabled = enabled
+        self.step_counter = step_counter
+        self.phases = []
+        self.started_at = clock.monotonic() if enabled else None
+
+    def add_phase(self, name, start, end, steps=None, error=None):
+        """
+        Records one phase. start and end are clock.monotonic() times, steps
+        the microsteps per axis executed during it.
+        """
+        if not self.enabled:
+            return
+        phase = {
+            "name": name,
+            "start": round(start - self.started_at, 4),
+            "duration": round(end - start, 4),
+        }
+        if steps is not None:
+            phase["steps"] = steps
+        if error is not None:
+            phase["error"] = error
+        self.phases.append(phase)
+
+    def record(self):
+        """
+        The phases for the run record, None when disabled.
+        total is the time since the timer was created.
+        """
+        if not self.enabled:
+            return None
+        return {
+            "total": round(clock.monotonic() - self.started_at, 4),
+            "phases": sorted(self.phases, key=lambda phase: phase["start"]),
+        }
+
+    def summary(self):
+        """One line per phase, for printing after a cycle"""
+        lines = []
+        for phase in sorted(self.phases, key=lambda phase: phase["start"]):
+            steps = " ".join(f"{axis}={n}" for axis, n in sorted(phase.get("steps", {}).items()))
+            lines.append(f"{phase['name']:<15} {phase['start']:>8.2f} +{phase['duration']:>7.2f} s  {steps}")
+        return "\n".join(lines)
@@ -0,0 +1,169 @@
+"""
+Step loss detection from homing.
+
+Homing drives every axis until its endstop triggers, so when the position was
+known before, the fast seek measures lost steps for free: an axis tracked p
+microsteps from home needs p + backoff_steps microsteps to reach the trigger
+point. The difference is the drift, positive if the axis was further out than
+tracked.
+
+The monitor keeps the drift of the last WINDOW homings per axis, with the
+microsteps the axis moved in between. When the mean absolute drift over the
+window passes DRIFT_LIMIT the axis is losing steps: the monitor prints an
+alert and lowers the axis' max velocity for planned moves
+(manual_control.set_limits) by SLOW_DOWN, down to MIN_SPEED of the configured
+velocity. The rig can then be configured as fast as it might go and settles
+at a speed it tolerates. Lowered speeds last until the process restarts.
+"""
+import threading
+from collections import deque
+
+from . import manual_control
+
+# Homings per axis the rolling statistic covers
+WINDOW = 10
+
+# Homings needed before the monitor acts
+MIN_SAMPLES = 3
+
+# Mean absolute drift in microsteps that counts as step loss. Lower than the
+# journal's DRIFT_TOLERANCE on purpose: that one judges a single homing, which
+# includes the endstop's trigger scatter, while this mean over several homings
+# averages the scatter out, so a smaller steady loss already shows.
+DRIFT_LIMIT = 100
+
+# Factor the max velocity is lowered by on step loss, and the lowest fraction of the configured velocity
+SLOW_DOWN = 0.8
+MIN_SPEED = 0.5
+
+AXES = ("x", "y")
+
+
+class DriftMonitor:
+    """
+    Rolling per-axis drift statistic of the homings.
+
+    :param window: homings per axis in the statistic
+    :param drift_limit: mean absolute drift in microsteps that counts as step loss
+    :param adapt_speed: lower the max velocity on step loss, otherwise only alert
+    """
+
+    def __init__(self, window=WINDOW, drift_limit=DRIFT_LIMIT, adapt_speed=True):
+        self.window = window
+        self.drift_limit = drift_limit
+        self.adapt_speed = adapt_speed
+        self.last = None  # dict axis -> drift of the last homing, empty if no position was known
+        self.alerts = []  # (axis, message)
+        self._samples = {}  # axis -> deque of (drift, microsteps moved since the previous homing)
+        self._configured = {}  # axis -> AxisLimits before the first slow down
+        self._homed_at = {}  # axis -> executed microsteps at the last homing
+        self._lock = threading.Lock()
+
+    def homing_started(self, controller, axes):
+        """
+        Snapshot before a homing: the tracked positions of the axes whose
+        position is known, and the microsteps they moved since the last homing.
+        """
+        executed = controller.step_counts()
+        position = controller.position
+        return {
+            axis: (position[axis], executed[axis] - self._homed_at.get(axis, 0))
+            for axis in axes
+            if controller.tracker.homed(axis)
+        }
+
+    def homing_done(self, controller, before, seek_steps, backoff_steps):
+        """
+        Records a homing.
+
+        :param before: snapshot of homing_started
+        :param seek_steps: dict axis -> microsteps of the fast seek until the endstop
+        :param backoff_steps: dict axis -> microsteps between the trigger point and home
+        :return: dict axis -> drift in microsteps, for the axes whose position was known
+        """
+        executed = controller.step_counts()
+        drift = {}
+        with self._lock:
+            for axis in seek_steps:
+                self._homed_at[axis] = executed[axis]
+            for axis, (position, moved) in before.items():
+                drift[axis] = seek_steps[axis] - (position + backoff_steps[axis])
+                samples = self._samples.setdefault(axis, deque(maxlen=self.window))
+                samples.append((drift[axis], moved))
+            self.last = drift
+        for axis in drift:
+            self._check(axis)
+        return drift
+
+    def _check(self, axis):
+        with self._lock:
+            samples = list(self._samples[axis])
+        if len(samples) < MIN_SAMPLES:
+            return
+        mean = sum(abs(d) for d, _ in samples) / len(samples)
+        if mean <= self.drift_limit:
+            return
+
+        message = f"{axis.upper()} loses steps: mean drift {mean:.0f} microsteps over {len(samples)} homings"
+        if self.adapt_speed:
+            message += ", " + self._slow_down(axis)
+        print(f"ALERT: {message}")
+        with self._lock:
+            self.alerts.append((axis, message))
+            self._samples[axis].clear()  # the next samples are taken at the new speed
+
+    def _slow_down(self, axis):
+        limits = manual_control.get_limits(axis)
+        configured = self._configured.setdefault(axis, limits)
+        floor = configured.max_velocity * MIN_SPEED
+        if limits.max_velocity <= floor:
+            return f"already at the minimum of {limits.max_velocity:.0f} microsteps/s, check the mechanics"
+        velocity = max(limits.max_velocity * SLOW_DOWN, floor, limits.start_velocity or 0)
+        manual_control.set_limits(axis, limits._replace(max_velocity=velocity))
+        return f"max velocity lowered to {velocity:.0f} microsteps/s"
+
+    def restore_speed(self):
+        """Sets the max velocities back to the configured ones"""
+        with self._lock:
+            configured, self._configured = self._configured, {}
+        for axis, limits in configured.items():
+            manual_control.set_limits(axis, limits)
+
+    def stats(self):
+        """dict axis -> rolling drift statistic and current max velocity"""
+        with self._lock:
+            samples = {axis: list(values) for axis, values in self._samples.items()}
+        stats = {}
+        for axis in AXES:
+            values = samples.get(axis, [])
+            entry = {"homings": len(values), "max_velocity": manual_control.get_limits(axis).max_velocity}
+            if values:
+                moved = sum(m for _, m in values)
+                entry.update(
+                    mean_drift=round(sum(d for d, _ in values) / len(values), 1),
+                    mean_abs_drift=round(sum(abs(d) for d, _ in values) / len(values), 1),
+                    max_abs_drift=max(abs(d) for d, _ in values),
+                    # Lost microsteps per 100000 moved
+                    loss_rate=round(sum(abs(d) for d, _ in values) / moved * 100000, 2) if moved else None,
+                )
+            stats[axis] = entry
+        return stats
+
+
+_monitor = None
+
+
+def get_monitor():
+    """The process wide DriftMonitor"""
+    global _monitor
+
+    if _monitor is None:
+        _monitor = DriftMonitor()
+    return _monitor
+
+
+def set_monitor(monitor):
+    """Replaces the process wide monitor, e.g. with a fresh one on the simulated rig"""
+    global _monitor
+
+    _monitor = monitor
@@ -0,0 +1,99 @@
+"""
+Min endstops of the axes.
+
+Every endstop is a gpiozero Button without hardware debounce. A press is
+acted on right away, on its first edge: it calls the motion controller's
+endstop_hit, which aborts the pulse trains driving into the switch and queues
+the backoff. Presses within the debounce time of that press are contact
+bounce; they are counted and ignored.
+
+Per axis the endstop keeps:
+    presses       presses acted on
+    bounces       presses ignored as bounce
+    edge_to_stop  seconds from the press callback until the aborted train
+                  stopped its step output, the last LATENCY_SAMPLES presses
+"""
+import threading
+from collections import deque, namedtuple
+
+from . import clock
+
+# Seconds after a press in which further presses are bounce
+DEBOUNCE = 0.005
+
+# Edge-to-stop latencies kept per endstop
+LATENCY_SAMPLES = 100
+
+EndstopConfig = namedtuple("EndstopConfig", ["pin", "pull_up", "debounce"], defaults=(DEBOUNCE,))
+EndstopConfig.__doc__ = """
+Wiring of one min endstop.
+
+:param pin: BCM pin
+:param pull_up: True if the switch pulls the pin low when pressed
+:param debounce: seconds after a press in which further presses are ignored
+"""
+
+
+class Endstop:
+    """
+    Debounced min endstop of one axis.
+
+    :param axis: "x" or "y"
+    :param config: EndstopConfig
+    :param on_press: function(axis) called on a press, returns the aborted pulse trains
+    """
+
+    def __init__(self, axis, config, on_press):
+        self.axis = axis
+        self.config = config
+        self.on_press = on_press
+        self.button = None
+        self.presses = 0
+        self.bounces = 0
+        self.edge_to_stop = deque(maxlen=LATENCY_SAMPLES)
+        self._last_press = None
+        self._lock = threading.Lock()
+
+    def attach(self):
+        """Creates the Button and connects its presses"""
+        from gpiozero import Button
+
+        self.button = Button(self.config.pin, pull_up=self.config.pull_up)
+        self.button.when_pressed = self._pressed  # the flags are cleared once the backoff completes
+        return self.button
+
+    def is_pressed(self):
+        """Reads the switch, False while it is not attached"""
+        return self.button is not None and self.button.is_pressed
+
+    def close(self):
+        if self.button is not None:
+            self.button.close()
+            self.button = None
+
+    def _pressed(self):
+        t = clock.monotonic()
+        with self._lock:
+            # Contact bounce shows up as more presses right after the first one
+            if self._last_press is not None and t - self._last_press < self.config.debounce:
+                self.bounces += 1
+                return
+            self._last_press = t
+            self.presses += 1
+        for train in self.on_press(self.axis) or []:
+            train.add_done_callback(lambda _, t=t: self._stopped(t))
+
+    def _stopped(self, t):
+        latency = clock.monotonic() - t
+        with self._lock:
+            self.edge_to_stop.append(latency)
+
+    def stats(self):
+        """presses, bounces and edge-to-stop latency in milliseconds"""
+        with self._lock:
+            samples = sorted(self.edge_to_stop)
+            stats = {"presses": self.presses, "bounces": self.bounces, "edge_to_stop_samples": len(samples)}
+        if samples:
+            stats["edge_to_stop_mean_ms"] = round(sum(samples) / len(samples) * 1000, 3)
+            stats["edge_to_stop_max_ms"] = round(samples[-1] * 1000, 3)
+        return stats
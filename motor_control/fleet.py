@@ -0,0 +1,385 @@
+"""
+Fleet of washer rigs: a rig agent per Pi and one coordinator.
+
+Every rig runs an agent, a WashService with a TCP server on its event loop.
+The coordinator connects to the agents, dispatches wash jobs and collects the
+run record of every cycle. It staggers the starts and caps the number of
+rigs washing at the same time, so the pumps and steppers of the fleet never
+all draw their peak current together (homing and the first moves of a cycle
+draw the most).
+
+Protocol: one JSON object per line in both directions.
+
+    -> {"op": "status"}
+    <- {"event": "status", "rig": "rig-1", "busy": false, "cycles": 3}
+    -> {"op": "wash", "job": 7}
+    <- {"event": "accepted", "job": 7}          or {"event": "busy", "job": 7}
+    <- {"event": "finished", "job": 7, "run": {...run record...}}
+
+Unknown ops and malformed lines are answered with {"event": "error", "error": ...}.
+An agent with --sim runs on the simulated rig, so a coordinator can be load
+tested with dozens of virtual rigs (one agent process each) on one machine.
+
+Usage:
+    python -m motor_control.fleet agent --port 7300 [--sim]
+    python -m motor_control.fleet run --rig pi-1:7300 --rig pi-2:7300 --cycles 5
+    python -m motor_control.fleet loadtest --rigs 24 --cycles 3 --max-active 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from .run_history import _percentile
+
+PORT = 7300
+
+# Rigs washing at the same time, and seconds between two cycle starts
+MAX_ACTIVE = 2
+STAGGER = 5.0
+
+# Seconds a rig may take for one cycle before its job counts as lost
+JOB_TIMEOUT = 300.0
+
+
+def _encode(message):
+    return (json.dumps(message) + "\n").encode()
+
+
+# =================== Rig Agent ===================
+
+
+class RigAgent:
+    """
+    Serves the fleet protocol for one WashService, on the service's event loop.
+
+    :param service: WashService, started with serve() on the same loop
+    :param name: rig name reported to the coordinator
+    """
+
+    def __init__(self, service, name=None):
+        self.service = service
+        self.name = name or socket.gethostname()
+        self._server = None
+
+    async def start(self, host="0.0.0.0", port=PORT):
+        self._server = await asyncio.start_server(self._client, host, port)
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+
+        def send(message):
+            if not writer.is_closing():
+                writer.write(_encode(message))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    op = message["op"]
+                except (ValueError, KeyError, TypeError):
+                    send({"event": "error", "error": "expected a JSON object with an op"})
+                    continue
+
+                if op == "status":
+                    send({
+                        "event": "status", "rig": self.name,
+                        "busy": self.service.busy(), "cycles": self.service.cycles,
+                    })
+                elif op == "wash":
+                    job = message.get("job")
+
+                    def finished(run, job=job):
+                        # on_done runs on the service loop, which is this loop
+                        loop.call_soon(send, {"event": "finished", "job": job, "run": run})
+
+                    accepted = self.service.request_wash(on_done=finished)
+                    send({"event": "accepted" if accepted else "busy", "job": job})
+                else:
+                    send({"event": "error", "error": f"unknown op {op!r}"})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def run_agent(host="0.0.0.0", port=PORT, name=None, sim=False):
+    """Runs a wash service with a rig agent until SIGTERM or SIGINT"""
+    from .wash_service import WashService, sd_notify
+
+    if sim:
+        from .sim import SimRig
+
+        rig = SimRig().install()
+        service = WashService(record=False, log=lambda message: None)
+    else:
+        rig = None
+        service = WashService()
+
+    async def run():
+        serving = asyncio.create_task(service.serve(handle_signals=True))
+        await service.wait_ready(serving)
+        agent = RigAgent(service, name)
+        await agent.start(host, port)
+        print(f"Rig agent {agent.name} listening on {host}:{port}", flush=True)
+        sd_notify("READY=1")
+        try:
+            await serving
+        finally:
+            agent.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        if rig is not None:
+            rig.uninstall()
+
+
+# =================== Coordinator ===================
+
+
+class RigLink:
+    """Connection of the coordinator to one rig agent"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.runs = []  # (job, run record, seconds from dispatch to finished)
+        self._reader = None
+        self._writer = None
+        self._pending = {}  # job -> future of the finished event
+        self._reply = None
+        self._receiver = None
+
+    async def connect(self, timeout=10.0):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout
+        )
+        self._receiver = asyncio.create_task(self._receive())
+        status = await self.request({"op": "status"})
+        self.name = status.get("rig", self.name)
+        return status
+
+    async def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+    async def request(self, message):
+        """Sends message and returns the direct reply"""
+        self._reply = asyncio.get_running_loop().create_future()
+        self._writer.write(_encode(message))
+        await self._writer.drain()
+        return await self._reply
+
+    async def wash(self, job, timeout=JOB_TIMEOUT):
+        """
+        Runs one cycle on the rig and returns its run record.
+        Raises RuntimeError if the rig is busy.
+        """
+        finished = asyncio.get_running_loop().create_future()
+        self._pending[job] = finished
+        try:
+            reply = await self.request({"op": "wash", "job": job})
+            if reply["event"] != "accepted":
+                raise RuntimeError(f"{self.name} is {reply['event']}")
+            return await asyncio.wait_for(finished, timeout)
+        finally:
+            self._pending.pop(job, None)
+
+    async def _receive(self):
+        error = ConnectionError(f"{self.name} closed the connection")
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message.get("event") == "finished":
+                    future = self._pending.get(message.get("job"))
+                    if future is not None and not future.done():
+                        future.set_result(message["run"])
+                elif self._reply is not None and not self._reply.done():
+                    self._reply.set_result(message)
+        except (ConnectionError, ValueError) as e:
+            error = e
+        for future in [self._reply, *self._pending.values()]:
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+
+class Coordinator:
+    """
+    Dispatches wash jobs to rig agents.
+
+    At most max_active rigs wash at the same time and two cycle starts are at
+    least stagger seconds apart.
+
+    :param rigs: list of (host, port)
+    """
+
+    def __init__(self, rigs, max_active=MAX_ACTIVE, stagger=STAGGER, log=print):
+        self.links = [RigLink(host, port) for host, port in rigs]
+        self.max_active = max_active
+        self.stagger = stagger
+        self.log = log
+        self.failures = []  # (rig, job, error)
+        self._slots = None
+        self._start_lock = None
+        self._last_start = None
+        self._jobs = 0
+
+    async def connect(self):
+        await asyncio.gather(*(link.connect() for link in self.links))
+        self.log(f"Connected to {len(self.links)} rigs")
+
+    async def close(self):
+        await asyncio.gather(*(link.close() for link in self.links))
+
+    async def run(self, cycles=1):
+        """Runs cycles wash cycles on every rig, returns the wall time in seconds"""
+        self._slots = asyncio.Semaphore(self.max_active)
+        self._start_lock = asyncio.Lock()
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_rig(link, cycles) for link in self.links))
+        return time.perf_counter() - started
+
+    async def _run_rig(self, link, cycles):
+        for _ in range(cycles):
+            async with self._slots:
+                await self._wait_stagger()
+                self._jobs += 1
+                job = self._jobs
+                dispatched = time.perf_counter()
+                try:
+                    run = await link.wash(job)
+                except (RuntimeError, ConnectionError, asyncio.TimeoutError) as e:
+                    self.log(f"{link.name} job {job} failed: {e}")
+                    self.failures.append((link.name, job, str(e)))
+                    continue
+                link.runs.append((job, run, time.perf_counter() - dispatched))
+                self.log(f"{link.name} job {job}: {run.get('outcome')}")
+
+    async def _wait_stagger(self):
+        async with self._start_lock:
+            if self._last_start is not None:
+                wait = self._last_start + self.stagger - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self._last_start = time.perf_counter()
+
+    def summary(self, wall=None):
+        """Per-rig cycle counts and durations, then fleet totals"""
+        lines = [f"{'rig':<22} {'cycles':>6} {'ok':>4} {'mean s':>8} {'p95 s':>8} {'wall s':>8}"]
+        all_durations = []
+        for link in self.links:
+            durations = [run["timing"]["total"] for _, run, _ in link.runs if run.get("timing")]
+            all_durations += durations
+            ok = sum(1 for _, run, _ in link.runs if run.get("outcome") == "completed")
+            mean = sum(durations) / len(durations) if durations else 0.0
+            p95 = _percentile(sorted(durations), 0.95) if durations else 0.0
+            wall_mean = sum(w for _, _, w in link.runs) / len(link.runs) if link.runs else 0.0
+            lines.append(f"{link.name:<22} {len(link.runs):>6} {ok:>4} {mean:>8.2f} {p95:>8.2f} {wall_mean:>8.2f}")
+        cycles = sum(len(link.runs) for link in self.links)
+        lines.append(f"{cycles} cycles, {len(self.failures)} failed")
+        if wall:
+            lines.append(f"Fleet: {wall:.1f} s wall, {cycles / wall * 3600:.0f} cycles/h")
+        return "\n".join(lines)
+
+
+def _parse_rig(value):
+    host, _, port = value.rpartition(":")
+    return (host or "localhost", int(port or PORT))
+
+
+async def _coordinate(rigs, cycles, max_active, stagger):
+    coordinator = Coordinator(rigs, max_active, stagger)
+    await coordinator.connect()
+    try:
+        wall = await coordinator.run(cycles)
+    finally:
+        await coordinator.close()
+    print(coordinator.summary(wall))
+    return 1 if coordinator.failures else 0
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_test(rigs, cycles, max_active, stagger):
+    """Starts rigs simulated agents on this machine and coordinates them"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ports = [_free_port() for _ in range(rigs)]
+    agents = [
+        subprocess.Popen(
+            [sys.executable, "-m", "motor_control.fleet", "agent", "--sim",
+             "--host", "127.0.0.1", "--port", str(port), "--name", f"sim-{i + 1}"],
+            cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for i, port in enumerate(ports)
+    ]
+    try:
+        for agent in agents:
+            # The agent prints its listening line once its rig is ready
+            for line in agent.stdout:
+                if line.startswith("Rig agent"):
+                    break
+            else:
+                raise RuntimeError("a simulated rig agent did not start")
+        return asyncio.run(_coordinate([("127.0.0.1", port) for port in ports], cycles, max_active, stagger))
+    finally:
+        for agent in agents:
+            agent.terminate()
+        for agent in agents:
+            agent.wait(timeout=10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Washer rig fleet: agents and coordinator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    agent = commands.add_parser("agent", help="serve this rig to a coordinator")
+    agent.add_argument("--host", default="0.0.0.0")
+    agent.add_argument("--port", type=int, default=PORT)
+    agent.add_argument("--name", help="rig name, the hostname by default")
+    agent.add_argument("--sim", action="store_true", help="run on the simulated rig")
+
+    for name, help_text in (("run", "run cycles on rig agents"), ("loadtest", "run cycles on simulated agents")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--cycles", type=int, default=1, help="cycles per rig")
+        command.add_argument("--max-active", type=int, default=MAX_ACTIVE, help="rigs washing at the same time")
+        command.add_argument("--stagger", type=float, default=STAGGER, help="seconds between cycle starts")
+        if name == "run":
+            command.add_argument("--rig", action="append", type=_parse_rig, required=True, help="host:port of an agent")
+        else:
+            command.add_argument("--rigs", type=int, default=8, help="simulated rigs")
+
+    args = parser.parse_args(argv)
+    if args.command == "agent":
+        run_agent(args.host, args.port, args.name, args.sim)
+        return 0
+    if args.command == "run":
+        return asyncio.run(_coordinate(args.rig, args.cycles, args.max_active, args.stagger))
+    return load_test(args.rigs, args.cycles, args.max_active, args.stagger)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
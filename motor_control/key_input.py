@@ -0,0 +1,174 @@
+"""
+Keyboard input of manual control and calibration.
+
+KeyReader puts the terminal in cbreak mode and blocks in select until a key
+arrives, a held key is released or wake() is called from another thread
+(through a self-pipe), so a listener uses no CPU while nobody types.
+
+Terminals send no key-up events. A held key arrives as the same key repeated
+by the terminal's auto-repeat, REPEAT_GAP apart or faster once the initial
+delay is over. For the keys in hold_keys KeyReader turns that into events:
+
+    press      the key was typed
+    hold       the key repeats, it is being held down
+    release    a held key stopped repeating for RELEASE_GAP, or another key was typed
+
+Other keys only ever give press events. Every event carries t, the clock time
+the key was read, which MotionLatency uses for the keystroke-to-motion latency.
+"""
+import os
+import select
+import sys
+import termios
+import tty
+from collections import deque, namedtuple
+
+from . import clock
+
+# Seconds between auto-repeated keys at most, a slower repeat is a new press
+REPEAT_GAP = 0.1
+
+# Seconds without a repeat after which a held key counts as released
+RELEASE_GAP = 0.2
+
+# Seconds after which a key that started no motion is not matched to a later train
+LATENCY_WINDOW = 1.0
+
+KeyEvent = namedtuple("KeyEvent", ["key", "kind", "t"])
+KeyEvent.__doc__ = """
+One key event of a KeyReader.
+
+:param key: the character, lower case
+:param kind: "press", "hold" or "release"
+:param t: clock time the key was read
+"""
+
+
+class KeyReader:
+    """
+    Blocking keyboard reader with hold detection.
+
+    :param hold_keys: keys that give hold and release events when held down
+    :param fd: file descriptor to read, stdin by default
+    """
+
+    def __init__(self, hold_keys=(), fd=None):
+        self.hold_keys = set(hold_keys)
+        self.fd = sys.stdin.fileno() if fd is None else fd
+        self._events = deque()
+        self._last = None  # (key, t) of the last key of hold_keys
+        self._held = None  # key of hold_keys being held down
+        self._old_settings = None
+        self._wake_r, self._wake_w = os.pipe()
+        self._closed = False
+
+    def __enter__(self):
+        if os.isatty(self.fd):
+            self._old_settings = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Restores the terminal settings"""
+        if self._old_settings is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self._old_settings)
+            self._old_settings = None
+        if not self._closed:
+            self._closed = True
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def wake(self):
+        """Makes a blocked read() return None. Callable from any thread and signal handlers."""
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            pass  # closed, or the pipe is full and read() wakes anyway
+
+    def read(self, timeout=None):
+        """
+        Blocks until the next KeyEvent and returns it. Returns None after
+        timeout seconds, when woken and at the end of the input.
+        """
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        while not self._events:
+            now = clock.monotonic()
+            release_at = self._last[1] + RELEASE_GAP if self._held is not None else None
+            if release_at is not None and now >= release_at:
+                self._release(now)
+                break
+            if deadline is not None and now >= deadline:
+                return None
+            wait = min((t for t in (deadline, release_at) if t is not None), default=None)
+            ready, _, _ = select.select([self.fd, self._wake_r], [], [], None if wait is None else wait - now)
+            if self._wake_r in ready:
+                os.read(self._wake_r, 64)
+                return None
+            if self.fd in ready:
+                data = os.read(self.fd, 64)
+                if not data:
+                    return None
+                t = clock.monotonic()
+                for char in data.decode(errors="ignore"):
+                    self._key(char.lower(), t)
+        return self._events.popleft()
+
+    def _key(self, key, t):
+        if self._held is not None:
+            if key == self._held:
+                self._last = (key, t)  # still held
+                return
+            self._release(t)
+        if key not in self.hold_keys:
+            self._last = None
+            self._events.append(KeyEvent(key, "press", t))
+            return
+        repeat = self._last is not None and self._last[0] == key and t - self._last[1] < REPEAT_GAP
+        if repeat:
+            self._held = key
+        self._events.append(KeyEvent(key, "hold" if repeat else "press", t))
+        self._last = (key, t)
+
+    def _release(self, t):
+        self._events.append(KeyEvent(self._held, "release", t))
+        self._held = None
+        self._last = None
+
+
+# =================== Latency ===================
+
+
+class MotionLatency:
+    """
+    Keystroke-to-motion latency: the time from reading a key to the start of
+    the first pulse train it caused.
+    """
+
+    def __init__(self):
+        self.samples = []  # seconds
+        self._pending = None
+
+    def expect(self, controller, t):
+        """Measures the next train start of controller against the key read at clock time t"""
+        token = self._pending = object()
+
+        def started(start):
+            # Only the latest key counts, and a key that moved nothing must not match a later train
+            if token is self._pending and start - t <= LATENCY_WINDOW:
+                self.samples.append(start - t)
+
+        controller.notify_next_start(started)
+
+    def summary(self):
+        if not self.samples:
+            return "Key to motion: no samples"
+        from .run_history import _percentile
+
+        ordered = sorted(self.samples)
+        return (
+            f"Key to motion over {len(ordered)} keys: mean {sum(ordered) / len(ordered) * 1000:.1f} ms, "
+            f"p95 {_percentile(ordered, 0.95) * 1000:.1f} ms, max {ordered[-1] * 1000:.1f} ms"
+        )
@@ -1,32 +1,24 @@
 """
 This file is the base for the control of the robot. It allows for manual control of the motors via keyboard input.
 """
-import sys
-import termios
-import tty
-import time
-import serial
+import signal
 import threading
+from . import clock
 from .DRV8825 import DRV8825
-from gpiozero import Button
-from gpiozero import Device
-from gpiozero.pins.rpigpio import RPiGPIOFactory
-from gpiozero import Motor, Servo
+from .endstops import Endstop, EndstopConfig
+from .key_input import KeyReader, MotionLatency
+from .microstep import FINE_MODE
+from .motion_controller import MotionController
+from .motion_planner import AxisLimits, plan_xy
+from .position_tracker import AxisTravel, PositionTracker
 
-# =================== Global Variables ===================
+# gpiozero is imported where devices are created, importing this module touches no hardware
 
-is_moving_forward = False  # single step
-is_moving_backward = False  # single step
-continuous_forward = False  # toggle
-continuous_backward = False  # toggle
-is_moving_left = False  # single step
-is_moving_right = False  # single step
-continuous_left = False  # toggle
-continuous_right = False  # toggle
+# =================== Global Variables ===================
 
+# Seconds the sponge servo needs for each turn of rotate_sponge
+SPONGE_TURN_TIME = 2.5
 
-y_axis = 0  # Used for calibration counter
-x_axis = 0  # Used for calibration counter
 running = True
 
 # Motor instances
@@ -37,6 +29,14 @@ servo = None
 y_min = None
 x_min = None
 DeviceFactory = None
+controller = None  # MotionController, all motion commands go through it
+endstops = {}  # axis -> Endstop
+keyboard = None  # KeyReader of the running keyboard listener
+
+# Hardware overrides, installed by sim.SimRig to run without a Pi
+gpio_module = None  # replaces RPi.GPIO in DRV8825
+pulse_backend = None  # replaces the default pulse backend of DRV8825
+pin_factory = None  # replaces RPiGPIOFactory for the gpiozero devices
 
 # Ensures that variables work across threads
 y_min_pressed = threading.Event()
@@ -48,6 +48,14 @@ x_backoff_running = threading.Event()
 Y_MIN_PIN = 6
 X_MIN_PIN = 5
 
+# Pull up is not the same, this is likely a hardware issue and could easily not work in the future
+Y_MIN_PULL_UP = False
+X_MIN_PULL_UP = True
+
+# Debounce per endstop, measure the bounce counts (command API "endstops") before changing it
+Y_ENDSTOP = EndstopConfig(Y_MIN_PIN, Y_MIN_PULL_UP, debounce=0.005)
+X_ENDSTOP = EndstopConfig(X_MIN_PIN, X_MIN_PULL_UP, debounce=0.005)
+
 #  ----- GPIO Pins for motors and pumps -----
 
 # Motor 1 (Y Axis)
@@ -67,34 +75,37 @@ MODE2 = (21, 22, 27)  # Microstep pins
 IN1 = 9  # Direction pin 1
 IN2 = 10  # Direction pin 2
 
+# Half period of a step pulse in seconds. Pulses are timed by the pulse backend,
+# so this is the real step rate: 10 kHz microsteps, about 1.5 rev/s at 1/32 step
+STEP_DELAY = 0.00005
 
-# =================== Functions for keyboard input ==================
+# Microsteps per jog step and per calibration count
+JOG_STEPS = 20
 
+# Microsteps driven away from an endstop after it was hit
+BACKOFF_STEPS = 1600
 
-def get_key_nonblocking():
-    """
-    Get key press from keyboard
-    """
-    import select
+# Motion limits per axis in microsteps (1/32 step), used by move_to_position.
+# Start velocity is the old constant jog speed, which never stalled from standstill.
+Y_LIMITS = AxisLimits(max_velocity=32000, max_acceleration=40000, max_jerk=400000, start_velocity=8000)
+X_LIMITS = AxisLimits(max_velocity=32000, max_acceleration=40000, max_jerk=400000, start_velocity=8000)
+
+# Travel per axis: microsteps per mm and the soft max limit in microsteps from home.
+# 160 steps/mm is 6400 microsteps/rev on a GT2 belt with a 20 tooth pulley (40 mm/rev).
+# The soft limits stay clear of the far end of the frame; measure them per rig.
+Y_TRAVEL = AxisTravel(steps_per_mm=160, max_steps=190000)
+X_TRAVEL = AxisTravel(steps_per_mm=160, max_steps=190000)
 
-    dr, _, _ = select.select([sys.stdin], [], [], 0)
-    if dr:
-        return sys.stdin.read(1)
-    return None
+
+# =================== Functions for keyboard input ==================
 
 
 def keyboard_listener():
     """
     Terminal-based listener for keyboard control.
+    Every key is turned into a command for the motion controller.
     """
-    global is_moving_forward, is_moving_backward
-    global continuous_forward, continuous_backward, running
-    global is_moving_left, is_moving_right
-    global continuous_left, continuous_right
-
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    tty.setcbreak(fd)
+    global running, keyboard
 
     print("Controls:")
     print("  W = toggle continuous up")
@@ -104,95 +115,122 @@ def keyboard_listener():
     print("  R = Rotate Sponge")
     print("  E = Pump One Forward")
     print("  Q = Pump Two Forward")
-    print("  X = Step right")
-    print("  Z = Step left")
-    print("  Y = Step up")
-    print("  H = Step Down")
+    print("  X = Step right (hold to keep moving)")
+    print("  Z = Step left (hold to keep moving)")
+    print("  Y = Step up (hold to keep moving)")
+    print("  H = Step Down (hold to keep moving)")
     print("  SPACE = stop")
     print("  ESC = quit")
 
-    try:
+    latency = MotionLatency()
+    with KeyReader(hold_keys=HOLD_KEYS) as keyboard:
         while running:
-            key = get_key_nonblocking()
-            if not key:
-                time.sleep(0.01)
-                continue
+            event = keyboard.read()  # blocks until a key or stop_keyboard_listener()
+            if event is None:
+                break
 
-            key = key.lower()
-
-            if key == "w":
-                continuous_forward = not continuous_forward
-                if continuous_forward:
-                    continuous_backward = False  # stop opposite modes
-                    continuous_left = False
-                    continuous_right = False
-
-            elif key == "a":
-                continuous_left = not continuous_left
-                if continuous_left:
-                    continuous_right = False  # stop opposite modes
-                    continuous_backward = False
-                    continuous_forward = False
-            elif key == "s":
-                continuous_backward = not continuous_backward
-                if continuous_backward:
-                    continuous_forward = False  # stop opposite modes
-                    continuous_left = False
-                    continuous_right = False
-            elif key == "d":
-                continuous_right = not continuous_right
-                if continuous_right:
-                    continuous_left = False  # stop opposite modes
-                    continuous_backward = False
-                    continuous_forward = False
-            elif key == "r":
+            if event.key in MOTION_KEYS:
+                handle_motion_key(event, latency)
+            elif event.kind != "press":
+                continue
+            elif event.key == "r":
                 rotate_sponge()
-            elif key == "e":
-                pump_one_forward(speed=1, duration=10)
-            elif key == "z":
-                is_moving_left = True
-            elif key == "x":
-                is_moving_right = True
-            elif key == "y":
-                is_moving_forward = True
-            elif key == "h":
-                is_moving_backward = True
-
-            elif key == " ":  # SPACE
-                continuous_forward = False
-                continuous_backward = False
-                is_moving_forward = False
-                is_moving_backward = False
-
-            elif key == "\x1b":  # ESC
+            elif event.key == "e":
+                pump_one_forward(duration=10)
+
+            elif event.key == "\x1b":  # ESC
                 running = False
                 break
+    keyboard = None
+    print(latency.summary())
+
 
-    finally:
-        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+def stop_keyboard_listener():
+    """Ends the keyboard listener from another thread or a signal handler"""
+    global running
+
+    running = False
+    if keyboard is not None:
+        keyboard.wake()
 
 
 # =================== Motor Control Functions ===================
 
 
-def step_motor_forward():
-    global Motor1
-    Motor1.TurnStep(Dir="forward", steps=20, stepdelay=0.00000001)
+# Motion keys shared by manual control and calibration: key -> (command, axis, direction)
+MOTION_KEYS = {
+    "w": ("continuous", "y", "forward"),  # up
+    "s": ("continuous", "y", "backward"),  # down
+    "a": ("continuous", "x", "backward"),  # left
+    "d": ("continuous", "x", "forward"),  # right
+    "y": ("jog", "y", "forward"),
+    "h": ("jog", "y", "backward"),
+    "z": ("jog", "x", "backward"),
+    "x": ("jog", "x", "forward"),
+    " ": ("stop", None, None),
+}
 
 
-def step_motor_backward():
-    global Motor1
-    Motor1.TurnStep(Dir="backward", steps=20, stepdelay=0.00000001)
+# Step keys that move continuously while held down
+HOLD_KEYS = tuple(key for key, (kind, _, _) in MOTION_KEYS.items() if kind == "jog")
 
 
-def step_motor_right():
-    global Motor2
-    Motor2.TurnStep(Dir="forward", steps=20, stepdelay=0.00000001)
+def handle_motion_key(event, latency=None):
+    """
+    Submits the motion of a KeyEvent of a MOTION_KEYS key. Holding a step key
+    moves its axis continuously until the key is let go.
 
+    :param latency: optional MotionLatency the key is measured with
+    """
+    kind, axis, direction = MOTION_KEYS[event.key]
+    if event.kind == "release":
+        controller.release(axis, direction)
+        return
+    if latency is not None and kind != "stop":
+        latency.expect(controller, event.t)
+    if event.kind == "hold":
+        controller.hold(axis, direction)
+    else:
+        submit_motion_key(event.key)
 
-def step_motor_left():
-    global Motor2
-    Motor2.TurnStep(Dir="backward", steps=20, stepdelay=0.00000001)
+
+def submit_motion_key(key):
+    """
+    Submits the motion command bound to key to the motion controller.
+    """
+    kind, axis, direction = MOTION_KEYS[key]
+    if kind == "stop":
+        controller.stop()
+    elif kind == "continuous":
+        controller.continuous(axis, direction)
+    else:
+        controller.jog(axis, direction)
+
+
+def position_counts():
+    """
+    Current (x, y) position in calibration counts of JOG_STEPS microsteps.
+    """
+    return (
+        round(controller.position["x"] / JOG_STEPS),
+        round(controller.position["y"] / JOG_STEPS),
+    )
+
+
+def position_mm():
+    """
+    Current {"x", "y"} position in millimetres from home.
+    """
+    return controller.tracker.positions_mm()
+
+
+def steps_executed():
+    """
+    Microsteps output per axis since the motion controller started, {} without a controller.
+    """
+    if controller is None:
+        return {}
+    return controller.step_counts()
 
 
 def rotate_sponge():
@@ -202,9 +240,9 @@ def rotate_sponge():
         return
 
     servo.min()
-    time.sleep(2.5)  # wait for servo to move
+    clock.sleep(SPONGE_TURN_TIME)  # wait for servo to move
     servo.max()
-    time.sleep(2.5)  # wait for servo to move
+    clock.sleep(SPONGE_TURN_TIME)  # wait for servo to move
     servo.mid()  # stop signal
     servo.detach()
 
@@ -215,218 +253,211 @@ def pump_one_forward(duration=10):
     """
     global pump1
     pump1.forward()
-    time.sleep(duration)
+    clock.sleep(duration)
     pump1.stop()
 
 
+def set_pin_factory():
+    """
+    Sets the gpiozero pin factory, unless one was already set.
+    Pin factory for gpiozero, as there were poblems when not set. It looked like there were multiple conflicting pin factories.
+    """
+    from gpiozero import Device
+
+    if pin_factory is not None:
+        Device.pin_factory = pin_factory
+        return
+
+    # Imported here, it needs RPi.GPIO which only exists on the Pi
+    from gpiozero.pins.rpigpio import RPiGPIOFactory
+
+    if not isinstance(Device.pin_factory, RPiGPIOFactory):
+        Device.pin_factory = RPiGPIOFactory()
+
+
+def initialize_endstops():
+    """
+    Creates the debounced endstops, see endstops.py, and returns their buttons.
+    """
+    global endstops
+
+    endstops = {"y": Endstop("y", Y_ENDSTOP, on_endstop_pressed), "x": Endstop("x", X_ENDSTOP, on_endstop_pressed)}
+    return endstops["y"].attach(), endstops["x"].attach()
+
+
+def endstop_pressed(axis):
+    """True while the min endstop switch of axis is pressed, False if it is not attached"""
+    endstop = endstops.get(axis)
+    return endstop is not None and endstop.is_pressed()
+
+
 def initialize_motors():
     """
     Initializes motors with pin layout
     """
     global IN1, IN2, DIR1, STEP1, ENABLE1, MODE1, DIR2, STEP2, ENABLE2, MODE2
 
-    Motor1 = DRV8825(dir_pin=DIR1, step_pin=STEP1, enable_pin=ENABLE1, mode_pins=MODE1)
-    Motor1.SetMicroStep("softward", "1/32step")
+    from gpiozero import Motor
+
+    Motor1 = DRV8825(
+        dir_pin=DIR1, step_pin=STEP1, enable_pin=ENABLE1, mode_pins=MODE1,
+        pulse_backend=pulse_backend, gpio=gpio_module,
+    )
+    Motor1.SetMicroStep("softward", FINE_MODE)
 
-    Motor2 = DRV8825(dir_pin=DIR2, step_pin=STEP2, enable_pin=ENABLE2, mode_pins=MODE2)
-    Motor2.SetMicroStep("softward", "1/32step")
+    Motor2 = DRV8825(
+        dir_pin=DIR2, step_pin=STEP2, enable_pin=ENABLE2, mode_pins=MODE2,
+        pulse_backend=pulse_backend, gpio=gpio_module,
+    )
+    Motor2.SetMicroStep("softward", FINE_MODE)
 
     pump1 = Motor(forward=IN1, backward=IN2)
 
     return Motor1, Motor2, pump1
 
 
-def motor_control_loop():
-    global running
-    global is_moving_forward, is_moving_backward
-    global continuous_forward, continuous_backward
-    global is_moving_left, is_moving_right
-    global continuous_left, continuous_right
-    global y_axis, x_axis
-    global Motor1, Motor2
+def initialize_servo():
+    """
+    Creates the sponge servo, detached so it does not move. Returns None if it cannot be created.
+    """
+    from gpiozero import Servo
+
+    try:
+        servo = Servo(26)
+        servo.detach()  # VERY IMPORTANT
+        return servo
+    except Exception as e:
+        print(f"Servo init failed: {e}")
+        return None
+
 
-    while running:
-        # -------- Y AXIS --------
-        if is_moving_forward or continuous_forward or y_backoff_running.is_set():
-            # Allow forward movement for backoff even if Y endstop is pressed
-            if not y_min_pressed.is_set() or y_backoff_running.is_set():
-                step_motor_forward()
-                y_axis += 1
-            # else: (no else needed, as forward is always safe)
-            is_moving_forward = False  # single step consumed
-
-        if is_moving_backward or continuous_backward:
-            # Don't move backward if Y endstop is pressed
-            if not y_min_pressed.is_set():
-                step_motor_backward()
-                y_axis -= 1
-            else:
-                # Stop continuous motion if endstop hit
-                continuous_backward = False
-            is_moving_backward = False
-
-        # -------- X AXIS --------
-        if is_moving_left or continuous_left:
-            # Don't move left if we might hit something (add upper limit check if available)
-            step_motor_left()
-            x_axis -= 1
-            is_moving_left = False  # single step consumed
-
-        if is_moving_right or continuous_right or x_backoff_running.is_set():
-            # Allow right movement for backoff even if X endstop is pressed
-            if not x_min_pressed.is_set() or x_backoff_running.is_set():
-                step_motor_right()
-                x_axis += 1
-            else:
-                # Stop continuous motion if endstop hit
-                continuous_right = False
-            is_moving_right = False
-
-        # Small sleep to prevent CPU hog
-        time.sleep(0.005)
-
-
-def move_to_position(calibrated_x, calibrated_y, step_delay=0.0000001):
+def start_motion_controller():
     """
-    Moves device to the calibrated position.
-    Steps are always positive; direction is determined by sign of coordinates.
-    Stops immediately if endstop is hit while moving backward.
+    Creates the motion controller for Motor1 (Y) and Motor2 (X) and starts its thread.
     """
-    global Motor1, Motor2
+    global controller
+
+    controller = MotionController(
+        motors={"x": Motor2, "y": Motor1},
+        min_pressed={"x": x_min_pressed, "y": y_min_pressed},
+        backoff_running={"x": x_backoff_running, "y": y_backoff_running},
+        step_delay=STEP_DELAY,
+        jog_steps=JOG_STEPS,
+        backoff_steps=BACKOFF_STEPS,
+        tracker=PositionTracker({"x": X_TRAVEL, "y": Y_TRAVEL}),
+        switch_pressed=endstop_pressed,
+    )
+    controller.start()
+    return controller
+
+
+def stop_motion_controller():
+    """
+    Stops all motion and the controller thread.
+    """
+    global controller
 
-    # Move Y axis
-    steps_y = abs(calibrated_y)
-    dir_y = "forward" if calibrated_y >= 0 else "backward"
-    for _ in range(steps_y):
-        # Stop if endstop hit while moving backward
-        if dir_y == "backward" and y_min_pressed.is_set():
-            break
-        Motor1.TurnStep(Dir=dir_y, steps=20, stepdelay=step_delay)
-
-    # Move X axis
-    steps_x = abs(calibrated_x)
-    dir_x = "forward" if calibrated_x >= 0 else "backward"
-    for _ in range(steps_x):
-        # Stop if endstop hit while moving backward
-        if dir_x == "backward" and x_min_pressed.is_set():
-            break
-        Motor2.TurnStep(Dir=dir_x, steps=20, stepdelay=step_delay)
+    if controller is not None:
+        controller.shutdown()
+        controller = None
 
 
-# ================== Endstop Handling Functions ===================
+def get_limits(axis):
+    """
+    AxisLimits of planned moves of axis ("x" or "y")
+    """
+    return {"x": X_LIMITS, "y": Y_LIMITS}[axis]
 
 
-def stop_all_motion():
+def set_limits(axis, limits):
     """
-    Stops all motor motion by resetting all movement flags.
+    Replaces the AxisLimits of planned moves of axis ("x" or "y"), e.g. a
+    lowered max velocity. Moves planned afterwards use them, running moves
+    keep theirs.
     """
-    global is_moving_forward, is_moving_backward
-    global is_moving_left, is_moving_right
-    global continuous_forward, continuous_backward
-    global continuous_left, continuous_right
+    global X_LIMITS, Y_LIMITS
 
-    is_moving_forward = False
-    is_moving_backward = False
-    is_moving_left = False
-    is_moving_right = False
+    if axis == "x":
+        X_LIMITS = limits
+    elif axis == "y":
+        Y_LIMITS = limits
+    else:
+        raise ValueError(f"unknown axis {axis!r}")
 
-    continuous_forward = False
-    continuous_backward = False
-    continuous_left = False
-    continuous_right = False
 
+def planned_move_time(calibrated_x, calibrated_y):
+    """
+    Planned duration in seconds of move_to_position(calibrated_x, calibrated_y)
+    """
+    return plan_xy(abs(calibrated_x) * JOG_STEPS, abs(calibrated_y) * JOG_STEPS, X_LIMITS, Y_LIMITS).duration
 
-def back_off_x_endstop():
-    """Backs off from the X endstop by moving right (away) for 0.5 seconds."""
-    global continuous_right
-    try:
-        print("DEBUG: X backoff started")
-        end = time.monotonic() + 1
-        while time.monotonic() < end:
-            continuous_right = True
-            time.sleep(0.01)
-    finally:
-        continuous_right = False
-        print("DEBUG: X backoff complete")
-    # Clear flags after backoff completes
-    time.sleep(0.1)  # Give it a moment to settle
-    x_min_pressed.clear()
-    x_backoff_running.clear()
-    print("DEBUG: X flags cleared")
-
-
-def back_off_y_endstop():
-    """Backs off from the Y endstop by moving forward (away) for 0.5 seconds."""
-    global continuous_forward
 
-    try:
-        print("DEBUG: Y backoff started")
-        end = time.monotonic() + 1
-        while time.monotonic() < end:
-            continuous_forward = True
-            time.sleep(0.01)
-    finally:
-        continuous_forward = False
-        print("DEBUG: Y backoff complete")
-    # Clear flags after backoff completes
-    time.sleep(0.1)  # Give it a moment to settle
-    y_min_pressed.clear()
-    y_backoff_running.clear()
-    print("DEBUG: Y flags cleared")
-
-
-def on_x_min_pressed():
-    """Handles X min endstop press event."""
-    print("DEBUG: X endstop pressed!")
-    
-    if x_backoff_running.is_set():
-        print("DEBUG: X backoff already running, ignoring")
-        return
+def start_move(calibrated_x, calibrated_y, limits_x=None, limits_y=None):
+    """
+    Starts move_to_position without waiting for it.
 
-    x_min_pressed.set()
-    print("DEBUG: X min_pressed set, stopping all motion")
-    stop_all_motion()
+    :return: MoveResult, done once both axes stopped
+    """
+    return start_move_steps(calibrated_x * JOG_STEPS, calibrated_y * JOG_STEPS, limits_x, limits_y)
 
-    x_backoff_running.set()
-    print("DEBUG: Starting X backoff thread")
-    threading.Thread(target=back_off_x_endstop, daemon=True).start()
 
+def start_move_steps(steps_x, steps_y, limits_x=None, limits_y=None):
+    """
+    Starts a coordinated move by (steps_x, steps_y) microsteps.
 
-def on_x_min_released():
-    """Handles X min endstop release event."""
-    print("DEBUG: X endstop released")
-    # Clear flags only after backoff completes (handled in back_off function)
+    :param limits_x: AxisLimits of X, X_LIMITS at the time of the call by default
+    :param limits_y: AxisLimits of Y, Y_LIMITS at the time of the call by default
+    :return: MoveResult, done once both axes stopped
+    """
+    # Looked up per move, the drift monitor may have lowered the speed
+    limits_x = limits_x or X_LIMITS
+    limits_y = limits_y or Y_LIMITS
+    dir_y = "forward" if steps_y >= 0 else "backward"
+    dir_x = "forward" if steps_x >= 0 else "backward"
+    plan = plan_xy(abs(steps_x), abs(steps_y), limits_x, limits_y)
 
+    return controller.move({
+        "y": (dir_y, plan.y.intervals, plan.y.delay),
+        "x": (dir_x, plan.x.intervals, plan.x.delay),
+    })
 
-def on_y_min_pressed():
-    """Handles Y min endstop press event."""
-    print("DEBUG: Y endstop pressed!")
-    try:
-        print(f"DEBUG: Y_MIN_PIN value (should be 0 if pressed): {y_min.value}")
-    except Exception as e:
-        print(f"DEBUG: Could not read y_min.value: {e}")
-    
-    if y_backoff_running.is_set():
-        print("DEBUG: Y backoff already running, ignoring")
-        return
 
-    y_min_pressed.set()
-    print("DEBUG: Y min_pressed set, stopping all motion")
-    stop_all_motion()
+def move_to_position(calibrated_x, calibrated_y, limits_x=None, limits_y=None):
+    """
+    Moves device to the calibrated position.
+    Steps are always positive; direction is determined by sign of coordinates.
+    Both axes move at the same time on one planned timeline, so they arrive together.
+    Stops an axis immediately if its endstop is hit while moving backward.
+
+    Refuses the move if it would pass a soft travel limit.
 
-    y_backoff_running.set()
-    print("DEBUG: Starting Y backoff thread")
-    threading.Thread(target=back_off_y_endstop, daemon=True).start()
+    :return: MoveResult with the steps executed per axis
+    :raises SoftLimitError: when the move was refused
+    """
+    result = start_move(calibrated_x, calibrated_y, limits_x, limits_y)
+    result.wait()
+    if result.error is not None:
+        raise result.error
+    return result
 
 
-def on_y_min_released():
-    """Handles Y min endstop release event."""
-    print("DEBUG: Y endstop released")
-    try:
-        print(f"DEBUG: Y_MIN_PIN value (should be 1 if released): {y_min.value}")
-    except Exception as e:
-        print(f"DEBUG: Could not read y_min.value: {e}")
-    # Clear flags only after backoff completes (handled in back_off function)
+# ================== Endstop Handling Functions ===================
+
+
+def stop_all_motion():
+    """
+    Stops all motor motion.
+    """
+    if controller is not None:
+        controller.stop()
+
+
+def on_endstop_pressed(axis):
+    """Handles a min endstop press, returns the aborted pulse trains."""
+    # Flags are cleared by the controller once the backoff completes
+    if controller is not None:
+        return controller.endstop_hit(axis)
+    return []
 
 
 # =================== Main Function ===================
@@ -439,52 +470,33 @@ def start_manual_control():
     global pump1
     global servo, y_min, x_min, DeviceFactory
 
-    # Pin factory for gpiozero, as there were poblems when not set. It looked like there were multiple conflicting pin factories.
-    Device.pin_factory = RPiGPIOFactory()
+    set_pin_factory()
 
-    # Pull up is not the same, this is likely a hardware issue and could easily not work in the future
-    y_min = Button(Y_MIN_PIN, pull_up=False) 
-    x_min = Button(X_MIN_PIN, pull_up=True)
+    y_min, x_min = initialize_endstops()
 
-    try:
-        servo = Servo(26)
-        servo.detach()  # VERY IMPORTANT
-    except Exception as e:
-        print(f"Servo init failed: {e}")
-        servo = None
+    servo = initialize_servo()
 
     Motor1, Motor2, pump1 = initialize_motors()
 
-    y_min.when_pressed = on_y_min_pressed
-    y_min.when_released = on_y_min_released
-
-    x_min.when_pressed = on_x_min_pressed
-    x_min.when_released = on_x_min_released
-
     running = True
 
-    motor_thread = threading.Thread(target=motor_control_loop, daemon=True)
-    motor_thread.start()
+    start_motion_controller()
 
+    # SIGTERM ends the listener, so the terminal settings are restored
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_keyboard_listener())
     keyboard_listener()
 
     running = False
-    Motor1.Stop()
-    Motor2.Stop()
+    stop_motion_controller()
     if servo:
         servo.detach()
 
-    for p in Motor1.mode_pins + Motor2.mode_pins:
-        p.close()
-
-    Motor1.dir_pin.close()
-    Motor1.step_pin.close()
-    Motor1.enable_pin.close()
-    Motor2.dir_pin.close()
-    Motor2.step_pin.close()
-    Motor2.enable_pin.close()
+    Motor1.Close()
+    Motor2.Close()
+    pump1.close()
 
-    y_min.close()
+    for endstop in endstops.values():
+        endstop.close()
 
     print("Program exited.")
 
@@ -0,0 +1,94 @@
+"""
+Microstep modes of the DRV8825 and switching them per move.
+
+Positions are kept in 1/32 microsteps (units) whatever the mode: a pulse in
+mode m moves UNITS[m] units. Long moves cruise in COARSE_MODE, which needs
+UNITS[COARSE_MODE] times fewer pulses, and make the final approach in
+FINE_MODE. Homing seeks may cruise coarse too, the homing latch always runs in
+FINE_MODE.
+
+The DRV8825 indexer only steps to positions on the grid of its current mode:
+switched to a coarser mode between grid positions, the next pulse moves less
+than a full coarse step. So a move only switches to the coarse mode on the
+grid, which needs the indexer position. An Indexer tracks it from the pulses
+output, modulo the grid it was last aligned to. It is unknown when the
+controller starts. The homing seek runs in COARSE_MODE, its first pulse puts
+the indexer on the grid (homing sets the position afterwards anyway), so until
+the first homing all other moves run in FINE_MODE.
+"""
+
+# Units (1/32 microsteps) moved per pulse in each mode
+UNITS = {
+    "fullstep": 32,
+    "halfstep": 16,
+    "1/4step": 8,
+    "1/8step": 4,
+    "1/16step": 2,
+    "1/32step": 1,
+}
+
+FINE_MODE = "1/32step"
+
+# Cruise mode of long moves, halfstep at most: the fullstep grid is offset from the others
+COARSE_MODE = "1/4step"
+
+# Units at the end of a move that are always made in FINE_MODE
+FINE_APPROACH = 800
+
+# Coarse pulses a move needs at least to switch modes
+MIN_COARSE_PULSES = 50
+
+
+class Indexer:
+    """Position of the DRV8825 indexer of one axis, in units modulo the grid it was aligned to"""
+
+    def __init__(self):
+        self.phase = None  # None while unknown
+        self.modulus = None
+
+    def advance(self, units):
+        """Books units output in FINE_MODE or on the grid, negative toward the min endstop"""
+        if self.phase is not None:
+            self.phase = (self.phase + units) % self.modulus
+
+    def aligned(self, mode):
+        """The indexer just output a pulse in mode, so it is on the grid of mode"""
+        self.phase = 0
+        self.modulus = UNITS[mode]
+
+    def known(self):
+        return self.phase is not None
+
+    def lead(self, mode, forward):
+        """
+        Units to output in FINE_MODE before the indexer is on the grid of mode,
+        None if that is not known.
+        """
+        size = UNITS[mode]
+        if self.phase is None or self.modulus % size:
+            return None
+        return (-self.phase) % size if forward else self.phase % size
+
+
+def split_move(intervals, lead, coarse=COARSE_MODE, approach=FINE_APPROACH):
+    """
+    Splits the planned intervals of a move, one per unit, into segments.
+    Every group of UNITS[coarse] intervals of the cruise becomes one coarse
+    pulse with the summed period, so the move keeps its timing.
+
+    :param lead: units to the grid of coarse (see Indexer.lead), None to stay in FINE_MODE
+    :param approach: units at least at the end of the move in FINE_MODE
+    :return: list of (mode, periods)
+    """
+    size = UNITS[coarse]
+    count = len(intervals)
+    pulses = 0 if lead is None else (count - lead - approach) // size
+    if pulses < MIN_COARSE_PULSES:
+        return [(FINE_MODE, intervals)]
+
+    end = lead + pulses * size
+    segments = [(FINE_MODE, intervals[:lead])] if lead else []
+    segments.append((coarse, [sum(intervals[i:i + size]) for i in range(lead, end, size)]))
+    if end < count:
+        segments.append((FINE_MODE, intervals[end:]))
+    return segments
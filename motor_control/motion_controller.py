@@ -0,0 +1,751 @@
+"""
+Motion controller for the X and Y axis.
+
+All motion goes through one MotionController. The keyboard listeners, the
+endstop callbacks and the wash cycle submit commands to its queue; the
+controller thread blocks while the queue is empty and wakes up as soon as a
+command arrives. Moves are output by the pulse engine, so the controller thread
+never steps a motor itself and can always react to the next command.
+
+Every train runs in one microstep mode, see microstep. Jog, continuous and
+backoff trains run in FINE_MODE; a long move cruises in COARSE_MODE and is
+output as back to back trains, one per mode. The mode switches of all axes
+cut a move into phases whose trains start together, see _phases. Positions
+are in 1/32 microsteps (units) whatever the mode.
+"""
+import queue
+import threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import accumulate
+
+from . import clock
+from .microstep import COARSE_MODE, FINE_MODE, UNITS, Indexer, split_move
+from .position_tracker import AxisTravel, PositionTracker, SoftLimitError
+from .pulse_engine import constant_periods
+
+Command = namedtuple(
+    "Command",
+    ["kind", "axis", "direction", "steps", "plans", "result", "generation"],
+    defaults=(None, None, 0, None, None, 0),
+)
+Command.__doc__ = """
+Command for the controller thread.
+
+kind is one of 'jog', 'continuous', 'hold', 'release', 'stop', 'move', 'seek'
+and 'backoff'. For 'move' and 'seek' plans maps an axis to (direction, intervals, delay) or
+(direction, intervals, delay, mode), see MotionController.move.
+"""
+
+# Direction that moves an axis toward its min endstop, and away from it
+TOWARD_MIN = "backward"
+AWAY_FROM_MIN = "forward"
+
+# Continuous motion is output as back to back trains of this many steps
+CONTINUOUS_CHUNK = 2000
+
+
+class MoveResult:
+    """
+    Outcome of a submitted move. steps maps an axis to the number of 1/32
+    microsteps that were actually executed, aborted is True if any axis was
+    cut short.
+    error is the SoftLimitError of a move that was refused, or the exception
+    the controller thread ran into.
+    """
+
+    def __init__(self):
+        self.steps = {}
+        self.aborted = False
+        self.error = None
+        self._done = threading.Event()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def done(self):
+        return self._done.is_set()
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(result) once the move is done, on the thread that finished it.
+        If the move is already done fn is called right away.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _set_done(self):
+        # Called with the lock held, the callbacks run after it is released
+        self._done.set()
+        callbacks, self._callbacks = self._callbacks, []
+        return callbacks
+
+    def _add(self, axis):
+        with self._lock:
+            self._pending += 1
+            self.steps[axis] = 0
+
+    def _train_finished(self, axis, train, units=1, last=True):
+        """Books a train of the move, the last one of axis (or an aborted one) ends it"""
+        callbacks = []
+        with self._lock:
+            self.steps[axis] += train.steps_done * units
+            self.aborted = self.aborted or train.aborted
+            if not last:
+                return
+            self._pending -= 1
+            if self._pending <= 0:
+                callbacks = self._set_done()
+        for fn in callbacks:
+            fn(self)
+
+    def _axis_failed(self, axis, error):
+        """An axis whose train could not be started, ends its part of the move"""
+        self._end_axis(error)
+
+    def _axis_dropped(self, axis):
+        """An axis whose remaining trains were dropped by a stop, ends its part of the move"""
+        self._end_axis(None)
+
+    def _end_axis(self, error):
+        callbacks = []
+        with self._lock:
+            self.error = self.error or error
+            self.aborted = True
+            self._pending -= 1
+            if self._pending <= 0:
+                callbacks = self._set_done()
+        for fn in callbacks:
+            fn(self)
+
+    def _finish_empty(self):
+        callbacks = []
+        with self._lock:
+            if self._pending <= 0 and not self._done.is_set():
+                callbacks = self._set_done()
+        for fn in callbacks:
+            fn(self)
+
+
+class MotionController:
+    """
+    Owns the motors of both axes and executes submitted commands on a thread.
+
+    :param motors: dict axis -> DRV8825
+    :param min_pressed: dict axis -> threading.Event set while the min endstop is hit
+    :param backoff_running: dict axis -> threading.Event set during an endstop backoff
+    :param step_delay: half period in seconds of jog, continuous and backoff steps
+    :param jog_steps: microsteps of one single step command
+    :param backoff_steps: microsteps driven away from an endstop after it was hit
+    :param tracker: PositionTracker with the soft limits, none by default
+    :param switch_pressed: function(axis) that reads the min endstop switch, True while
+        pressed. Without it the endstop counts as released once a backoff ends.
+    """
+
+    SETTLE_TIME = 0.1  # seconds after a backoff before the endstop flags clear
+    PHASE_LEAD = 0.001  # seconds from starting the trains of a move phase to their common start
+
+    def __init__(self, motors, min_pressed, backoff_running, step_delay, jog_steps, backoff_steps, tracker=None,
+                 switch_pressed=None):
+        self.motors = motors
+        self.switch_pressed = switch_pressed
+        self.min_pressed = min_pressed
+        self.backoff_running = backoff_running
+        self.step_delay = step_delay
+        self.jog_steps = jog_steps
+        self.backoff_steps = backoff_steps
+        self.auto_backoff = True
+
+        self.tracker = tracker or PositionTracker({axis: AxisTravel() for axis in motors})
+        self._active = {axis: None for axis in motors}  # axis -> (train, direction, kind, units per pulse)
+        # Cleared while a move owns the axis, also between the trains of its phases
+        self._free = {axis: threading.Event() for axis in motors}
+        for free in self._free.values():
+            free.set()
+        self.indexers = {axis: Indexer() for axis in motors}
+        self._modes = {axis: None for axis in motors}  # microstep mode set on the driver, None if unknown
+        self._continuous = None  # (axis, direction) of the running continuous move
+        self._start_listeners = []  # called once with the clock time of the next train start
+        self._listeners = []  # called with (event, axis), see add_listener
+        # Reentrant: a backend may finish a train on the thread that started it
+        self._lock = threading.RLock()
+        self._queue = queue.Queue()
+        self._pending = 0  # commands submitted and not yet executed
+        self._generation = 0
+        self._thread = None
+        # Backoff workers, started with the controller, clear the endstop flags after the settle time
+        self._settle = {axis: queue.Queue() for axis in motors}
+        self._settle_threads = {}
+
+    # ----- Lifecycle -----
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        for axis, requests in self._settle.items():
+            if axis not in self._settle_threads or not self._settle_threads[axis].is_alive():
+                thread = threading.Thread(target=self._settle_worker, args=(axis,), name=f"{axis}-backoff", daemon=True)
+                self._settle_threads[axis] = thread
+                thread.start()
+
+    def shutdown(self):
+        """Stops all motion and ends the controller thread."""
+        self.stop()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        for axis in self.motors:
+            self._wait_idle(axis)  # aborted trains end right away
+        for requests in self._settle.values():
+            requests.put(None)
+        # A backoff cut short by the shutdown would keep its flags set without a settle worker
+        for axis in self.motors:
+            if self.backoff_running[axis].is_set():
+                self.end_backoff(axis)
+        for motor in self.motors.values():
+            motor.Stop()
+
+    # ----- Commands (callable from any thread) -----
+
+    def submit(self, command):
+        with self._lock:
+            command = command._replace(generation=self._generation)
+            self._pending += 1
+        self._queue.put(command)
+        return command
+
+    def jog(self, axis, direction, steps=None):
+        """Moves axis steps microsteps (one jog step by default)"""
+        self.submit(Command("jog", axis, direction, steps or self.jog_steps))
+
+    def continuous(self, axis, direction):
+        """Toggles continuous motion, starting it stops any other continuous motion"""
+        self.submit(Command("continuous", axis, direction))
+
+    def hold(self, axis, direction):
+        """Starts continuous motion unless it already runs, e.g. while a key is held down"""
+        self.submit(Command("hold", axis, direction))
+
+    def release(self, axis, direction):
+        """Ends continuous motion of axis in direction if it runs, e.g. when a held key is let go"""
+        self.submit(Command("release", axis, direction))
+
+    def move(self, plans):
+        """
+        Starts a move and returns its MoveResult.
+
+        :param plans: dict axis -> (direction, intervals, delay) or (direction,
+            intervals, delay, mode), with one interval per 1/32 microstep.
+            Without a mode a long move cruises in COARSE_MODE once the indexer
+            position is known. FINE_MODE outputs the whole move in 1/32 steps.
+            A coarse mode cruises in it up to the end; from an unknown indexer
+            position its first pulse moves less than a full step, which only
+            a move whose end position does not matter can afford (the homing seek).
+        """
+        result = MoveResult()
+        self.submit(Command("move", plans=plans, result=result))
+        return result
+
+    def seek(self, plans):
+        """
+        Starts a homing move and returns its MoveResult. Like move, but an
+        axis may drive below home toward its endstop.
+        """
+        result = MoveResult()
+        self.submit(Command("seek", plans=plans, result=result))
+        return result
+
+    def stop(self):
+        """
+        Stops all motion right away. Commands submitted before the stop that
+        are still queued are dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            self._continuous = None
+            active = [a for a in self._active.values() if a is not None]
+        for entry in active:
+            entry[0].abort()
+        self.submit(Command("stop"))
+
+    def endstop_hit(self, axis):
+        """
+        Called from the endstop callback. Stops continuous motion and aborts any
+        move of axis toward the endstop directly, then queues the backoff.
+        Returns the aborted trains.
+        """
+        if self.backoff_running[axis].is_set():
+            return []
+        self.min_pressed[axis].set()
+
+        with self._lock:
+            self._continuous = None
+            active = list(self._active.items())
+        aborted = []
+        for active_axis, entry in active:
+            if entry is None:
+                continue
+            train, direction, kind, _ = entry
+            if kind == "continuous" or (active_axis == axis and direction == TOWARD_MIN):
+                train.abort()
+                aborted.append(train)
+
+        if self.auto_backoff:
+            self._emit("endstop", axis)
+            self.backoff_running[axis].set()
+            self.submit(Command("backoff", axis))
+        return aborted
+
+    def wait_for_backoff(self, axis, timeout=5.0):
+        """
+        Blocks until a running endstop backoff of axis and its settle time are
+        over. A backoff that is not over within timeout is ended, see end_backoff.
+        Returns False in that case.
+        """
+        end = clock.monotonic() + timeout
+        while self.backoff_running[axis].is_set() and clock.monotonic() < end:
+            clock.sleep(0.01)
+        if self.backoff_running[axis].is_set():
+            print(f"{axis.upper()} endstop backoff did not finish within {timeout} s")
+            self.end_backoff(axis)
+            return False
+        return True
+
+    def end_backoff(self, axis):
+        """
+        Clears the backoff flag of axis, and min_pressed unless the switch is
+        still pressed: moves toward the endstop stay blocked only while the
+        axis really is on it.
+        """
+        pressed = self.switch_pressed(axis) if self.switch_pressed is not None else False
+        if not pressed:
+            self.min_pressed[axis].clear()
+        self.backoff_running[axis].clear()
+
+    def notify_next_start(self, fn):
+        """Calls fn(t) once, with the clock time t at which the next train is started"""
+        with self._lock:
+            self._start_listeners.append(fn)
+
+    def add_listener(self, fn):
+        """
+        Calls fn(event, axis) on every train "start" and "abort", on an
+        "endstop" hit outside homing and on "home" when a position is reset.
+        fn runs on the thread of the event and must not block.
+
+        "starting" is called right before a train is handed to the backend.
+        The train waits for fn, so fn may do what has to happen before motion
+        (the position journal's write), and nothing else.
+        """
+        with self._lock:
+            self._listeners.append(fn)
+
+    def _emit(self, event, axis):
+        for fn in list(self._listeners):
+            fn(event, axis)
+
+    def is_idle(self):
+        """True if no train runs and no command waits to be executed"""
+        with self._lock:
+            return (
+                self._pending == 0
+                and all(entry is None for entry in self._active.values())
+                and all(free.is_set() for free in self._free.values())
+            )
+
+    def active(self):
+        """
+        dict axis -> (train, direction, kind, units per pulse) of the running
+        trains, None for an idle axis. Taken without the lock, for observers
+        like telemetry.
+        """
+        return dict(self._active)
+
+    @property
+    def position(self):
+        """dict axis -> microsteps from home"""
+        return self.tracker.positions()
+
+    def step_counts(self):
+        """dict axis -> microsteps output since start, either direction"""
+        return self.tracker.executed()
+
+    def reset_position(self, axis=None):
+        """Makes the current position of axis (all axes by default) home"""
+        self.tracker.reset(axis)
+        for a in ([axis] if axis else self.tracker.travel):
+            self._emit("home", a)
+
+    # ----- Controller thread -----
+
+    def _run(self):
+        while True:
+            command = self._queue.get()  # blocks while idle
+            if command is None:
+                return
+            try:
+                self._execute(command)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def _execute(self, command):
+        with self._lock:
+            stale = command.generation != self._generation
+        if stale:
+            if command.kind == "backoff":
+                # Dropped by a stop, the axis may still be on its endstop
+                self.end_backoff(command.axis)
+            if command.result is not None:
+                command.result.aborted = True
+                command.result._finish_empty()
+            return
+        try:
+            getattr(self, "_do_" + command.kind)(command)
+        except Exception as e:
+            print(f"Motion command {command.kind} failed: {e}")
+            if command.result is not None:
+                command.result.error = e
+                command.result.aborted = True
+                command.result._finish_empty()
+            elif command.kind == "backoff":
+                self.end_backoff(command.axis)
+
+    def _blocked(self, axis, direction):
+        return (
+            direction == TOWARD_MIN
+            and self.min_pressed[axis].is_set()
+            and not self.backoff_running[axis].is_set()
+        )
+
+    def _wait_idle(self, axis):
+        # A move owns the axis until its last phase ended, not only while one of its trains runs
+        self._free[axis].wait()
+        with self._lock:
+            entry = self._active[axis]
+        if entry is not None:
+            entry[0].wait()
+
+    def _start(self, axis, direction, periods, delay=0.0, kind="jog", on_done=None, mode=FINE_MODE, guard=None):
+        """
+        Starts a train on axis in mode and books its steps into position when it ends.
+
+        :param guard: function() called under the lock right before the train
+            starts; if it returns False nothing starts and None is returned
+        """
+        units = UNITS[mode]
+        indexer = self.indexers[axis]
+        # The indexer is on the grid of mode after the first pulse from an unknown position
+        aligns = not indexer.known() and mode != FINE_MODE
+        self._emit("starting", axis)
+        # Registered under the lock, so an endstop edge right after the start
+        # waits for the registration and then aborts this train
+        with self._lock:
+            if guard is not None and not guard():
+                return None
+            if self._modes[axis] != mode:
+                # The axis is idle, so no pulse is output while the mode pins change
+                self.motors[axis].SetStepFormat(mode)
+                self._modes[axis] = mode
+            train = self.motors[axis].StartPulses(direction, periods, delay)
+            if train is None:
+                return None
+            self._active[axis] = (train, direction, kind, units)
+            listeners, self._start_listeners = self._start_listeners, []
+        for fn in listeners:
+            fn(clock.monotonic())
+        self._emit("start", axis)
+        sign = 1 if direction == AWAY_FROM_MIN else -1
+
+        def finished(t):
+            with self._lock:
+                self.tracker.add(axis, sign * t.steps_done * units)
+                if aligns and t.steps_done:
+                    indexer.aligned(mode)
+                else:
+                    indexer.advance(sign * t.steps_done * units)
+                if self._active[axis] is not None and self._active[axis][0] is t:
+                    self._active[axis] = None
+            if t.aborted:
+                self._emit("abort", axis)
+            if on_done is not None:
+                on_done(t)
+
+        train.add_done_callback(finished)
+        return train
+
+    def _stop_continuous(self):
+        with self._lock:
+            running, self._continuous = self._continuous, None
+            entry = self._active[running[0]] if running else None
+        if entry is not None and entry[2] == "continuous":
+            entry[0].abort()
+            entry[0].wait()
+
+    def _do_stop(self, command):
+        pass  # motion was already aborted by stop()
+
+    def _do_jog(self, command):
+        self._wait_idle(command.axis)
+        if self._blocked(command.axis, command.direction):
+            return
+        steps = self.tracker.clamp(command.axis, command.direction == AWAY_FROM_MIN, command.steps)
+        if steps <= 0:
+            print(f"{command.axis.upper()} soft limit reached")
+            return
+        periods = constant_periods(steps, 2 * self.step_delay)
+        self._start(command.axis, command.direction, periods)
+
+    def _do_continuous(self, command):
+        wanted = (command.axis, command.direction)
+        with self._lock:
+            toggle_off = self._continuous == wanted
+        self._stop_continuous()
+        if toggle_off:
+            return
+        self._wait_idle(command.axis)
+        if self._blocked(command.axis, command.direction):
+            return
+        with self._lock:
+            self._continuous = wanted
+        self._continue(command.axis, command.direction)
+
+    def _do_hold(self, command):
+        with self._lock:
+            running = self._continuous == (command.axis, command.direction)
+        if not running:
+            self._do_continuous(command)
+
+    def _do_release(self, command):
+        with self._lock:
+            running = self._continuous == (command.axis, command.direction)
+        if running:
+            self._stop_continuous()
+
+    def _continue(self, axis, direction, previous=None):
+        """Starts the next chunk of a continuous move while it is still wanted"""
+        if previous is not None and previous.aborted:
+            return
+        with self._lock:
+            if self._continuous != (axis, direction):
+                return
+        steps = self.tracker.clamp(axis, direction == AWAY_FROM_MIN, CONTINUOUS_CHUNK)
+        if steps <= 0:
+            print(f"{axis.upper()} soft limit reached")
+            with self._lock:
+                if self._continuous == (axis, direction):
+                    self._continuous = None
+            return
+        periods = constant_periods(steps, 2 * self.step_delay)
+        self._start(
+            axis, direction, periods, kind="continuous",
+            on_done=lambda t: self._continue(axis, direction, t),
+        )
+
+    def _do_move(self, command):
+        result = command.result
+        for axis in command.plans:
+            self._wait_idle(axis)
+
+        moves = [
+            (axis, plan[0], plan[1], plan[2], plan[3] if len(plan) > 3 else None)
+            for axis, plan in command.plans.items()
+            if plan[1] and not self._blocked(axis, plan[0])
+        ]
+        # Axes are idle now, so the positions are exact
+        try:
+            for axis, direction, intervals, _, _ in moves:
+                if command.kind == "seek" and direction == TOWARD_MIN:
+                    continue  # homing drives to the endstop, below home
+                self.tracker.check(axis, direction == AWAY_FROM_MIN, len(intervals))
+        except SoftLimitError as e:
+            print(f"Move refused: {e}")
+            result.error = e
+            result.aborted = True
+            result._finish_empty()
+            return
+        with self._lock:
+            generation = self._generation
+        if moves:
+            phases = self._phases({
+                axis: (delay, self._segments(axis, direction, intervals, mode))
+                for axis, direction, intervals, delay, mode in moves
+            })
+            directions = {axis: direction for axis, direction, _, _, _ in moves}
+            # Register every axis before starting, so a short axis finishing
+            # first does not complete the result early
+            for axis in directions:
+                result._add(axis)
+                self._free[axis].clear()
+            self._start_phase(phases, directions, result, generation, set())
+        result._finish_empty()
+
+    _do_seek = _do_move
+
+    def _segments(self, axis, direction, intervals, mode):
+        """Splits the intervals of a planned move into (mode, periods) trains"""
+        if mode == FINE_MODE:
+            return [(FINE_MODE, intervals)]
+        if mode is None:
+            return split_move(intervals, self.indexers[axis].lead(COARSE_MODE, direction == AWAY_FROM_MIN))
+        lead = self.indexers[axis].lead(mode, direction == AWAY_FROM_MIN)
+        return split_move(intervals, lead or 0, mode, approach=0)
+
+    @staticmethod
+    def _phases(moves):
+        """
+        Cuts the segments of a move into phases at every mode switch of any
+        axis. A phase holds one train per axis, the trains of a phase start
+        together and the next phase starts once all of them ended. The restart
+        at a switch then delays every axis alike, instead of only the axis that
+        switches, and the axes stay in lockstep.
+
+        Every phase keeps the planned edge times: a train's delay is its first
+        edge after the phase start, and the last period of a train is cut at
+        the phase end.
+
+        :param moves: dict axis -> (delay, segments), segments as from _segments
+        :return: list of dict axis -> (mode, periods, delay), an axis without
+            pulses in a phase is left out of it
+        """
+        pulses = {}  # axis -> (rising edge times, periods, first pulse index of every segment, modes)
+        cuts = set()
+        for axis, (delay, segments) in moves.items():
+            edges, periods, firsts, modes = [], [], [], []
+            t = delay
+            for mode, segment in segments:
+                if periods:
+                    cuts.add(t)
+                firsts.append(len(periods))
+                modes.append(mode)
+                edges.extend(accumulate(segment[:-1], initial=t))
+                t = edges[-1] + segment[-1]
+                periods.extend(segment)
+            pulses[axis] = (edges, periods, firsts, modes)
+
+        bounds = [0.0] + sorted(cuts) + [None]
+        phases = []
+        for start, end in zip(bounds, bounds[1:]):
+            phase = {}
+            for axis, (edges, periods, firsts, modes) in pulses.items():
+                first = bisect_left(edges, start)
+                stop = len(edges) if end is None else bisect_left(edges, end)
+                if first >= stop:
+                    continue
+                part = periods[first:stop]
+                if end is not None:
+                    part[-1] = min(part[-1], end - edges[stop - 1])
+                phase[axis] = (modes[bisect_right(firsts, first) - 1], part, edges[first] - start)
+            phases.append(phase)
+        return phases
+
+    def _start_phase(self, phases, directions, result, generation, ended):
+        """
+        Starts the trains of the first of phases together, the last one to
+        end starts the next phase. An aborted train ends its axis' part of the
+        move, the other axes go on; a stop ends the whole move.
+
+        :param ended: axes whose part of the move already ended, see _end
+        """
+        phase, rest = phases[0], phases[1:]
+        finished = {}  # axis -> (mode, train)
+        pending = [len(phase) + 1]  # trains of the phase, and the starting below
+        lock = threading.Lock()
+        # All trains wait for the same instant. Starting right away, the first
+        # train's pulse thread could hold up starting the others.
+        start_at = clock.monotonic() + self.PHASE_LEAD
+
+        def release():
+            with lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            self._phase_done(finished, rest, directions, result, generation, ended)
+
+        def train_done(axis, mode, t):
+            finished[axis] = (mode, t)
+            release()
+
+        for axis, (mode, periods, delay) in phase.items():
+            if axis in ended:
+                release()
+                continue
+            direction = directions[axis]
+            dropped = []
+
+            def guard(axis=axis, direction=direction):
+                # Between two phases no train runs, so neither a stop nor an endstop edge aborted anything
+                if generation != self._generation or self._blocked(axis, direction):
+                    dropped.append(axis)
+                    return False
+                return True
+
+            try:
+                lead = max(start_at - clock.monotonic(), 0.0)
+                train = self._start(
+                    axis, direction, periods, delay + lead, kind="move", mode=mode, guard=guard,
+                    on_done=lambda t, axis=axis, mode=mode: train_done(axis, mode, t),
+                )
+                if train is None and not dropped:
+                    raise ValueError(f"invalid direction {direction!r}")
+            except Exception as e:
+                print(f"{axis.upper()} move failed: {e}")
+                self._end(axis, ended)
+                result._axis_failed(axis, e)
+                release()
+                continue
+            if dropped:
+                self._end(axis, ended)
+                result._axis_dropped(axis)
+                release()
+        release()
+
+    def _phase_done(self, finished, rest, directions, result, generation, ended):
+        with self._lock:
+            stopped = generation != self._generation
+        for axis, (mode, t) in finished.items():
+            more = any(axis in phase for phase in rest)
+            end = stopped or t.aborted or not more
+            if stopped and more:
+                result.aborted = True  # cut short by the stop, even if this train was not
+            result._train_finished(axis, t, UNITS[mode], last=end)
+            if end:
+                self._end(axis, ended)
+        if stopped:
+            # Axes that had no train in this phase still wait for their next one
+            for axis in directions:
+                if axis not in ended:
+                    self._end(axis, ended)
+                    result._axis_dropped(axis)
+            return
+        if rest:
+            self._start_phase(rest, directions, result, generation, ended)
+
+    def _end(self, axis, ended):
+        """Ends the part of a move on axis, other commands may use the axis again"""
+        ended.add(axis)
+        self._free[axis].set()
+
+    def _do_backoff(self, command):
+        axis = command.axis
+        self._wait_idle(axis)
+        print(f"{axis.upper()} endstop: backing off")
+
+        def clear(_):
+            self._settle[axis].put(axis)
+
+        periods = constant_periods(self.backoff_steps, 2 * self.step_delay)
+        if self._start(axis, AWAY_FROM_MIN, periods, kind="backoff", on_done=clear) is None:
+            clear(None)
+
+    def _settle_worker(self, axis):
+        while self._settle[axis].get() is not None:
+            clock.sleep(self.SETTLE_TIME)
+            self.end_backoff(axis)
@@ -0,0 +1,206 @@
+"""
+Motion planner for the stepper axes.
+
+Turns a move length plus the limits of an axis into a precomputed table of
+step intervals, so a move starts slowly, cruises at max velocity and stops
+slowly again. Without a jerk limit the ramps are trapezoidal, with a jerk
+limit they are S-curves. Plans are cached per move length, as the wash cycle
+repeats the same moves over and over.
+"""
+import bisect
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+AxisLimits = namedtuple(
+    "AxisLimits",
+    ["max_velocity", "max_acceleration", "max_jerk", "start_velocity"],
+    defaults=(None, 1000.0),
+)
+AxisLimits.__doc__ = """
+Motion limits of one axis, all in (micro)steps and seconds.
+
+:param max_velocity: cruise speed in steps/s
+:param max_acceleration: steps/s^2
+:param max_jerk: steps/s^3, None for a trapezoidal profile
+:param start_velocity: speed the motor can start and stop at without stalling
+"""
+
+MotionProfile = namedtuple("MotionProfile", ["steps", "intervals", "duration"])
+MotionProfile.__doc__ = """
+Planned move: one interval (seconds between steps) per step and the total
+planned duration in seconds.
+"""
+
+_RAMP_DT = 0.0005  # time resolution in seconds of the S-curve ramp table
+
+
+def _trapezoid_velocities(distances, limits):
+    v0 = limits.start_velocity
+    a = limits.max_acceleration
+    return [min(math.sqrt(v0 * v0 + 2 * a * s), limits.max_velocity) for s in distances]
+
+
+@lru_cache(maxsize=16)
+def _s_curve_ramp(limits):
+    """
+    Distance/velocity table of a jerk limited ramp from start_velocity to
+    max_velocity. Acceleration rises with max_jerk, holds at
+    max_acceleration and falls again so it reaches 0 exactly at max_velocity.
+    """
+    v0, vmax = limits.start_velocity, limits.max_velocity
+    amax, jerk = limits.max_acceleration, limits.max_jerk
+
+    # If max_acceleration is not reached the ramp has no constant phase
+    if (vmax - v0) < amax * amax / jerk:
+        amax = math.sqrt((vmax - v0) * jerk)
+    v_jerk_down = vmax - amax * amax / (2 * jerk)
+
+    s, v, a = 0.0, v0, 0.0
+    distances, velocities = [0.0], [v0]
+    while v < vmax:
+        if v >= v_jerk_down:
+            a = max(a - jerk * _RAMP_DT, amax * 0.01)
+        else:
+            a = min(a + jerk * _RAMP_DT, amax)
+        v = min(v + a * _RAMP_DT, vmax)
+        s += v * _RAMP_DT
+        distances.append(s)
+        velocities.append(v)
+    return distances, velocities
+
+
+def _s_curve_velocities(distances, limits):
+    table_s, table_v = _s_curve_ramp(limits)
+    velocities = []
+    for s in distances:
+        i = bisect.bisect_right(table_s, s)
+        if i >= len(table_s):
+            velocities.append(limits.max_velocity)
+            continue
+        s0, s1 = table_s[i - 1], table_s[i]
+        v0, v1 = table_v[i - 1], table_v[i]
+        velocities.append(v0 + (v1 - v0) * (s - s0) / (s1 - s0))
+    return velocities
+
+
+@lru_cache(maxsize=128)
+def plan_move(steps, limits, decelerate=True):
+    """
+    Plans a move of steps steps.
+
+    The speed at every step is the lowest of the acceleration ramp from the
+    start, the deceleration ramp to the end and max_velocity, so short moves
+    get a triangular profile that peaks halfway.
+
+    :param steps: number of steps of the move
+    :param limits: AxisLimits of the axis
+    :param decelerate: False for moves that end on an endstop, these only ramp up
+    :return: MotionProfile
+    """
+    steps = max(int(steps), 0)
+    if steps == 0:
+        return MotionProfile(0, (), 0.0)
+
+    ramp = _s_curve_velocities if limits.max_jerk else _trapezoid_velocities
+    accelerating = ramp(range(steps), limits)
+    if decelerate:
+        decelerating = accelerating[::-1]
+        velocities = [min(up, down) for up, down in zip(accelerating, decelerating)]
+    else:
+        velocities = accelerating
+
+    intervals = tuple(1.0 / v for v in velocities)
+    return MotionProfile(steps, intervals, sum(intervals))
+
+
+def planned_duration(steps, limits):
+    """Planned duration in seconds of a move of steps steps"""
+    return plan_move(steps, limits).duration
+
+
+# =================== Coordinated X/Y Moves ===================
+
+AxisPlan = namedtuple("AxisPlan", ["steps", "delay", "intervals"])
+AxisPlan.__doc__ = """
+Step timing of one axis within a coordinated move: delay before the first
+step and one interval per step, both in seconds.
+"""
+
+CoordinatedMove = namedtuple("CoordinatedMove", ["x", "y", "duration"])
+
+
+def _scaled_limits(limits, factor):
+    return AxisLimits(
+        limits.max_velocity * factor,
+        limits.max_acceleration * factor,
+        limits.max_jerk * factor if limits.max_jerk else None,
+        limits.start_velocity * factor,
+    )
+
+
+def _slowest_limits(a, b):
+    jerks = [j for j in (a.max_jerk, b.max_jerk) if j]
+    return AxisLimits(
+        min(a.max_velocity, b.max_velocity),
+        min(a.max_acceleration, b.max_acceleration),
+        min(jerks) if jerks else None,
+        min(a.start_velocity, b.start_velocity),
+    )
+
+
+def _minor_axis_plan(major, minor_steps):
+    """
+    Bresenham/DDA: the minor axis steps together with those major axis steps
+    where the ideal minor position passes the next whole step.
+    """
+    if minor_steps == 0:
+        return AxisPlan(0, 0.0, ())
+
+    edges = []
+    t = 0.0
+    for k, interval in enumerate(major.intervals):
+        if (k + 1) * minor_steps // major.steps > k * minor_steps // major.steps:
+            edges.append((t, interval))
+        t += interval
+
+    intervals = [b[0] - a[0] for a, b in zip(edges, edges[1:])]
+    intervals.append(edges[-1][1])
+    return AxisPlan(minor_steps, edges[0][0], tuple(intervals))
+
+
+@lru_cache(maxsize=128)
+def plan_xy(steps_x, steps_y, limits_x, limits_y):
+    """
+    Plans a coordinated move where both axes start and arrive together.
+
+    The axis with the most steps is planned on the motion planner and drives
+    the timing, the other axis is interleaved on the same timeline. The limits
+    of the long axis are lowered where needed, so the short axis stays within
+    its own limits too.
+
+    :return: CoordinatedMove with an AxisPlan per axis and the planned duration
+    """
+    steps_x, steps_y = abs(int(steps_x)), abs(int(steps_y))
+    if steps_x >= steps_y:
+        major_steps, minor_steps = steps_x, steps_y
+        major_limits, minor_limits = limits_x, limits_y
+    else:
+        major_steps, minor_steps = steps_y, steps_x
+        major_limits, minor_limits = limits_y, limits_x
+
+    if major_steps == 0:
+        empty = AxisPlan(0, 0.0, ())
+        return CoordinatedMove(empty, empty, 0.0)
+
+    if minor_steps:
+        ratio = major_steps / minor_steps
+        major_limits = _slowest_limits(major_limits, _scaled_limits(minor_limits, ratio))
+
+    profile = plan_move(major_steps, major_limits)
+    major = AxisPlan(major_steps, 0.0, profile.intervals)
+    minor = _minor_axis_plan(major, minor_steps)
+
+    if steps_x >= steps_y:
+        return CoordinatedMove(major, minor, profile.duration)
+    return CoordinatedMove(minor, major, profile.duration)
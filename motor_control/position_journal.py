@@ -0,0 +1,262 @@
+"""
+Position journal: the last known axis positions, kept across cycles and restarts.
+
+Homing is the slowest part of a cycle. With the journal the cycle only homes
+when the position is in doubt; otherwise it returns to the origin with one
+coordinated move. The journal stores the positions with a confidence flag:
+
+- homing both axes makes the position confident
+- an endstop hit outside homing, an aborted train (stop, cancel, endstop) or
+  a failed write clears the confidence
+- while the axes move the file says not confident, so a power loss mid-move
+  leaves a journal that forces homing at the next start. The first train
+  after a confident write waits until that is written and synced to disk.
+
+The journal asks for homing every rehome_every cycles anyway, and every cycle
+after a homing found more drift than DRIFT_TOLERANCE microsteps, until a
+homing finds the position where the journal expected it.
+
+Writes are batched: a write is scheduled flush_interval after a change and
+covers every change since, so a cycle costs a couple of writes. Each write is
+atomic and synced (see calibration_store.write_json_atomic). Only the first
+train after a confident write writes on the spot, before it starts.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from .calibration_store import write_json_atomic
+
+FILE_NAME = "position_journal.json"
+
+# Cycles between homings while the position is confident
+REHOME_EVERY = 10
+
+# Microsteps a homing may find the axis away from the journal position. One
+# homing, so it has to allow for the endstop's trigger scatter; the drift
+# monitor's DRIFT_LIMIT is lower because it is a mean over several homings.
+DRIFT_TOLERANCE = 200
+
+# Seconds a change waits for other changes before it is written
+FLUSH_INTERVAL = 1.0
+
+
+def default_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), FILE_NAME)
+
+
+class PositionJournal:
+    """
+    Last known positions and their confidence, written to path.
+
+    :param path: journal file, None keeps the journal in memory only (simulated rig)
+    :param rehome_every: cycles between homings while confident
+    :param flush_interval: seconds changes are batched before a write
+    """
+
+    def __init__(self, path=None, rehome_every=REHOME_EVERY, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.rehome_every = rehome_every
+        self.flush_interval = flush_interval
+        self.positions = {}
+        self.confident = False
+        self.reason = "no journal"  # why the position is not confident
+        self.cycles_since_home = 0
+        self.drifting = False
+        self.last_drift = None
+        self.controller = None
+        self._moving = False
+        self._homed_axes = set()
+        self._written_confident = False  # confidence in the file on disk
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer = None
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+            self.positions = {axis: int(steps) for axis, steps in data["positions"].items()}
+            self.confident = bool(data["confident"])
+            self.reason = data.get("reason") or ("" if self.confident else "unknown")
+            self.cycles_since_home = int(data.get("cycles_since_home", 0))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Position journal {self.path} unreadable, homing first: {e}")
+            self.confident = False
+            self.reason = "unreadable journal"
+        self._written_confident = self.confident
+
+    def attach(self, controller):
+        """
+        Restores a confident position into controller's tracker and follows the
+        controller's motion events from now on.
+        """
+        self.controller = controller
+        with self._lock:
+            if self.confident and set(self.positions) == set(controller.tracker.travel):
+                controller.tracker.restore(self.positions)
+                print(f"Position restored from journal: {self.positions}")
+            elif self.confident:
+                self._invalidate("journal axes do not match the rig")
+        controller.add_listener(self._on_event)
+
+    # ----- Motion events -----
+
+    def _on_event(self, event, axis):
+        if event == "starting":
+            self._motion_starting()
+            return
+        with self._lock:
+            if event == "abort":
+                # The seeks of a homing end on the endstop, the homing makes the position confident again
+                homing = not self.controller.auto_backoff
+                self._invalidate("homing interrupted" if homing else f"{axis} motion aborted", announce=not homing)
+            elif event == "endstop":
+                self._invalidate(f"unexpected {axis} endstop hit")
+            elif event == "home":
+                self._homed_axes.add(axis)
+                if self._homed_axes >= set(self.controller.tracker.travel):
+                    self.confident = True
+                    self.reason = ""
+                    self.cycles_since_home = 0
+                    self._schedule(self.flush_interval)
+
+    def _motion_starting(self):
+        # Runs before the train starts: a confident file must say moving on disk before anything moves
+        with self._lock:
+            self._moving = True
+            urgent = self._written_confident
+        if urgent:
+            self.flush()
+
+    def _invalidate(self, reason, announce=True):
+        # Called with the lock held
+        self._homed_axes.clear()
+        if self.confident:
+            if announce:
+                print(f"Position no longer trusted: {reason}")
+            self.reason = reason  # the first cause is the interesting one
+        self.confident = False
+        self._schedule(0.0 if self._written_confident else self.flush_interval)
+
+    def invalidate(self, reason):
+        """Forces homing at the start of the next cycle"""
+        with self._lock:
+            self._invalidate(reason)
+
+    # ----- Cycles -----
+
+    def needs_homing(self):
+        """True if the next cycle has to home instead of trusting the journal"""
+        return self.homing_reason() is not None
+
+    def homing_reason(self):
+        """Why the next cycle has to home, None if the journal is trusted"""
+        with self._lock:
+            if not self.confident:
+                return self.reason
+            if self.drifting:
+                return f"drift {self.last_drift} at the last homing"
+            if self.cycles_since_home >= self.rehome_every:
+                return f"{self.cycles_since_home} cycles since the last homing"
+            return None
+
+    def check_drift(self, drift):
+        """
+        Takes the drift a homing found from the journal position into account,
+        see drift_monitor.
+
+        :param drift: dict axis -> drift in microsteps, positive if the axis was further out
+        """
+        worst = max((abs(d) for d in drift.values()), default=0)
+        with self._lock:
+            self.last_drift = drift
+            self.drifting = worst > DRIFT_TOLERANCE
+        if worst > DRIFT_TOLERANCE:
+            print(f"Homing found drift {drift} microsteps, homing every cycle until it is gone")
+
+    def checkpoint(self):
+        """Records the tracked positions, call while the axes are idle"""
+        positions = self.controller.tracker.positions()
+        with self._lock:
+            self._moving = False
+            self.positions = positions
+            self._schedule(self.flush_interval)
+
+    def cycle_done(self):
+        """Counts a completed cycle and records the positions"""
+        with self._lock:
+            self.cycles_since_home += 1
+        self.checkpoint()
+
+    # ----- Writing -----
+
+    def _schedule(self, delay):
+        # Called with the lock held. A pending write covers later changes, an
+        # urgent one replaces it.
+        if self.path is None:
+            return
+        if self._timer is not None:
+            if delay > 0:
+                return
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """Writes the journal now"""
+        if self.path is None:
+            return
+        with self._write_lock:
+            with self._lock:
+                self._timer = None
+                confident = self.confident and not self._moving
+                data = {
+                    "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "positions": dict(self.positions),
+                    "confident": confident,
+                    "reason": "moving" if self.confident and self._moving else self.reason,
+                    "cycles_since_home": self.cycles_since_home,
+                }
+            try:
+                write_json_atomic(self.path, data)
+            except OSError as e:
+                print(f"Error writing position journal: {e}")
+                with self._lock:
+                    self._written_confident = False
+                return
+            with self._lock:
+                self._written_confident = confident
+
+    def close(self):
+        """Writes pending changes, call once the axes are idle"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
+
+
+_journal = None
+
+
+def get_journal():
+    """The process wide PositionJournal"""
+    global _journal
+
+    if _journal is None:
+        _journal = PositionJournal(default_path())
+    return _journal
+
+
+def set_journal(journal):
+    """Replaces the process wide journal, e.g. with an in-memory one on the simulated rig"""
+    global _journal
+
+    _journal = journal
@@ -0,0 +1,133 @@
+"""
+Position tracking of the axes in microsteps.
+
+The motion controller books every pulse train into a PositionTracker when the
+train ends, with the number of microsteps that were actually output, so the
+position stays exact when a move is cut short by an endstop or a stop.
+Microsteps are 1/32 steps whatever microstep mode a train ran in.
+
+Positions count from home, away from the min endstop is positive. Once an
+axis was homed its soft max limit applies: the controller clamps jogs and
+continuous motion at the limit and refuses moves that would pass it. Moves
+that would end below home are refused too; jogs and continuous motion may go
+there, the endstop stops them.
+"""
+import threading
+from collections import namedtuple
+
+AxisTravel = namedtuple("AxisTravel", ["steps_per_mm", "max_steps"], defaults=(None, None))
+AxisTravel.__doc__ = """
+Travel of one axis.
+
+:param steps_per_mm: microsteps per millimetre of carriage travel, None if unknown
+:param max_steps: soft limit in microsteps from home, None for no limit
+"""
+
+
+class SoftLimitError(ValueError):
+    """A move would take an axis below home or past its soft max limit"""
+
+
+class PositionTracker:
+    """
+    Thread-safe microstep positions and step counts of the axes.
+
+    :param travel: dict axis -> AxisTravel
+    """
+
+    def __init__(self, travel):
+        self.travel = dict(travel)
+        self._position = {axis: 0 for axis in travel}
+        self._executed = {axis: 0 for axis in travel}  # microsteps output, either direction
+        self._homed = {axis: False for axis in travel}
+        self._lock = threading.Lock()
+
+    def add(self, axis, steps):
+        """Books steps microsteps on axis, negative toward the min endstop"""
+        with self._lock:
+            self._position[axis] += steps
+            self._executed[axis] += abs(steps)
+
+    def reset(self, axis=None):
+        """Sets the position of axis (all axes by default) to zero and marks it homed"""
+        with self._lock:
+            for a in ([axis] if axis else self._position):
+                self._position[a] = 0
+                self._homed[a] = True
+
+    def restore(self, positions):
+        """Sets the positions, e.g. from the position journal, and marks those axes homed"""
+        with self._lock:
+            for axis, steps in positions.items():
+                self._position[axis] = int(steps)
+                self._homed[axis] = True
+
+    def position(self, axis):
+        with self._lock:
+            return self._position[axis]
+
+    def positions(self):
+        """dict axis -> microsteps from home"""
+        with self._lock:
+            return dict(self._position)
+
+    def executed(self):
+        """dict axis -> microsteps output since start, either direction"""
+        with self._lock:
+            return dict(self._executed)
+
+    def homed(self, axis):
+        with self._lock:
+            return self._homed[axis]
+
+    # ----- Millimetres -----
+
+    def to_mm(self, axis, steps):
+        steps_per_mm = self.travel[axis].steps_per_mm
+        if not steps_per_mm:
+            raise ValueError(f"steps per mm of the {axis} axis are not configured")
+        return steps / steps_per_mm
+
+    def from_mm(self, axis, mm):
+        steps_per_mm = self.travel[axis].steps_per_mm
+        if not steps_per_mm:
+            raise ValueError(f"steps per mm of the {axis} axis are not configured")
+        return round(mm * steps_per_mm)
+
+    def positions_mm(self):
+        """dict axis -> millimetres from home"""
+        return {axis: self.to_mm(axis, steps) for axis, steps in self.positions().items()}
+
+    # ----- Soft limits -----
+
+    def headroom(self, axis, forward):
+        """
+        Microsteps axis can still travel in the given direction, None if unlimited.
+        Only the max side is limited, the min side has the endstop.
+        """
+        max_steps = self.travel[axis].max_steps
+        with self._lock:
+            if not forward or max_steps is None or not self._homed[axis]:
+                return None
+            return max(max_steps - self._position[axis], 0)
+
+    def check(self, axis, forward, steps):
+        """Raises SoftLimitError if steps microsteps in the given direction pass home or the limit"""
+        if not forward:
+            with self._lock:
+                below = self._homed[axis] and steps > self._position[axis]
+                position = self._position[axis]
+            if below:
+                raise SoftLimitError(f"{axis.upper()} move of {steps} steps passes home, {position} steps left")
+            return
+        room = self.headroom(axis, forward)
+        if room is not None and steps > room:
+            raise SoftLimitError(
+                f"{axis.upper()} move of {steps} steps passes the soft limit "
+                f"{self.travel[axis].max_steps}, {room} steps left"
+            )
+
+    def clamp(self, axis, forward, steps):
+        """steps, cut down to the headroom in the given direction"""
+        room = self.headroom(axis, forward)
+        return steps if room is None else min(steps, room)
@@ -0,0 +1,313 @@
+"""
+Pulse train engine for the step pins of the DRV8825 drivers.
+
+A whole move (a list of step periods) is handed to a backend in one call. The
+backend outputs the pulses on its own timing source and immediately returns a
+PulseTrain handle that can be waited on or aborted.
+
+Backends:
+    LgpioPulseBackend   : pulses are timed by lgpio (kernel side), not by Python
+    ThreadPulseBackend  : pure Python fallback, deadline scheduled on a thread
+    RecordingPulseBackend : records every train and finishes instantly (tests)
+"""
+import threading
+import time
+
+# DRV8825 needs the STEP pin high and low for at least 1.9 us each
+MIN_PULSE_US = 2
+MIN_STEP_PERIOD = 2 * MIN_PULSE_US / 1_000_000
+
+
+def constant_periods(steps, period):
+    """
+    Period list for a move of steps pulses at a fixed period (seconds)
+    """
+    return [max(period, MIN_STEP_PERIOD)] * max(int(steps), 0)
+
+
+# =================== Pulse Train Handle ===================
+
+
+class PulseTrain:
+    """
+    Handle for a pulse train that is being output by a backend.
+
+    :param pin: BCM number of the step pin
+    :param periods: step periods in seconds, one per step
+    :param delay: time in seconds before the first rising edge
+    """
+
+    def __init__(self, pin, periods, delay=0.0):
+        self.pin = pin
+        self.periods = [max(p, MIN_STEP_PERIOD) for p in periods]
+        self.delay = max(delay, 0.0)
+        self.steps = len(self.periods)
+        self.started_at = None
+        self.finished_at = None
+        self._steps_done = 0
+        self._done = threading.Event()
+        self._aborted = threading.Event()
+        self._cancel = None  # set by the backend
+        self._callbacks = []
+        self._callback_lock = threading.Lock()
+
+    @property
+    def duration(self):
+        """Planned duration of the train in seconds"""
+        return self.delay + sum(self.periods)
+
+    @property
+    def aborted(self):
+        return self._aborted.is_set()
+
+    @property
+    def steps_done(self):
+        """Number of steps that were actually output"""
+        return self._steps_done
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the train finished or was aborted.
+        Returns True if the train is done, False on timeout.
+        """
+        return self._done.wait(timeout)
+
+    def abort(self):
+        """
+        Stops the train as soon as possible. Safe to call from any thread,
+        also from gpiozero callbacks, and safe to call more than once.
+        """
+        if self._done.is_set():
+            return
+        self._aborted.set()
+        if self._cancel is not None:
+            self._cancel()
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(train) once the train is done, on the thread that finished it.
+        If the train is already done fn is called right away.
+        """
+        with self._callback_lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, steps_done):
+        self._steps_done = min(max(int(steps_done), 0), self.steps)
+        self.finished_at = time.monotonic()
+        with self._callback_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+# =================== Backends ===================
+
+
+class ThreadPulseBackend:
+    """
+    Pure Python backend. Every train runs on its own thread and each edge is
+    scheduled against an absolute deadline, so jitter does not accumulate.
+    The last part of every wait is spun instead of slept for accuracy.
+
+    :param write: function(pin, value) that sets an output pin
+    :param setup: function(pin) that configures a pin as output
+    :param cleanup: function(pin) that releases a pin
+    """
+
+    SPIN_WINDOW = 0.0002  # seconds spun before each edge instead of slept
+
+    def __init__(self, write, setup=None, cleanup=None):
+        self._write = write
+        self._setup = setup
+        self._cleanup = cleanup
+
+    def claim(self, pin):
+        if self._setup is not None:
+            self._setup(pin)
+
+    def release(self, pin):
+        self._write(pin, False)
+        if self._cleanup is not None:
+            self._cleanup(pin)
+
+    def start(self, pin, periods, delay=0.0):
+        train = PulseTrain(pin, periods, delay)
+        thread = threading.Thread(target=self._run, args=(train,), daemon=True)
+        train.started_at = time.monotonic()
+        thread.start()
+        return train
+
+    def _wait_until(self, deadline, train):
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or train._aborted.is_set():
+                return
+            if remaining > self.SPIN_WINDOW:
+                time.sleep(remaining - self.SPIN_WINDOW)
+
+    def _run(self, train):
+        steps = 0
+        try:
+            deadline = time.perf_counter() + train.delay
+            for period in train.periods:
+                self._wait_until(deadline, train)
+                if train._aborted.is_set():
+                    break
+                self._write(train.pin, True)
+                self._wait_until(deadline + period / 2, train)
+                self._write(train.pin, False)
+                steps += 1
+                deadline += period
+            else:
+                self._wait_until(deadline, train)
+        finally:
+            self._write(train.pin, False)
+            train._finish(steps)
+
+
+class LgpioPulseBackend:
+    """
+    Backend that lets lgpio time the pulses. Trains are fed as waves from a
+    small feeder thread that keeps the lgpio queue topped up.
+
+    The number of steps output is exact, also for aborted trains: it is the
+    number of steps fed minus the steps still waiting in the lgpio queue at
+    the moment of the abort. The abort check before a feed, the feed and the
+    cancel run under the train's lock, so no chunk is fed after a cancel and
+    the count taken at the cancel is final.
+
+    :param chip: gpiochip number (0 on the Pi 5 with a recent kernel)
+    """
+
+    WAVE_CHUNK = 200  # steps per tx_wave call
+    POLL = 0.002  # seconds between busy checks while waiting for a train
+
+    def __init__(self, chip=0):
+        import lgpio
+
+        self._lgpio = lgpio
+        self._handle = lgpio.gpiochip_open(chip)
+
+    def claim(self, pin):
+        self._lgpio.gpio_claim_output(self._handle, pin, 0)
+
+    def release(self, pin):
+        self._lgpio.gpio_free(self._handle, pin)
+
+    def close(self):
+        self._lgpio.gpiochip_close(self._handle)
+
+    def start(self, pin, periods, delay=0.0):
+        train = PulseTrain(pin, periods, delay)
+        train._lock = threading.Lock()  # abort check + feed, and cancel
+        train._fed = 0  # steps handed to lgpio so far
+        train._stopped_at = None  # steps output when the train was cancelled
+        train._capacity = self._lgpio.tx_room(self._handle, pin, self._lgpio.TX_WAVE)
+        train._cancel = lambda: self._cancel(train)
+        train.started_at = time.monotonic()
+        thread = threading.Thread(target=self._run, args=(train,), daemon=True)
+        thread.start()
+        return train
+
+    def _cancel(self, train):
+        lg = self._lgpio
+        with train._lock:
+            if train._stopped_at is not None:
+                return  # aborted twice, the queue is already empty
+            queued = train._capacity - lg.tx_room(self._handle, train.pin, lg.TX_WAVE)
+            lg.tx_pulse(self._handle, train.pin, 0, 0)
+            # Two queue entries per step, an odd count means the rising edge of a step already happened
+            train._stopped_at = train._fed - queued // 2
+
+    def _pulse_us(self, period):
+        half = max(int(round(period * 500_000)), MIN_PULSE_US)
+        return half, half
+
+    def _run(self, train):
+        lg = self._lgpio
+        if train.delay and train._aborted.wait(train.delay):
+            train._finish(0)
+            return
+        try:
+            for i in range(0, train.steps, self.WAVE_CHUNK):
+                pulses = []
+                for period in train.periods[i:i + self.WAVE_CHUNK]:
+                    on_us, off_us = self._pulse_us(period)
+                    pulses.append(lg.pulse(1, 1, on_us))
+                    pulses.append(lg.pulse(0, 1, off_us))
+                while lg.tx_room(self._handle, train.pin, lg.TX_WAVE) < len(pulses):
+                    if train._aborted.wait(self.POLL):
+                        break
+                with train._lock:
+                    if train._aborted.is_set():
+                        break
+                    lg.tx_wave(self._handle, train.pin, pulses)
+                    train._fed += len(pulses) // 2
+
+            while lg.tx_busy(self._handle, train.pin, lg.TX_WAVE):
+                if train._aborted.wait(self.POLL):
+                    break
+        finally:
+            if train._aborted.is_set():
+                # abort() may not have reached its cancel yet, the count is only final after one
+                self._cancel(train)
+                lg.gpio_write(self._handle, train.pin, 0)
+                train._finish(train._stopped_at)
+            else:
+                train._finish(train.steps)
+
+
+class RecordingPulseBackend:
+    """
+    Backend that records every train instead of outputting it. Trains are
+    finished instantly with all steps done. Meant for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.claimed = []
+        self.trains = []
+
+    def claim(self, pin):
+        self.claimed.append(pin)
+
+    def release(self, pin):
+        if pin in self.claimed:
+            self.claimed.remove(pin)
+
+    def start(self, pin, periods, delay=0.0):
+        train = PulseTrain(pin, periods, delay)
+        train.started_at = time.monotonic()
+        self.trains.append(train)
+        train._finish(train.steps)
+        return train
+
+    def steps(self, pin):
+        """Total number of steps that were output on pin"""
+        return sum(t.steps_done for t in self.trains if t.pin == pin)
+
+
+_lgpio_backend = None
+
+
+def default_backend(write, setup=None, cleanup=None):
+    """
+    Returns the lgpio backend when lgpio is available, otherwise the
+    pure Python fallback that toggles pins through write.
+    The lgpio backend is shared, so the gpiochip is only opened once.
+    """
+    global _lgpio_backend
+
+    if _lgpio_backend is None:
+        try:
+            _lgpio_backend = LgpioPulseBackend()
+        except Exception as e:
+            print(f"lgpio pulse backend unavailable ({e}), using Python timing")
+            return ThreadPulseBackend(write, setup, cleanup)
+    return _lgpio_backend
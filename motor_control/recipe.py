@@ -0,0 +1,319 @@
+"""
+Declarative wash recipes.
+
+A recipe lists the steps of a wash cycle against named calibration positions,
+as JSON or YAML:
+
+    name: default
+    steps:
+      - home
+      - move: spray
+      - together:
+          - spray: 10
+          - [wait: 8, move: sponge, scrub: 5]
+      - move: spray
+      - together:
+          - spray: 10
+          - [wait: 8, home]
+      - move: house
+
+Steps:
+    home                 two-phase homing, position (0, 0) afterwards
+    move: <name>         move to a calibration position, or move: [x, y]
+    spray: <seconds>     run the pump
+    scrub: <seconds>     let the sponge soak, then rotate it
+    wait: <seconds>      do nothing
+    together: [...]      run branches at the same time; a branch is one step
+                         or a list of steps, only one branch may move
+
+How home steps run is decided when the recipe is compiled (homing):
+    always   every home step homes
+    first    the first home step homes, later ones return to the origin with
+             one coordinated move (kind "origin" in the Plan)
+    never    every home step returns to the origin, for a rig whose position
+             is known from the position journal
+
+Any step can be written as a mapping with an extra name, which is the phase
+name in the cycle timing, e.g. {move: spray, name: return}.
+
+compile_recipe validates a recipe ahead of time and turns it into a Plan: the
+moves become relative moves in calibrated counts and every step gets its
+estimated start and duration from the motion planner, so the predicted cycle
+time of a recipe is known before the rig moves. Plans are cached by the
+recipe's hash, the positions and the speed limits, so compiling the same
+recipe every cycle is free.
+
+Usage:
+    python -m motor_control.recipe [recipe.json|recipe.yaml] [--homing first]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import namedtuple
+from functools import lru_cache
+
+from . import manual_control
+from .calibrate import planned_home_time
+
+RECIPE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recipe.json")
+
+STEP_KINDS = ("home", "move", "spray", "scrub", "wait", "together")
+
+HOMING_MODES = ("always", "first", "never")
+
+Step = namedtuple("Step", ["kind", "name", "args", "start", "duration", "children"])
+Step.__doc__ = """
+One step of a compiled Plan.
+
+:param kind: one of STEP_KINDS, "sequence" for a list of steps or "origin"
+    for a home step that returns to the origin without homing
+:param args: (calibrated_x, calibrated_y) of a relative move, (seconds,) of
+    spray, scrub and wait, () otherwise
+:param start: estimated seconds from the start of the cycle
+:param duration: estimated seconds
+:param children: steps of a sequence or the branches of together
+"""
+
+Plan = namedtuple("Plan", ["name", "digest", "root", "duration"])
+Plan.__doc__ = """
+A compiled recipe.
+
+:param digest: sha256 of the recipe, which the plan cache is keyed by
+:param root: sequence Step with the steps of the recipe
+:param duration: predicted cycle time in seconds
+"""
+
+
+class RecipeError(ValueError):
+    """The recipe is malformed or refers to an unknown position"""
+
+
+# =================== Loading ===================
+
+
+def load_recipe(path=RECIPE_PATH):
+    """Reads a recipe from a .json, .yaml or .yml file"""
+    with open(path) as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RecipeError(f"{path}: reading YAML recipes needs PyYAML (pip install pyyaml)")
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise RecipeError(f"{path}: {e}")
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise RecipeError(f"{path}: {e}")
+
+
+# =================== Compiling ===================
+
+
+def compile_recipe(recipe, positions, homing="always"):
+    """
+    Validates recipe and compiles it into a Plan.
+
+    :param recipe: dict with "steps" (and optionally "name"), as read by load_recipe
+    :param positions: dict name -> (x, y) of the calibrated positions
+    :param homing: one of HOMING_MODES
+    :raises RecipeError: when the recipe is invalid
+    """
+    if homing not in HOMING_MODES:
+        raise ValueError(f"homing must be one of {', '.join(HOMING_MODES)}, got {homing!r}")
+    try:
+        text = json.dumps(recipe, sort_keys=True)
+    except (TypeError, ValueError) as e:
+        raise RecipeError(f"recipe is not plain data: {e}")
+    positions = tuple(sorted((name, (int(x), int(y))) for name, (x, y) in positions.items()))
+    return _compile(text, positions, homing, (manual_control.get_limits("x"), manual_control.get_limits("y")))
+
+
+@lru_cache(maxsize=32)
+def _compile(text, positions, homing, limits):
+    # limits only keys the cache, the estimates depend on the speed limits of the moves
+    recipe = json.loads(text)
+    if not isinstance(recipe, dict) or not isinstance(recipe.get("steps"), list):
+        raise RecipeError("a recipe is a mapping with a list of steps")
+
+    # A cycle starts where the previous one ended, so the first pass finds the
+    # end position and the second pass estimates the first home from there
+    compiler = _Compiler(dict(positions), homing, start=(0, 0))
+    compiler.sequence(recipe["steps"], "steps")
+    compiler = _Compiler(dict(positions), homing, start=compiler.position)
+    root = compiler.sequence(recipe["steps"], "steps")
+
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    return Plan(str(recipe.get("name", "recipe")), digest, root, root.duration)
+
+
+class _Compiler:
+    """Tracks position and estimated time while a recipe is compiled"""
+
+    def __init__(self, positions, homing, start):
+        self.positions = positions
+        self.homing = homing
+        self.homings = 0  # home steps compiled as a real homing
+        self.position = start  # calibrated counts, estimate only until homed
+        self.homed = False
+        self.time = 0.0
+        self.moving = False  # set by steps that drive the axes
+
+    def sequence(self, raw, path):
+        if not isinstance(raw, list) or not raw:
+            raise RecipeError(f"{path}: expected a non-empty list of steps")
+        start = self.time
+        children = tuple(self.step(item, f"{path}[{i}]") for i, item in enumerate(raw))
+        return Step("sequence", "sequence", (), start, self.time - start, children)
+
+    def step(self, raw, path):
+        if isinstance(raw, list):
+            return self.sequence(raw, path)
+        if isinstance(raw, str):
+            raw = {raw: None}
+        if not isinstance(raw, dict):
+            raise RecipeError(f"{path}: expected a step, got {raw!r}")
+
+        raw = dict(raw)
+        name = raw.pop("name", None)
+        if len(raw) != 1:
+            raise RecipeError(f"{path}: a step has exactly one of {', '.join(STEP_KINDS)}")
+        (kind, arg), = raw.items()
+        if kind not in STEP_KINDS:
+            raise RecipeError(f"{path}: unknown step {kind!r}, expected one of {', '.join(STEP_KINDS)}")
+        return getattr(self, "_" + kind)(arg, name, f"{path}.{kind}")
+
+    def _leaf(self, kind, name, args, duration):
+        step = Step(kind, name, args, self.time, duration, ())
+        self.time += duration
+        return step
+
+    def _home(self, arg, name, path):
+        if arg is not None:
+            raise RecipeError(f"{path}: home takes no argument")
+        x, y = self.position
+        self.position = (0, 0)
+        self.homed = True
+        self.moving = True
+        if self.homing == "always" or (self.homing == "first" and not self.homings):
+            self.homings += 1
+            duration = planned_home_time({"x": x * manual_control.JOG_STEPS, "y": y * manual_control.JOG_STEPS})
+            return self._leaf("home", name or "home", (), duration)
+        return self._leaf("origin", name or "return-home", (), manual_control.planned_move_time(-x, -y))
+
+    def _move(self, arg, name, path):
+        if isinstance(arg, str):
+            if arg not in self.positions:
+                known = ", ".join(sorted(self.positions)) or "none"
+                raise RecipeError(f"{path}: unknown position {arg!r} (calibrated: {known})")
+            target = self.positions[arg]
+            default_name = f"move-to-{arg}"
+        elif isinstance(arg, list) and len(arg) == 2 and all(isinstance(v, int) for v in arg):
+            target = tuple(arg)
+            default_name = f"move-to-{arg[0]},{arg[1]}"
+        else:
+            raise RecipeError(f"{path}: expected a position name or [x, y], got {arg!r}")
+        if not self.homed:
+            raise RecipeError(f"{path}: move before the first home, the position is unknown")
+
+        for axis, value, travel in (("x", target[0], manual_control.X_TRAVEL), ("y", target[1], manual_control.Y_TRAVEL)):
+            if value < 0:
+                raise RecipeError(f"{path}: {axis} = {value} is below home, behind the min endstop")
+            if travel.max_steps is not None and value * manual_control.JOG_STEPS > travel.max_steps:
+                raise RecipeError(f"{path}: {axis} = {value} is past the soft limit of {travel.max_steps} microsteps")
+
+        dx, dy = target[0] - self.position[0], target[1] - self.position[1]
+        self.position = target
+        self.moving = True
+        return self._leaf("move", name or default_name, (dx, dy), manual_control.planned_move_time(dx, dy))
+
+    def _seconds(self, kind, arg, name, path):
+        if isinstance(arg, bool) or not isinstance(arg, (int, float)) or arg < 0:
+            raise RecipeError(f"{path}: expected seconds >= 0, got {arg!r}")
+        return self._leaf(kind, name or kind, (float(arg),), float(arg))
+
+    def _spray(self, arg, name, path):
+        return self._seconds("spray", arg, name, path)
+
+    def _scrub(self, arg, name, path):
+        step = self._seconds("scrub", arg, name, path)
+        # The sponge turns both ways after the dwell
+        turn = 2 * manual_control.SPONGE_TURN_TIME
+        self.time += turn
+        return step._replace(duration=step.duration + turn)
+
+    def _wait(self, arg, name, path):
+        return self._seconds("wait", arg, name, path)
+
+    def _together(self, arg, name, path):
+        if not isinstance(arg, list) or len(arg) < 2:
+            raise RecipeError(f"{path}: expected a list of at least two branches")
+
+        start, moving = self.time, self.moving
+        branches, ends, end_state = [], [], None
+        for i, raw in enumerate(arg):
+            self.time = start
+            self.moving = False
+            before = (self.position, self.homed)
+            branches.append(self.step(raw, f"{path}[{i}]"))
+            ends.append(self.time)
+            if self.moving:
+                if end_state is not None:
+                    raise RecipeError(f"{path}: more than one branch moves the axes")
+                end_state = (self.position, self.homed)
+            self.position, self.homed = before
+
+        if end_state is not None:
+            self.position, self.homed = end_state
+        self.moving = moving or end_state is not None
+        self.time = max(ends)
+        return Step("together", name or "together", (), start, self.time - start, tuple(branches))
+
+
+# =================== Inspection ===================
+
+
+def leaves(step):
+    """The home, move, spray, scrub and wait steps below step, in recipe order"""
+    if step.kind in ("sequence", "together"):
+        for child in step.children:
+            yield from leaves(child)
+    else:
+        yield step
+
+
+def describe(plan):
+    """One line per step with its estimated start and duration, then the predicted total"""
+    lines = [f"Recipe {plan.name} ({plan.digest[:12]})"]
+    for step in sorted(leaves(plan.root), key=lambda step: step.start):
+        args = " ".join(str(arg) for arg in step.args)
+        lines.append(f"{step.name:<15} {step.start:>8.2f} +{step.duration:>7.2f} s  {args}")
+    lines.append(f"Predicted cycle time: {plan.duration:.2f} s")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from .calibration_store import get_store
+
+    parser = argparse.ArgumentParser(description="Validate a wash recipe and predict its cycle time")
+    parser.add_argument("path", nargs="?", default=RECIPE_PATH, help="recipe file, .json or .yaml")
+    parser.add_argument("--homing", choices=HOMING_MODES, default="always", help="how home steps run")
+    args = parser.parse_args(argv)
+
+    positions = {name: (p["x"], p["y"]) for name, p in get_store().positions().items()}
+    try:
+        plan = compile_recipe(load_recipe(args.path), positions, args.homing)
+    except (OSError, RecipeError) as e:
+        print(f"Invalid recipe: {e}")
+        return 1
+    print(describe(plan))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
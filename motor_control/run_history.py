@@ -0,0 +1,228 @@
+"""
+Run history of the wash cycles.
+
+Every finished cycle is appended as one row to a SQLite database in WAL mode,
+so an append costs the same no matter how long the history is, and a power
+cut during a write loses at most that one run instead of the whole history.
+Rows are indexed by start time, so recent cycles and duration percentiles are
+queried without reading everything. Once the database holds more than
+MAX_RUNS runs the oldest are deleted and the file is compacted.
+
+The old logging.json list is imported once, the first time the database is
+opened next to it.
+
+Usage:
+    python -m motor_control.run_history --recent 10
+    python -m motor_control.run_history --since 2026-01-01 --percentiles 50,90,99
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DB_NAME = "run_history.db"
+LEGACY_JSON = "logging.json"
+
+# Runs kept, and how often (in appends) that is enforced
+MAX_RUNS = 50000
+COMPACT_EVERY = 500
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start_time TEXT NOT NULL,
+    end_time TEXT,
+    duration REAL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_start_time ON runs (start_time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def default_path():
+    """run_history.db next to this file, where logging.json used to be written"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), DB_NAME)
+
+
+def _duration(record):
+    """Cycle duration in seconds: the timed total if present, else end - start"""
+    timing = record.get("timing")
+    if timing and timing.get("total") is not None:
+        return float(timing["total"])
+    try:
+        start = datetime.strptime(record["start_time"], TIME_FORMAT)
+        end = datetime.strptime(record["end_time"], TIME_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (end - start).total_seconds()
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class RunHistory:
+    """
+    Append-only store of run records.
+
+    :param path: database file, default_path() by default
+    :param max_runs: oldest runs beyond this count are deleted on compaction
+    """
+
+    def __init__(self, path=None, max_runs=MAX_RUNS):
+        self.path = path or default_path()
+        self.max_runs = max_runs
+        self._appends = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL never corrupts the database, a power cut can only drop the last commit
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._migrate_legacy_json()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----- Writing -----
+
+    def append(self, record):
+        """
+        Appends one run. record is a dict with at least start_time and
+        end_time strings, anything else (timing, errors) is kept as JSON.
+        """
+        with self._lock, self._db:
+            self._insert(record)
+        self._appends += 1
+        if self._appends % COMPACT_EVERY == 0:
+            self.compact()
+
+    def _insert(self, record):
+        self._db.execute(
+            "INSERT INTO runs (start_time, end_time, duration, record) VALUES (?, ?, ?, ?)",
+            (record["start_time"], record.get("end_time"), _duration(record), json.dumps(record)),
+        )
+
+    def compact(self):
+        """Deletes the oldest runs beyond max_runs and shrinks the file"""
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    "DELETE FROM runs WHERE id <= "
+                    "(SELECT id FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (self.max_runs,),
+                )
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.execute("VACUUM")
+
+    def _migrate_legacy_json(self):
+        legacy = os.path.join(os.path.dirname(os.path.abspath(self.path)), LEGACY_JSON)
+        with self._lock:
+            done = self._db.execute("SELECT value FROM meta WHERE key = 'legacy_imported'").fetchone()
+            if done or not os.path.exists(legacy):
+                return
+            try:
+                with open(legacy, "r") as fp:
+                    records = json.load(fp)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Could not import {legacy}: {e}")
+                records = []
+            with self._db:
+                for record in records:
+                    if isinstance(record, dict) and record.get("start_time"):
+                        self._insert(record)
+                self._db.execute(
+                    "INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (legacy,)
+                )
+            print(f"Imported {len(records)} runs from {legacy}")
+
+    # ----- Queries -----
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def recent(self, n=10):
+        """The n most recent runs, newest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT record FROM runs ORDER BY start_time DESC, id DESC LIMIT ?", (n,)
+            ).fetchall()
+        return [json.loads(row["record"]) for row in rows]
+
+    def between(self, since=None, until=None):
+        """
+        Runs that started in [since, until), oldest first. Both are
+        datetimes or strings in TIME_FORMAT (a date alone works too).
+        """
+        query, args = self._range("SELECT record FROM runs", since, until)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY start_time, id", args).fetchall()
+        return [json.loads(row["record"]) for row in rows]
+
+    def duration_percentiles(self, percentiles=(50, 90, 99), since=None, until=None):
+        """dict percentile -> cycle duration in seconds, over the runs in [since, until)"""
+        query, args = self._range("SELECT duration FROM runs", since, until)
+        query += (" AND" if args else " WHERE") + " duration IS NOT NULL ORDER BY duration"
+        with self._lock:
+            durations = [row[0] for row in self._db.execute(query, args)]
+        return {p: _percentile(durations, p / 100) for p in percentiles}
+
+    def _range(self, query, since, until):
+        clauses, args = [], []
+        for op, value in ((">=", since), ("<", until)):
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                value = value.strftime(TIME_FORMAT)
+            clauses.append(f"start_time {op} ?")
+            args.append(value)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        return query, args
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the wash cycle run history")
+    parser.add_argument("--db", default=None, help=f"database file, default {DB_NAME} next to this module")
+    parser.add_argument("--recent", type=int, default=10, help="number of recent runs to list")
+    parser.add_argument("--since", default=None, help="only runs started at or after this date")
+    parser.add_argument("--until", default=None, help="only runs started before this date")
+    parser.add_argument("--percentiles", default="50,90,99", help="comma separated duration percentiles")
+    parser.add_argument("--compact", action="store_true", help="drop runs beyond MAX_RUNS and shrink the file")
+    args = parser.parse_args()
+
+    with RunHistory(args.db) as history:
+        if args.compact:
+            history.compact()
+        print(f"{history.count()} runs in {history.path}")
+        for run in history.recent(args.recent):
+            duration = _duration(run)
+            duration = "-" if duration is None else f"{duration:.1f} s"
+            print(f"{run['start_time']}  {run.get('end_time', '-')}  {duration:>9}")
+        percentiles = [float(p) for p in args.percentiles.split(",")]
+        stats = history.duration_percentiles(percentiles, args.since, args.until)
+        print("  ".join(f"p{p:g}={'-' if v is None else f'{v:.1f} s'}" for p, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
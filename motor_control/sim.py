@@ -0,0 +1,466 @@
+"""
+Simulated rig, to run the wash cycle without any hardware.
+
+The rig replaces RPi.GPIO with SimGPIO, the pulse backend with one that moves
+simulated axes, and the gpiozero pin factory with gpiozero's MockFactory. The
+axes track their position from the step, dir, enable and microstep pins and
+drive the X/Y min endstop pins when the carriage reaches zero. Waits go
+through a virtual clock, so a full wash cycle takes well under a second of wall time
+while the clock still reports what the real rig would need.
+
+Every cycle starts like a restarted process: the rig is initialized again
+and the position journal is read back from its file, in a temp folder. After
+a completed cycle the next one has to continue from the journal without
+homing.
+
+Every cycle is checked against the simulated carriage. A cycle fails when
+it does not complete, it homes after a clean restart, an endstop is hit outside homing, steps are lost
+against the frame, the carriage ends up away from the tracked position or the
+rig cannot be released. Failed cycles are listed and the run exits with
+status 1.
+
+Usage:
+    python -m motor_control.sim --cycles 3
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+from . import clock, drift_monitor, manual_control, position_journal
+from .pulse_engine import PulseTrain
+
+# 1/32 microsteps moved per step for each level of the mode pins
+MICROSTEP_SIZE = {
+    (0, 0, 0): 32,
+    (1, 0, 0): 16,
+    (0, 1, 0): 8,
+    (1, 1, 0): 4,
+    (0, 0, 1): 2,
+    (1, 0, 1): 1,
+}
+
+
+# =================== Clock ===================
+
+
+class SimClock:
+    """
+    Virtual clock. Sleeps and timed waits block until virtual time reaches
+    their deadline. Virtual time jumps to the earliest deadline as soon as
+    no thread started or finished a wait for QUIET seconds of wall time, so
+    waits on different threads overlap exactly as they would on the rig.
+    """
+
+    QUIET = 0.002  # wall seconds without clock activity before time jumps ahead
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._cond = threading.Condition()
+        self._deadlines = []  # deadlines of the waits that are blocked
+        self._activity = 0
+        self._held = 0  # blocks running in hold(), time does not jump meanwhile
+        self._advancer = None
+
+    def monotonic(self):
+        with self._cond:
+            return self._now
+
+    def advance_to(self, t):
+        with self._cond:
+            if t > self._now:
+                self._now = t
+                self._cond.notify_all()
+
+    @contextmanager
+    def hold(self):
+        """Keeps virtual time from jumping while the block runs, e.g. while a train is set up"""
+        with self._cond:
+            self._held += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._held -= 1
+                self._activity += 1
+
+    def sleep(self, seconds):
+        self.sleep_until(self.monotonic() + max(seconds, 0.0))
+
+    def sleep_until(self, t):
+        self._wait_until(t, None)
+
+    def wait(self, event, timeout=None):
+        if timeout is None:
+            return event.wait()
+        return self._wait_until(self.monotonic() + max(timeout, 0.0), event)
+
+    async def async_sleep(self, seconds):
+        # Waits on an executor thread, a cancelled sleep ends that wait right away
+        cancelled = threading.Event()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.wait, cancelled, seconds)
+        finally:
+            cancelled.set()
+
+    def _wait_until(self, deadline, event):
+        with self._cond:
+            if self._advancer is None:
+                self._advancer = threading.Thread(target=self._advance, daemon=True)
+                self._advancer.start()
+            self._deadlines.append(deadline)
+            self._activity += 1
+            self._cond.notify_all()
+            try:
+                while self._now < deadline:
+                    if event is not None and event.is_set():
+                        break
+                    # Events are set without notifying the clock, so those waits poll
+                    self._cond.wait(0.001 if event is not None else None)
+            finally:
+                self._deadlines.remove(deadline)
+                self._activity += 1
+        return event is not None and event.is_set()
+
+    def _advance(self):
+        while True:
+            with self._cond:
+                while not self._deadlines:
+                    self._cond.wait()
+                seen = self._activity
+            time.sleep(self.QUIET)
+            with self._cond:
+                if self._activity == seen and self._deadlines and not self._held:
+                    self._now = max(self._now, min(self._deadlines))
+                    self._cond.notify_all()
+
+
+# =================== GPIO ===================
+
+
+class SimGPIO:
+    """
+    Stand-in for the RPi.GPIO module, as used by DRV8825. Keeps the level of
+    every output pin so the simulated axes can read them.
+    """
+
+    BCM = "BCM"
+    OUT = "OUT"
+    IN = "IN"
+
+    def __init__(self):
+        self.levels = {}
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pins, direction):
+        for pin in pins if isinstance(pins, (list, tuple)) else [pins]:
+            self.levels.setdefault(pin, 0)
+
+    def output(self, pins, values):
+        if isinstance(pins, (list, tuple)):
+            if not isinstance(values, (list, tuple)):
+                values = [values] * len(pins)
+            for pin, value in zip(pins, values):
+                self.levels[pin] = int(bool(value))
+        else:
+            self.levels[pins] = int(bool(values))
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def cleanup(self, *args):
+        pass
+
+
+# =================== Axis ===================
+
+
+class SimAxis:
+    """
+    One simulated axis driven by a DRV8825.
+
+    Position is in 1/32 microsteps from the min endstop switch point. Past the
+    switch the carriage can only travel overtravel more before it hits the
+    frame, further steps backward are lost, as are steps beyond travel.
+
+    :param rig: SimRig the axis belongs to
+    :param endstop_pin: BCM pin of the min endstop
+    :param pull_up: pull up setting of the endstop Button, sets the pressed level
+    """
+
+    def __init__(self, rig, dir_pin, enable_pin, mode_pins, endstop_pin, pull_up,
+                 position=0, travel=200000, overtravel=200):
+        self.rig = rig
+        self.dir_pin = dir_pin
+        self.enable_pin = enable_pin
+        self.mode_pins = mode_pins
+        self.endstop_pin = endstop_pin
+        self.pull_up = pull_up
+        self.position = position
+        self.travel = travel
+        self.overtravel = overtravel
+        self.steps = 0  # step pulses received
+        self.lost_steps = 0  # pulses that did not move the carriage
+        self.pressed = False
+        self._lock = threading.Lock()
+
+    def step(self, count=1, before_edge=None):
+        """
+        Applies count step pulses at the current pin levels. Stops early at the
+        next endstop edge, so its callback runs exactly at the switch point.
+        Returns the number of pulses consumed.
+
+        :param before_edge: optional function(pulses) called before the endstop switches
+        """
+        gpio = self.rig.gpio
+        if not gpio.input(self.enable_pin):
+            return count
+        size = MICROSTEP_SIZE[tuple(gpio.input(p) for p in self.mode_pins)]
+        # DRV8825.SetDirection writes dir 0 for forward
+        forward = gpio.input(self.dir_pin) == 0
+
+        with self._lock:
+            # Pulses until the endstop switches, pressed at position <= 0
+            if forward and self.position <= 0:
+                count = min(count, -self.position // size + 1)
+            elif not forward and self.position > 0:
+                count = min(count, -(-self.position // size))
+
+            target = self.position + (count * size if forward else -count * size)
+            new = min(max(target, -self.overtravel), self.travel)
+            self.lost_steps += abs(target - new) // size
+            self.steps += count
+            self.position = new
+        if before_edge is not None and (self.position <= 0) != self.pressed:
+            before_edge(count)
+        self._update_endstop()
+        return count
+
+    def _update_endstop(self):
+        pressed = self.position <= 0
+        if pressed == self.pressed:
+            return
+        self.pressed = pressed
+        pin = self.rig.pin_factory.pin(self.endstop_pin)
+        # A pull up button is pressed when the pin is pulled low
+        if pressed == self.pull_up:
+            pin.drive_low()
+        else:
+            pin.drive_high()
+
+
+# =================== Pulse Backend ===================
+
+
+class SimPulseBackend:
+    """
+    Pulse backend that steps the simulated axes. Every train is stepped at
+    once on its own thread, which then sleeps on the virtual clock until the
+    time the train would have ended on the real rig.
+    """
+
+    def __init__(self, rig):
+        self.rig = rig
+
+    def claim(self, pin):
+        pass
+
+    def release(self, pin):
+        pass
+
+    def start(self, pin, periods, delay=0.0):
+        # Setting up a long train takes a while on the host, the rig would not lose that time
+        with self.rig.clock.hold():
+            train = PulseTrain(pin, periods, delay)
+            train.started_at = self.rig.clock.monotonic()
+            thread = threading.Thread(target=self._run, args=(train,), daemon=True)
+            thread.start()
+        return train
+
+    def _run(self, train):
+        axis = self.rig.axis_for_step_pin(train.pin)
+        steps = 0
+
+        def at_edge(pulses):
+            # The endstop switches when the pulse that reaches it is output
+            self.rig.clock.sleep_until(train.started_at + train.delay + sum(train.periods[:steps + pulses]))
+
+        while steps < train.steps and not train._aborted.is_set():
+            steps += axis.step(train.steps - steps, at_edge)
+        elapsed = train.delay + sum(train.periods[:steps])
+        self.rig.clock.sleep_until(train.started_at + elapsed)
+        train._finish(steps)
+
+
+# =================== Rig ===================
+
+
+class SimRig:
+    """
+    Simulated washer rig with the pin layout of manual_control.
+
+    :param x_position: start position of the X carriage in 1/32 microsteps
+    :param y_position: start position of the Y carriage in 1/32 microsteps
+    """
+
+    def __init__(self, x_position=40000, y_position=60000):
+        mc = manual_control
+        self.clock = SimClock()
+        self.gpio = SimGPIO()
+        self.pin_factory = MockFactory(pin_class=MockPWMPin)
+        self.pulse_backend = SimPulseBackend(self)
+        self.axes = {
+            "y": SimAxis(self, mc.DIR1, mc.ENABLE1, mc.MODE1, mc.Y_MIN_PIN, mc.Y_MIN_PULL_UP, y_position),
+            "x": SimAxis(self, mc.DIR2, mc.ENABLE2, mc.MODE2, mc.X_MIN_PIN, mc.X_MIN_PULL_UP, x_position),
+        }
+        self._journal_dir = tempfile.mkdtemp(prefix="biomim_8_sim-")
+        self.journal = position_journal.PositionJournal(os.path.join(self._journal_dir, position_journal.FILE_NAME))
+        self.last_outcome = None  # of the last cycle run_cycle ran
+        self.drift_monitor = drift_monitor.DriftMonitor()
+        self.home_offset = {}  # axis -> carriage position at tracked position 0, set by every homing
+        self.endstop_hits = []  # axes hit outside homing
+        self._step_pins = {mc.STEP1: self.axes["y"], mc.STEP2: self.axes["x"]}
+        self._saved = None
+
+    def axis_for_step_pin(self, pin):
+        return self._step_pins[pin]
+
+    def watch(self, controller):
+        """Follows the homings and unexpected endstop hits of controller"""
+        controller.add_listener(self._on_event)
+
+    def _on_event(self, event, axis):
+        if event == "home":
+            self.home_offset[axis] = self.axes[axis].position
+        elif event == "endstop":
+            self.endstop_hits.append(axis)
+
+    def position_errors(self, controller):
+        """dict axis -> 1/32 microsteps the carriage is away from the tracked position, for homed axes"""
+        tracked = controller.position
+        return {axis: self.axes[axis].position - offset - tracked[axis] for axis, offset in self.home_offset.items()}
+
+    def install(self):
+        """Makes manual_control and the clock use this rig instead of the hardware."""
+        mc = manual_control
+        self._saved = (
+            mc.gpio_module, mc.pulse_backend, mc.pin_factory, clock.get_clock(), Device.pin_factory,
+            position_journal._journal, drift_monitor._monitor,
+        )
+        mc.gpio_module = self.gpio
+        mc.pulse_backend = self.pulse_backend
+        mc.pin_factory = self.pin_factory
+        clock.set_clock(self.clock)
+        Device.pin_factory = self.pin_factory
+        # The carriage starts at an unknown position, the real journal is left alone
+        position_journal.set_journal(self.journal)
+        drift_monitor.set_monitor(self.drift_monitor)
+        return self
+
+    def restart(self):
+        """Reads the journal back from its file, as a restarted process would"""
+        self.journal = position_journal.PositionJournal(self.journal.path)
+        position_journal.set_journal(self.journal)
+
+    def uninstall(self):
+        if self._saved is None:
+            return
+        mc = manual_control
+        mc.gpio_module, mc.pulse_backend, mc.pin_factory, saved_clock, Device.pin_factory, journal, monitor = self._saved
+        clock.set_clock(saved_clock)
+        position_journal.set_journal(journal)
+        self.drift_monitor.restore_speed()
+        drift_monitor.set_monitor(monitor)
+        shutil.rmtree(self._journal_dir, ignore_errors=True)
+        self._saved = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+
+
+# =================== Checked Cycles ===================
+
+
+def run_cycle(rig):
+    """
+    Initializes the rig, runs one wash cycle and releases the rig, like
+    test_wash.demo, and checks the cycle against the simulated carriage.
+
+    :return: (run record, list of problems found)
+    """
+    from .test_wash import init_rig, release_rig, run_cycle as run_wash_cycle
+
+    lost = {axis: sim_axis.lost_steps for axis, sim_axis in rig.axes.items()}
+    rig.endstop_hits = []
+    record = {}
+    problems = []
+    rig.restart()
+    reason = rig.journal.homing_reason()
+    if rig.last_outcome == "completed" and reason is not None:
+        problems.append(f"homed after a clean restart: {reason}")
+    handles = init_rig()
+    try:
+        controller = manual_control.controller
+        rig.watch(controller)
+        run_wash_cycle(record=False, result=record)
+        errors = {axis: error for axis, error in rig.position_errors(controller).items() if error}
+        if errors:
+            problems.append(f"carriage away from the tracked position by {errors} microsteps")
+    finally:
+        if not release_rig(handles):
+            problems.append("the rig could not be released")
+
+    rig.last_outcome = record.get("outcome")
+    if record.get("outcome") != "completed":
+        problems.insert(0, f"cycle did not complete: {record.get('outcome')}")
+    for axis in sorted(set(rig.endstop_hits)):
+        problems.append(f"{axis} endstop hit {rig.endstop_hits.count(axis)} times outside homing")
+    lost = {axis: sim_axis.lost_steps - lost[axis] for axis, sim_axis in rig.axes.items()}
+    if any(lost.values()):
+        problems.append(f"steps lost against the frame: {lost}")
+    return record, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run wash cycles on the simulated rig")
+    parser.add_argument("--cycles", type=int, default=1)
+    args = parser.parse_args()
+
+    failed = 0
+    with SimRig() as rig:
+        for i in range(args.cycles):
+            wall_start = time.perf_counter()
+            sim_start = rig.clock.monotonic()
+            record, problems = run_cycle(rig)
+            print(
+                f"Cycle {i + 1}: {rig.clock.monotonic() - sim_start:.1f} s simulated, "
+                f"{time.perf_counter() - wall_start:.3f} s wall, homing {record.get('homing')}"
+            )
+            for problem in problems:
+                print(f"  FAILED: {problem}")
+            failed += bool(problems)
+
+    if failed:
+        print(f"{failed} of {args.cycles} simulated cycles failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
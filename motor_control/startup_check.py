@@ -0,0 +1,162 @@
+"""
+Startup check for the entry points.
+
+Every entry point is imported in a fresh interpreter, as systemd would start
+it. The check fails when an import takes longer than its budget, when an
+import loads a hardware module (gpiozero, RPi.GPIO, lgpio) or when it installs
+signal handlers: all of that belongs in main(), not at import time.
+
+The slowest modules of every import are listed from python -X importtime,
+so a regression points straight at its cause. With --ready the time from
+interpreter start to a ready wash service is measured on the simulated rig.
+
+Usage:
+    python -m motor_control.startup_check
+    python -m motor_control.startup_check --ready --top 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Entry point -> import budget in seconds, with headroom for the Pi 5 SD card
+IMPORT_BUDGET = {
+    "main": 0.05,
+    "button_launcher": 0.15,
+    "motor_control.test_wash": 0.25,
+    "motor_control.wash_service": 0.25,
+    "motor_control.calibrate": 0.25,
+    "motor_control.manual_control": 0.15,
+}
+
+# Process start to a ready wash service on the simulated rig
+READY_BUDGET = 1.5
+
+HARDWARE_MODULES = ("gpiozero", "RPi", "lgpio")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_PROBE = """
+import signal, sys, time
+start = time.perf_counter()
+exec("import " + sys.argv[1])
+seconds = time.perf_counter() - start
+import json
+print(json.dumps({
+    "seconds": seconds,
+    "hardware": [m for m in %r if m in sys.modules],
+    "signals": [
+        name for name in ("SIGINT", "SIGTERM", "SIGHUP")
+        if signal.getsignal(getattr(signal, name)) not in (signal.SIG_DFL, signal.default_int_handler)
+    ],
+}))
+""" % (HARDWARE_MODULES,)
+
+_READY_PROBE = """
+import json, time
+from motor_control.sim import SimRig
+from motor_control.wash_service import WashService
+with SimRig():
+    service = WashService(record=False, log=lambda message: None).start()
+    ready = time.perf_counter()
+    service.stop()
+print(json.dumps({"ready": ready}))
+"""
+
+
+def _run(code, *args, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", code, *args]
+    return subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+
+
+def slowest_imports(importtime_output, module, top=5):
+    """
+    (cumulative us, name) of the slowest imports done while importing module,
+    from -X importtime output. Its nested imports are the lines right before
+    its own line that are indented deeper.
+    """
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), len(name) - len(name.lstrip()), name.strip()))
+
+    names = [name for _, _, name in rows]
+    if module not in names:
+        return []
+    end = len(names) - 1 - names[::-1].index(module)
+    depth = rows[end][1]
+    start = end
+    while start > 0 and rows[start - 1][1] > depth:
+        start -= 1
+    return sorted(((c, name) for c, _, name in rows[start:end]), reverse=True)[:top]
+
+
+def check_import(module, budget, top=5):
+    """Imports module in a fresh interpreter, returns (problems, result)"""
+    proc = _run(_IMPORT_PROBE, module, importtime=True)
+    if proc.returncode != 0:
+        return [f"{module}: import failed\n{proc.stderr.strip().splitlines()[-1]}"], None
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["slowest"] = slowest_imports(proc.stderr, module, top)
+    problems = []
+    if result["seconds"] > budget:
+        problems.append(f"{module}: import took {result['seconds'] * 1000:.0f} ms, budget {budget * 1000:.0f} ms")
+    if result["hardware"]:
+        problems.append(f"{module}: imports hardware modules {', '.join(result['hardware'])}")
+    if result["signals"]:
+        problems.append(f"{module}: installs handlers for {', '.join(result['signals'])} at import")
+    return problems, result
+
+
+def check_ready(budget=READY_BUDGET):
+    """Measures process start to a ready WashService on the simulated rig"""
+    import time
+
+    start = time.perf_counter()
+    proc = _run(_READY_PROBE)
+    if proc.returncode != 0:
+        return [f"ready: failed\n{proc.stderr.strip()}"], None
+    # perf_counter is system wide on Linux, so the child's timestamp is comparable
+    seconds = json.loads(proc.stdout.strip().splitlines()[-1])["ready"] - start
+    problems = []
+    if seconds > budget:
+        problems.append(f"ready: took {seconds:.2f} s, budget {budget:.2f} s")
+    return problems, seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check import time and import side effects of the entry points")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per entry point")
+    parser.add_argument("--ready", action="store_true", help="also time a ready wash service on the simulated rig")
+    args = parser.parse_args(argv)
+
+    problems = []
+    for module, budget in IMPORT_BUDGET.items():
+        found, result = check_import(module, budget, args.top)
+        problems += found
+        if result is None:
+            continue
+        print(f"{module:<30} {result['seconds'] * 1000:7.1f} ms  (budget {budget * 1000:.0f} ms)")
+        for cumulative, name in result["slowest"]:
+            print(f"    {cumulative / 1000:7.1f} ms  {name}")
+
+    if args.ready:
+        found, seconds = check_ready()
+        problems += found
+        if seconds is not None:
+            print(f"{'ready (simulated rig)':<30} {seconds * 1000:7.1f} ms  (budget {READY_BUDGET * 1000:.0f} ms)")
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+Live telemetry of the rig.
+
+A Unix socket server on the wash service's event loop that streams the state
+of the rig to local subscribers (dashboards, loggers), one JSON object per line:
+
+    {"t": 12.35, "seq": 41, "position": {"x": 51200, "y": 3840},
+     "rate": {"x": 6400.0, "y": 0.0}, "moving": {"x": "move", "y": null},
+     "endstop": {"x": false, "y": false}, "pump": 1.0, "servo": null,
+     "phase": ["spray", "move-to-sponge"], "busy": true}
+
+position is in 1/32 microsteps from home and includes the steps of running
+trains, rate is the current speed in 1/32 microsteps per second whatever the
+microstep mode of the train, moving the kind of the
+running train (jog, continuous, move, backoff, home) and phase the cycle
+phases that run right now.
+
+Nothing is pushed from the step path: the publisher samples the motion
+controller, the pump and the servo at most RATE times per second and only
+sends a sample when something changed. Every subscriber has a single slot
+that the next sample overwrites, so a slow subscriber skips samples instead of
+queueing them, and the publisher never waits for a subscriber.
+
+Usage:
+    python -m motor_control.telemetry
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+from bisect import bisect_right
+from itertools import accumulate
+
+from . import clock, manual_control
+from .motion_controller import AWAY_FROM_MIN
+
+TELEMETRY_PATH = "/tmp/biomim_8_telemetry.sock"
+
+# Samples per second at most
+RATE = 20
+
+# Cycle phases running right now, maintained by the cycle engine
+phases = []
+
+
+def phase_started(name):
+    phases.append(name)
+
+
+def phase_ended(name):
+    try:
+        phases.remove(name)
+    except ValueError:
+        pass
+
+
+class TelemetryServer:
+    """
+    Samples the rig and streams changed samples to the subscribers of path.
+
+    :param service: optional WashService, its busy state is included
+    :param path: Unix socket path
+    :param rate: samples per second at most
+    """
+
+    def __init__(self, service=None, path=TELEMETRY_PATH, rate=RATE):
+        self.service = service
+        self.path = path
+        self.rate = rate
+        self.seq = 0
+        self.skipped = 0  # samples overwritten before a slow subscriber took them
+        self._server = None
+        self._sampler = None
+        self._subscribers = set()
+        self._line = None  # the last sample, a new subscriber starts with it
+        self._elapsed = {}  # id(train) -> (train, cumulative periods)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over from a crashed process
+        self._server = await asyncio.start_unix_server(self._client, self.path)
+        os.chmod(self.path, 0o660)
+        self._sampler = asyncio.create_task(self._sample_loop())
+        return self._server
+
+    def close(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+        if self._server is not None:
+            self._server.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    # ----- Sampling -----
+
+    def sample(self):
+        """The current state of the rig as a dict, without t and seq"""
+        controller = manual_control.controller
+        state = {"position": None, "rate": None, "moving": None, "endstop": None}
+        if controller is not None:
+            now = clock.monotonic()
+            position = controller.tracker.positions()
+            rate = dict.fromkeys(position, 0.0)
+            moving = dict.fromkeys(position)
+            active = controller.active()  # the step path never waits for telemetry
+            for axis, entry in active.items():
+                if entry is None:
+                    continue
+                train, direction, kind, units = entry
+                done, period = self._progress(train, now)
+                done *= units
+                position[axis] += done if direction == AWAY_FROM_MIN else -done
+                rate[axis] = round(units / period, 1) if period else 0.0
+                moving[axis] = kind
+            self._forget(active)
+            state.update(
+                position=position,
+                rate=rate,
+                moving=moving,
+                endstop={axis: event.is_set() for axis, event in controller.min_pressed.items()},
+            )
+        state["pump"] = _value(manual_control.pump1)
+        state["servo"] = _value(manual_control.servo)
+        state["phase"] = list(phases)
+        state["busy"] = self.service.busy() if self.service is not None else None
+        return state
+
+    def _progress(self, train, now):
+        """(steps output so far, current period) of a running train, estimated from its start"""
+        if train.started_at is None:
+            return 0, None
+        key = id(train)
+        cached = self._elapsed.get(key)
+        if cached is None or cached[0] is not train:
+            cached = self._elapsed[key] = (train, list(accumulate(train.periods)))
+        ends = cached[1]
+        elapsed = now - train.started_at - train.delay
+        if elapsed < 0:
+            return 0, None
+        done = bisect_right(ends, elapsed)
+        if done >= len(ends):
+            return len(ends), None
+        return done, train.periods[done]
+
+    def _forget(self, active):
+        running = {id(entry[0]) for entry in active.values() if entry is not None}
+        for key in [key for key in self._elapsed if key not in running]:
+            del self._elapsed[key]
+
+    async def _sample_loop(self):
+        interval = 1.0 / self.rate
+        last = None
+        while True:
+            state = self.sample()
+            if state != last:
+                last = state
+                self.seq += 1
+                message = dict(state, t=round(clock.monotonic(), 3), seq=self.seq)
+                self._line = (json.dumps(message) + "\n").encode()
+                for subscriber in self._subscribers:
+                    if subscriber.pending is not None:
+                        self.skipped += 1
+                    subscriber.pending = self._line
+                    subscriber.wake.set()
+            await clock.async_sleep(interval)
+
+    # ----- Subscribers -----
+
+    async def _client(self, reader, writer):
+        subscriber = _Subscriber()
+        subscriber.pending = self._line
+        self._subscribers.add(subscriber)
+        closed = asyncio.create_task(reader.read())  # subscribers send nothing, EOF means gone
+        try:
+            while not closed.done():
+                woken = asyncio.create_task(subscriber.wake.wait())
+                await asyncio.wait({woken, closed}, return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                subscriber.wake.clear()
+                line, subscriber.pending = subscriber.pending, None
+                if line is not None:
+                    writer.write(line)
+                    await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # gone, or the loop is shutting down with the subscriber connected
+        finally:
+            self._subscribers.discard(subscriber)
+            closed.cancel()
+            writer.close()
+
+
+class _Subscriber:
+    """Latest unsent sample of one subscriber"""
+
+    def __init__(self):
+        self.pending = None
+        self.wake = asyncio.Event()
+
+
+def _value(device):
+    """value of a gpiozero device, None if there is none or it is detached"""
+    if device is None:
+        return None
+    try:
+        value = device.value
+    except Exception:
+        return None
+    return None if value is None else round(float(value), 3)
+
+
+# =================== Client ===================
+
+
+def subscribe(path=TELEMETRY_PATH):
+    """Yields the samples of a TelemetryServer as dicts, blocking"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile("rb") as lines:
+            for line in lines:
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the rig's live telemetry")
+    parser.add_argument("--socket", default=TELEMETRY_PATH)
+    parser.add_argument("--json", action="store_true", help="print the raw samples")
+    args = parser.parse_args(argv)
+
+    try:
+        for sample in subscribe(args.socket):
+            if args.json:
+                print(json.dumps(sample))
+                continue
+            position, rate = sample["position"] or {}, sample["rate"] or {}
+            axes = "  ".join(
+                f"{axis}={position[axis]:>7} {rate.get(axis, 0):>7.0f}/s{' E' if sample['endstop'][axis] else ''}"
+                for axis in sorted(position)
+            )
+            print(f"{sample['t']:>9.2f}  {axes}  pump={sample['pump']} servo={sample['servo']}  {','.join(sample['phase'])}")
+    except OSError as e:
+        print(f"Telemetry not reachable at {args.socket}: {e}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
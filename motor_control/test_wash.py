@@ -5,75 +5,80 @@ import os
 # Add parent directory to path so we can import 'motor_control' package
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import json
 from motor_control import manual_control
-from motor_control.calibrate import move_to_home, reset_manual_state
-from motor_control.manual_control import (
-    initialize_motors,
-    pump_one_forward,
-    rotate_sponge,
-    move_to_position,
-)
-from motor_control.DRV8825 import DRV8825
-import time
-import serial
+from motor_control.manual_control import initialize_motors
+from motor_control.cycle_engine import de_energise, wash_cycle
 from datetime import datetime
-import threading
-from gpiozero import Button, Device
-from gpiozero.pins.rpigpio import RPiGPIOFactory
-import signal
+import asyncio
+from motor_control.cycle_timer import CycleTimer
+from motor_control.recipe import RECIPE_PATH, RecipeError, compile_recipe, load_recipe
+from motor_control.run_history import RunHistory
+from motor_control.calibration_store import get_store as get_calibration_store
+from motor_control.position_journal import get_journal
 
-# Set pin factory at the very top
-Device.pin_factory = RPiGPIOFactory()
+# Record per-phase durations and step counts of every cycle
+TIMING_ENABLED = True
 
-# Global lock to prevent concurrent demo runs
-is_running = False
+# Skip homing while the position journal trusts the position, see position_journal.py
+JOURNAL_ENABLED = True
 
-# Graceful shutdown event
-shutdown_event = threading.Event()
+# Run history, opened on the first logged cycle
+run_history = None
 
-def handle_shutdown(signum, frame):
-    print(f"Received signal {signum}, shutting down.")
-    shutdown_event.set()
+def get_run_history():
+    """The RunHistory cycles are logged to, opened once per process"""
+    global run_history
 
-signal.signal(signal.SIGINT, handle_shutdown)
-signal.signal(signal.SIGTERM, handle_shutdown)
+    if run_history is None:
+        run_history = RunHistory()
+    return run_history
 
 # ===================== Calibration Data Retrieval =====================
 
-def get_calibrated_postion(json_file: str):
+def get_calibrated_positions():
     """
-    Retrieves earlier calibrated position
+    Retrieves all calibrated positions from the calibration store as a dict name -> (x, y).
+    Returns None if the calibration file cannot be read.
     """
+    store = get_calibration_store()
     try:
-        with open(json_file, "r") as fp:
-            coords = json.load(fp)
-            calibrated_x = int(coords["end_position_x"])
-            calibrated_y = int(coords["end_position_y"])
+        return {name: (point["x"], point["y"]) for name, point in store.positions().items()}
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Error reading calibration: {e}")
+    return None
 
-    except FileNotFoundError:
-        print(f"Error: {json_file} not found.")
-        return None, None
 
-    except json.JSONDecodeError:
-        print("Error decoding JSON data.")
-        return None, None
+def get_position_journal():
+    """The PositionJournal of the rig, None if JOURNAL_ENABLED is off"""
+    return get_journal() if JOURNAL_ENABLED else None
 
-    except KeyError as e:
-        print(f"Missing key in JSON data: {e}")
-        return None, None
 
-    return calibrated_x, calibrated_y
+def get_wash_plan(path=RECIPE_PATH, homing="always"):
+    """
+    Loads the wash recipe and compiles it against the calibrated positions.
+    Returns None if the calibration or the recipe is invalid.
+
+    :param homing: how the home steps run, see recipe.HOMING_MODES
+    """
+    positions = get_calibrated_positions()
+    if positions is None:
+        return None
+    try:
+        return compile_recipe(load_recipe(path), positions, homing)
+    except (OSError, RecipeError) as e:
+        print(f"Invalid wash recipe: {e}")
+    return None
 
 
-# ===================== Wash Cycle =====================
+# ===================== Rig Setup =====================
 
-def demo():
+def init_rig():
     """
-    Performs one washing cycle and logs to json
+    Initializes motors, pump, servo and endstops and starts the motion controller.
+    Returns the handles release_rig needs.
     """
-    global is_running
-    
+    manual_control.set_pin_factory()
+
     # Initialize motors
     Motor1, Motor2, pump1 = initialize_motors()
     manual_control.Motor1 = Motor1
@@ -81,165 +86,179 @@ def demo():
     manual_control.pump1 = pump1
 
     # Initialize servo
+    manual_control.servo = manual_control.initialize_servo()
+
+    # Initialize endstops
+    y_min, x_min = manual_control.initialize_endstops()
+
+    manual_control.running = True
+
+    # Start motion controller thread
+    controller = manual_control.start_motion_controller()
+
+    # Continue from the journalled position if it can be trusted
+    journal = get_position_journal()
+    if journal is not None:
+        journal.attach(controller)
+
+    return Motor1, Motor2, y_min, x_min
+
+
+def release_rig(handles):
+    """
+    Stops the motion controller and closes the pins opened by init_rig.
+    Returns False if something could not be stopped or released.
+    """
+    Motor1, Motor2, y_min, x_min = handles
+    manual_control.running = False
+
+    journal = get_position_journal()
+    if journal is not None and journal.controller is manual_control.controller:
+        journal.checkpoint()
+        journal.close()
+
+    released = True
+
+    # Safely stop motors
     try:
-        manual_control.servo = manual_control.Servo(26)
-        manual_control.servo.detach() 
+        manual_control.stop_motion_controller()
     except Exception as e:
-        print(f"Servo init failed: {e}")
-        manual_control.servo = None
+        print(f"Error stopping motors: {e}")
+        released = False
 
-    # Initialize endstops
-    y_min = Button(manual_control.Y_MIN_PIN, pull_up=False)
-    x_min = Button(manual_control.X_MIN_PIN, pull_up=True)
+    # Clean up GPIO pins
+    try:
+        if y_min: y_min.close()
+        if x_min: x_min.close()
+        # Close pump and servo too, the next init_rig creates them again
+        if manual_control.pump1: manual_control.pump1.close()
+        if manual_control.servo: manual_control.servo.close()
+
+        # The driver pins are plain BCM numbers, released through GPIO and the pulse backend
+        Motor1.Close()
+        Motor2.Close()
+    except Exception as e:
+        print(f"Error cleaning up GPIO: {e}")
+        released = False
+    return released
 
-    y_min.when_pressed = manual_control.on_y_min_pressed
-    y_min.when_released = manual_control.on_y_min_released
 
-    x_min.when_pressed = manual_control.on_x_min_pressed
-    x_min.when_released = manual_control.on_x_min_released
+# ===================== Wash Cycle =====================
 
-    manual_control.running = True
+def run_cycle(record=True, timing=None, extra=None, result=None):
+    """
+    Performs one washing cycle on an initialized rig and logs it to the run history.
+    Runs run_cycle_async on a new event loop.
 
-    # Start motor control loop thread
-    motor_thread = threading.Thread(
-        target=manual_control.motor_control_loop, daemon=True
-    )
-    motor_thread.start()
+    :return: the CycleTimer of the cycle
+    """
+    return asyncio.run(run_cycle_async(record, timing, extra, result=result))
 
-    # Give thread time to start
-    time.sleep(0.1)
 
+async def run_cycle_async(record=True, timing=None, extra=None, recipe_path=RECIPE_PATH, result=None):
+    """
+    Performs one washing cycle on an initialized rig and logs it to the run history.
+    Cancelling it stops the rig right away.
+
+    :param record: False to leave the run out of the run history, e.g. for simulated runs
+    :param timing: record per-phase timing, defaults to TIMING_ENABLED
+    :param extra: dict of additional fields for the run record, read when the cycle ends
+    :param recipe_path: wash recipe to run, read every cycle
+    :param result: dict that receives the run record, also when record is False
+    :return: the CycleTimer of the cycle
+    """
     start = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timer = CycleTimer(
+        enabled=TIMING_ENABLED if timing is None else timing,
+        step_counter=manual_control.steps_executed,
+    )
+    outcome = "completed"
+    predicted = None
+    homing = None
 
     try:
-        move_to_home()
-
-        # --- FIX: USE ABSOLUTE PATH ---
-        # This finds the directory where THIS script is located
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        # This joins the directory with the filename
-        json_path = os.path.join(script_dir, "calibration_info.json")
-        house_json_path = os.path.join(script_dir, "calibration_house.json")
-        
-        print(f"Looking for calibration file at: {json_path}") # Debug print
-
-        calibrated_x, calibrated_y = get_calibrated_postion(json_path)
-        calibrated_x_house, calibrated_y_house = get_calibrated_postion(house_json_path)
-
-        if calibrated_x is None or calibrated_y is None:
-            print("Calibration data is invalid.")
-            return
-
-        move_to_position(0, calibrated_y)  # Move to spray position
-        pump_one_forward(duration=10)
-        move_to_position(calibrated_x, 0)
-        time.sleep(5)
-        rotate_sponge()
-        move_to_position(-calibrated_x, 0)  # Move back to spray
-        pump_one_forward(duration=10)
-        move_to_home()
-        move_to_position(calibrated_x_house, calibrated_y_house)  # Move to house position
+        # Home once at the start unless the journal trusts the position
+        journal = get_position_journal()
+        homing = "always"
+        if journal is not None:
+            reason = journal.homing_reason()
+            if reason is not None:
+                print(f"Homing this cycle: {reason}")
+                homing = "first"
+            else:
+                homing = "never"
+
+        plan = get_wash_plan(recipe_path, homing)
+        if plan is None:
+            print("Calibration data or wash recipe is invalid.")
+            outcome = "invalid recipe"
+            return timer
+
+        predicted = plan.duration
+        await wash_cycle(plan, timer, journal)
+        if journal is not None:
+            journal.cycle_done()
+
+    except asyncio.CancelledError:
+        print("Wash cycle cancelled, actuators stopped")
+        outcome = "cancelled"
+        raise
 
     except Exception as e:
         print(f"Error during demo: {e}")
-        
+        outcome = f"error: {e}"
+        # Leave the actuators off
+        de_energise()
+
     finally:
-        # --- CLEANUP & UNLOCK ---
-        manual_control.running = False
-
-        # Safely stop motors
-        try:
-            if "Motor1" in locals(): Motor1.Stop()
-            if "Motor2" in locals(): Motor2.Stop()
-        except Exception as e:
-            print(f"Error stopping motors: {e}")
-
-        # Clean up GPIO pins
-        try:
-            if "Motor1" in locals() and hasattr(Motor1, "dir_pin") and Motor1.dir_pin:
-                Motor1.dir_pin.close()
-            if "Motor1" in locals() and hasattr(Motor1, "step_pin") and Motor1.step_pin:
-                Motor1.step_pin.close()
-            if "Motor1" in locals() and hasattr(Motor1, "enable_pin") and Motor1.enable_pin:
-                Motor1.enable_pin.close()
-
-            if "Motor2" in locals() and hasattr(Motor2, "dir_pin") and Motor2.dir_pin:
-                Motor2.dir_pin.close()
-            if "Motor2" in locals() and hasattr(Motor2, "step_pin") and Motor2.step_pin:
-                Motor2.step_pin.close()
-            if "Motor2" in locals() and hasattr(Motor2, "enable_pin") and Motor2.enable_pin:
-                Motor2.enable_pin.close()
-
-            if y_min: y_min.close()
-            if x_min: x_min.close()
-        except Exception as e:
-            print(f"Error cleaning up GPIO: {e}")
-
-        # Logging - Use Absolute Path here as well to be safe
+        # Logging - one appended row in the run history
         end = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        try:
-            # Determine path for logging.json (assumed to be in same folder as script)
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            log_path = os.path.join(script_dir, "logging.json")
-            
+        entry = {"start_time": start, "end_time": end, "outcome": outcome}
+        if predicted is not None:
+            entry["predicted_duration"] = round(predicted, 2)
+        if homing is not None:
+            entry["homing"] = homing
+        entry.update(extra or {})
+        timing_record = timer.record()
+        if timing_record is not None:
+            entry["timing"] = timing_record
+        if result is not None:
+            result.update(entry)
+        if record:
             try:
-                with open(log_path, "r") as fp:
-                    logs = json.load(fp)
-            except (FileNotFoundError, json.JSONDecodeError):
-                logs = []
-            
-            logs.append({"start_time": start, "end_time": end})
-            
-            with open(log_path, "w") as fp:
-                json.dump(logs, fp, indent=2)
-        except Exception as e:
-            print(f"Error logging data: {e}")
-
-        # Unlock allows the button to be pressed again
-        is_running = False
-
+                get_run_history().append(entry)
+            except Exception as e:
+                print(f"Error logging data: {e}")
 
-# --- Button setup and main loop ---
-def main():
-    # Configure button on GPIO23 (wired to GND)
-    try:
-        button = Button(23, pull_up=True, bounce_time=0.01)
-        print("Button initialized on GPIO23")
-    except Exception as e:
-        print(f"Failed to initialize button: {e}")
-        return
+        if timer.phases:
+            print(timer.summary())
+            if predicted is not None:
+                print(f"Recipe predicted {predicted:.2f} s")
 
-    def on_button_pressed():
-        global is_running
-        
-        if is_running:
-            print("Wash already in progress. Ignoring press.")
-            return
+    return timer
 
-        print("Button pressed! Starting demo thread...")
-        
-        is_running = True 
-        demo_thread = threading.Thread(target=demo)
-        demo_thread.start()
 
-    button.when_pressed = on_button_pressed
-    print("Button callback registered. Waiting for presses...")
+def demo(record=True, timing=None):
+    """
+    Initializes the rig, performs one washing cycle and releases the rig again.
+    The resident WashService keeps the rig initialized between cycles instead.
 
+    :return: the CycleTimer of the cycle
+    """
+    handles = init_rig()
     try:
-        while not shutdown_event.is_set():
-            shutdown_event.wait(1)
-    except KeyboardInterrupt:
-        print("KeyboardInterrupt received, shutting down.")
-        shutdown_event.set()
+        return run_cycle(record, timing)
+    finally:
+        release_rig(handles)
 
-    try:
-        import motor_control.manual_control as manual_control
-        manual_control.running = False
-    except Exception:
-        pass
 
-    print("Exiting now.")
+# --- Button setup and main loop ---
+def main():
+    # The button runs cycles on the resident wash service, the rig stays initialized between presses
+    from motor_control.wash_service import main as wash_service_main
+
+    wash_service_main()
     sys.exit(0)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
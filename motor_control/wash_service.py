@@ -0,0 +1,304 @@
+"""
+Resident wash service.
+
+The rig (motors, pump, servo, endstops, motion controller) is initialized
+once when the service starts and stays initialized between cycles. Cycles
+run on an asyncio event loop that is started up front and idles until a
+wash is requested, so a button press only has to wake it.
+
+main() also serves the local command API (command_api.py) and the live
+telemetry (telemetry.py) on the same loop.
+
+For every cycle the latency from the press to the first step pulse train is
+measured, printed and stored in the run record as press_to_first_step.
+
+Usage (the button daemon of wash_button.service):
+    python -m motor_control.wash_service
+"""
+import asyncio
+import os
+import signal
+import socket
+import threading
+
+from . import clock, manual_control
+
+BUTTON_PIN = 23  # wired to GND
+
+
+def sd_notify(state):
+    """
+    Sends state (e.g. "READY=1") to systemd when started by a Type=notify unit.
+    Does nothing outside systemd.
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"):
+        address = "\0" + address[1:]  # abstract socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+        return True
+    except OSError as e:
+        print(f"sd_notify failed: {e}")
+        return False
+
+
+class WashService:
+    """
+    Keeps the rig initialized and runs wash cycles on one asyncio event loop.
+
+    serve() is the loop's main coroutine: it initializes the rig, then runs a
+    cycle for every request. start() runs serve() on a background thread for
+    callers that are not asyncio based. request_wash() and cancel_cycle()
+    can be called from any thread, e.g. gpiozero callbacks.
+
+    A cycle and motion outside cycles (the command API) exclude each other:
+    both hold the busy lock while the rig moves, see claim().
+
+    :param record: log cycles to the run history
+    :param log: function(message) used for status messages
+    """
+
+    def __init__(self, record=True, log=print):
+        self.record = record
+        self.log = log
+        self.latencies = []  # press to first step of every cycle, seconds
+        self.cycles = 0
+        self._loop = None
+        self._requests = None
+        self._cycle = None  # asyncio task of the running cycle
+        self._thread = None
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._busy = threading.Lock()
+        self._error = None
+
+    # ----- Lifecycle -----
+
+    def start(self):
+        """Runs serve() on a background thread and returns once the rig is ready"""
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.serve()), name="wash-service", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    async def serve(self, handle_signals=False):
+        """
+        Initializes the rig and runs requested cycles until stop().
+
+        :param handle_signals: cancel the running cycle and stop on SIGTERM/SIGINT,
+            only possible when the loop runs on the main thread
+        """
+        from .test_wash import init_rig, release_rig
+
+        self._loop = asyncio.get_running_loop()
+        self._requests = asyncio.Queue()
+        started = clock.monotonic()
+        try:
+            handles = init_rig()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            raise
+        if handle_signals:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                self._loop.add_signal_handler(sig, self._shutdown)
+        self.log(f"Wash service ready, rig initialized in {clock.monotonic() - started:.2f} s")
+        self._ready.set()
+
+        try:
+            while True:
+                request = await self._requests.get()
+                if request is None:
+                    break
+                self._cycle = asyncio.create_task(self._run_cycle(*request))
+                try:
+                    await self._cycle
+                except asyncio.CancelledError:
+                    if asyncio.current_task().cancelling():
+                        raise
+        finally:
+            release_rig(handles)
+
+    async def wait_ready(self, serving):
+        """
+        Waits until serving, the task running serve(), has the rig ready.
+        Raises the error if the rig could not be initialized.
+        """
+        while not self._ready.is_set():
+            await asyncio.sleep(0.01)
+        if self._error is not None:
+            await serving
+
+    def stop(self, timeout=None):
+        """
+        Stops the service and releases the rig. A running cycle is cancelled,
+        which stops all actuators right away.
+        """
+        self._stopping.set()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._shutdown)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _shutdown(self):
+        self._stopping.set()
+        self._cancel_cycle()
+        self._requests.put_nowait(None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ----- Requests -----
+
+    def busy(self):
+        return self._busy.locked()
+
+    def claim(self):
+        """
+        Takes the rig for motion outside a cycle without blocking. Returns
+        False if a cycle is running or requested, or the rig is claimed
+        already. While claimed, request_wash() refuses. Give the rig back with
+        unclaim() once the motion ended.
+        """
+        return not self._stopping.is_set() and self._busy.acquire(blocking=False)
+
+    def unclaim(self):
+        self._busy.release()
+
+    def request_wash(self, on_done=None):
+        """
+        Requests a wash cycle without blocking. Returns False if a cycle is
+        already running or requested, or the rig is claimed for other motion.
+
+        :param on_done: called with the run record once the cycle ended, on the service's loop
+        """
+        if self._stopping.is_set() or self._loop is None or not self._busy.acquire(blocking=False):
+            return False
+        self._loop.call_soon_threadsafe(self._requests.put_nowait, (clock.monotonic(), on_done))
+        return True
+
+    def cancel_cycle(self):
+        """Cancels the running cycle, the rig stops where it is"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel_cycle)
+
+    def _cancel_cycle(self):
+        if self._cycle is not None and not self._cycle.done():
+            self._cycle.cancel()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until no cycle is running. Returns False on timeout."""
+        if not self._busy.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        self._busy.release()
+        return True
+
+    # ----- Cycles -----
+
+    async def _run_cycle(self, pressed_at, on_done=None):
+        from .test_wash import run_cycle_async
+
+        extra = {}
+        run = {}
+
+        def first_step(t):
+            extra["press_to_first_step"] = round(t - pressed_at, 4)
+
+        manual_control.controller.notify_next_start(first_step)
+        try:
+            manual_control.running = True
+            await run_cycle_async(record=self.record, extra=extra, result=run)
+        except Exception as e:
+            self.log(f"Wash cycle failed: {e}")
+            run.setdefault("outcome", f"error: {e}")
+        finally:
+            self.cycles += 1
+            latency = extra.get("press_to_first_step")
+            if latency is not None:
+                self.latencies.append(latency)
+                self.log(f"Cycle {self.cycles}: press to first step {latency * 1000:.1f} ms")
+            self._busy.release()
+            self.log("Wash finished. Ready for next press.")
+            if on_done is not None:
+                run.setdefault("outcome", "cancelled")
+                try:
+                    on_done(run)
+                except Exception as e:
+                    self.log(f"Wash done callback failed: {e}")
+
+
+def main():
+    """
+    Button daemon: waits for presses on BUTTON_PIN and runs a cycle per press.
+    SIGTERM cancels a running cycle, which stops the rig, and exits.
+    """
+    from gpiozero import Button
+
+    from .calibration_store import reload_on_sighup
+    from .command_api import CommandServer
+    from .telemetry import TelemetryServer
+
+    manual_control.set_pin_factory()
+    reload_on_sighup()
+
+    service = WashService()
+
+    async def run():
+        serving = asyncio.create_task(service.serve(handle_signals=True))
+        await service.wait_ready(serving)
+
+        try:
+            button = Button(BUTTON_PIN, pull_up=True, bounce_time=0.01)
+            print(f"Button initialized on GPIO{BUTTON_PIN}")
+        except Exception as e:
+            print(f"Failed to initialize button: {e}")
+            service._shutdown()
+            await serving
+            return
+
+        def on_button_pressed():
+            if not service.request_wash():
+                print("Wash already in progress. Ignoring press.")
+                return
+            print("Button pressed! Starting wash...")
+
+        button.when_pressed = on_button_pressed
+        print("Button callback registered. Waiting for presses...")
+
+        # Jogging, calibration and automation without an SSH terminal
+        commands = CommandServer(service)
+        try:
+            await commands.start()
+            print(f"Command API on {commands.path}")
+        except OSError as e:
+            print(f"Command API not available: {e}")
+        telemetry = TelemetryServer(service)
+        try:
+            await telemetry.start()
+            print(f"Telemetry on {telemetry.path}")
+        except OSError as e:
+            print(f"Telemetry not available: {e}")
+        sd_notify("READY=1")
+
+        try:
+            await serving
+        finally:
+            sd_notify("STOPPING=1")
+            commands.close()
+            telemetry.close()
+            button.close()
+
+    asyncio.run(run())
+    print("Exiting now.")
+
+
+if __name__ == "__main__":
+    main()